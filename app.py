@@ -1,18 +1,41 @@
 import os
-from flask import Flask, request, jsonify, send_from_directory
+import io
+import time
+from flask import Flask, Request, request, jsonify, send_from_directory, g, Response
 from flask_cors import CORS
 from pathlib import Path
 import json
+import numpy as np
 from werkzeug.utils import secure_filename
 import sys
+from utils.metrics import metrics, HTTP_SECONDS, SEARCH_SECONDS
+from utils.serialization import dumps
 
 # Set up error handling for module imports
 try:
     # Import our modules
-    from models.image_embedder import embedder
+    from models.image_embedder import embedder, embed_probe_image
     from models.index import image_index
+    from models.labels import label_vocabulary
     from database.db import db
     from utils.image_processor import image_processor
+    from utils.jobs import job_queue, QUEUED, RUNNING
+    from utils.reconciler import reconciler
+    from utils.collection_manager import collection_manager, CollectionNotFound, DEFAULT_COLLECTION
+    from utils.watcher import upload_watcher, WATCH_UPLOADS
+    from utils.query_log import query_log
+    from utils.warmup import warmer
+    from database.keyword_index import reciprocal_rank_fusion
+    from models.rerank import RERANKERS
+    from werkzeug.local import LocalProxy
+    
+    # Routes and job handlers work on the collection selected for the
+    # request or job (see select_collection); the default one otherwise
+    image_index = LocalProxy(lambda: collection_manager.current().index)
+    db = LocalProxy(lambda: collection_manager.current().db)
+    image_processor = LocalProxy(lambda: collection_manager.current().processor)
+    reconciler = LocalProxy(lambda: collection_manager.current().reconciler)
+    model_migration = LocalProxy(lambda: collection_manager.current().migration)
     
     MODULES_LOADED = True
 except ImportError as e:
@@ -20,12 +43,35 @@ except ImportError as e:
     print("Please install the required dependencies with: python setup.py")
     MODULES_LOADED = False
 
+class AppRequest(Request):
+    # Paths whose uploaded files are only read, never saved
+    IN_MEMORY_UPLOADS = ('/api/search/by-image',)
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        """Keep query images in memory; werkzeug spools large uploads to a temp file"""
+        if self.path in self.IN_MEMORY_UPLOADS:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 app = Flask(__name__, static_folder='static')
+app.request_class = AppRequest
 CORS(app)
 
 # Configuration
 UPLOAD_FOLDER = os.path.join(app.static_folder, 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+SEARCH_MODES = ('vector', 'hybrid')
+
+# Database fields that can be joined onto search results ('db_id' is the
+# database id used by /api/images/<id>)
+RESULT_FIELDS = ('db_id', 'favorites', 'tags', 'description', 'uploaded_at', 'metadata')
+DEFAULT_RESULT_FIELDS = ('db_id', 'favorites', 'tags', 'description')
+
+# Minimum number of results taken from each retriever before fusing
+HYBRID_DEPTH = 50
+
+# Seconds between scheduled index/database reconciliations (0 disables them)
+RECONCILE_INTERVAL = int(os.environ.get('RECONCILE_INTERVAL', 0))
 
 # Create necessary directories
 Path(UPLOAD_FOLDER).mkdir(parents=True, exist_ok=True)
@@ -37,6 +83,190 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Background job handlers
+def run_upload_job(job, file_path):
+    """Embed and index an uploaded image"""
+    result = image_processor.process_upload(file_path)
+    if not result:
+        raise RuntimeError('Failed to process image')
+    return result
+
+def run_upload_batch_job(job, file_paths):
+    """Embed and index several uploaded images with one index and database save"""
+    results = image_processor.process_images(file_paths, progress=job.update_progress, remove_failed=True)
+    processed = [result for result in results if result]
+    if not processed:
+        raise RuntimeError('Failed to process images')
+    failed = [image_processor.relative_path(path) for path, result in zip(file_paths, results) if not result]
+    return {'images': processed, 'failed': failed}
+
+def run_batch_import_job(job, directory):
+    """Import all images from a directory on the server"""
+    processed, failed = image_processor.batch_process_directory(directory, progress=job.update_progress)
+    return {'processed': processed, 'failed': failed}
+
+def run_reindex_job(job):
+    """Rebuild the index from the uploads folder"""
+    count = image_index.rebuild_index(image_processor.upload_dir, progress=job.update_progress,
+                                      path_root=image_processor.path_root)
+    
+    # Fit the default clustering now so /api/clusters stays a cache read
+    image_index.get_semantic_clusters()
+    
+    # Positions changed, so the neighbour graph must be recomputed
+    image_index.build_neighbor_graph()
+    return {'count': count}
+
+def run_neighbors_job(job):
+    """Precompute the neighbour lists used for "similar images" searches"""
+    return {'count': image_index.build_neighbor_graph(progress=job.update_progress)}
+
+def run_autotag_job(job, overwrite=False, batch_size=1024):
+    """Zero-shot tag images in the database from their indexed embeddings"""
+    images = [image for image in db.get_all_images() if overwrite or not image.get('tags')]
+    updates = {}
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        with image_index.lock:
+            positions = image_index.positions_for_paths([image['path'] for image in batch])
+            found = [i for i, position in enumerate(positions) if position >= 0]
+            embeddings = image_index.image_embeddings[positions[found]] if found else None
+        if found:
+            for i, tags in zip(found, image_index.labels.tag(embeddings)):
+                updates[batch[i]['id']] = {'tags': tags}
+        job.update_progress(min(start + batch_size, len(images)), len(images))
+    
+    return {'tagged': db.update_images(updates), 'skipped': len(images) - len(updates)}
+
+def run_reconcile_job(job, dry_run=False):
+    """Repair differences between the uploads folder, the database and the index"""
+    return reconciler.reconcile(dry_run=dry_run, progress=job.update_progress)
+
+def run_migrate_model_job(job, model_name, batch_size=32, rate=None):
+    """Re-embed the collection with another model and switch to it"""
+    summary = model_migration.run(model_name, batch_size=batch_size, rate=rate, progress=job.update_progress)
+    
+    # Clusters and neighbour lists were dropped with the old vectors
+    image_index.get_semantic_clusters()
+    image_index.build_neighbor_graph()
+    return summary
+
+def in_collection(handler):
+    """Wrap a job handler so it runs against the collection it was submitted for"""
+    def run(job, collection=None, **params):
+        with collection_manager.use(collection):
+            return handler(job, **params)
+    run.__doc__ = handler.__doc__
+    return run
+
+def submit_job(job_type, **params):
+    """Queue a job for the collection selected by the current request"""
+    collection = collection_manager.current().name
+    if collection != DEFAULT_COLLECTION:
+        params['collection'] = collection
+    return job_queue.submit(job_type, **params)
+
+def requested_collection(headers, args):
+    """Collection named by the X-Collection header or ?collection=, if any"""
+    return headers.get('X-Collection') or args.get('collection') or None
+
+def run_in_collection(name, fn, *args, **kwargs):
+    """Call fn with a collection selected; used for work handed to other threads"""
+    with collection_manager.use(name):
+        return fn(*args, **kwargs)
+
+def json_response(payload, status=200):
+    """JSON response serialised with the fast encoder"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+def job_accepted(job, **extra):
+    """Build the 202 response returned when a job has been queued"""
+    response = {
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/api/jobs/{job['id']}"
+    }
+    response.update(extra)
+    return jsonify(response), 202
+
+if MODULES_LOADED:
+    metrics.gauge('index_size', 'Number of vectors in the search index',
+                  fn=lambda: image_index.index.ntotal if image_index.index is not None else 0)
+    metrics.gauge('index_embeddings_bytes', 'Memory held by the cached image embeddings in bytes',
+                  fn=lambda: image_index.image_embeddings.nbytes if image_index.image_embeddings is not None else 0)
+    metrics.gauge('database_images', 'Number of images in the database',
+                  fn=lambda: len(db.get_all_images()))
+    
+    job_queue.register('upload', in_collection(run_upload_job), lane='interactive')
+    job_queue.register('upload_batch', in_collection(run_upload_batch_job), lane='interactive')
+    job_queue.register('batch_import', in_collection(run_batch_import_job))
+    job_queue.register('reindex', in_collection(run_reindex_job))
+    job_queue.register('autotag', in_collection(run_autotag_job))
+    job_queue.register('neighbors', in_collection(run_neighbors_job))
+    job_queue.register('reconcile', in_collection(run_reconcile_job))
+    job_queue.register('migrate_model', in_collection(run_migrate_model_job))
+    if RECONCILE_INTERVAL > 0:
+        job_queue.schedule('reconcile', RECONCILE_INTERVAL)
+
+@app.before_request
+def start_job_workers():
+    """Start the job workers in the process that actually serves requests.
+
+    Starting them at import time would also start them in the debug
+    reloader's parent process, which never serves requests.
+    """
+    if MODULES_LOADED:
+        start_background_workers()
+
+def start_background_workers():
+    """Start the job workers, the warmer and, with WATCH_UPLOADS set, the upload watcher.
+
+    The watcher only runs in the process that runs jobs, so one process
+    indexes each change.
+    """
+    warmer.start()
+    job_queue.start()
+    if WATCH_UPLOADS and job_queue.role == 'runner':
+        upload_watcher.start()
+
+@app.before_request
+def select_collection():
+    """Make the collection named by X-Collection or ?collection= current for this request"""
+    name = requested_collection(request.headers, request.args)
+    if not MODULES_LOADED or not name:
+        return None
+    try:
+        g.collection = collection_manager.use(name)
+        g.collection.__enter__()
+    except CollectionNotFound:
+        g.collection = None
+        return jsonify({'error': f"Collection not found: {name}"}), 404
+
+@app.teardown_request
+def release_collection(exc):
+    collection = g.pop('collection', None)
+    if collection is not None:
+        collection.__exit__(None, None, None)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Record request latency by route pattern (not raw path, to bound cardinality)"""
+    start = g.get('request_start')
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get the status of the system"""
@@ -45,38 +275,66 @@ def get_status():
             'status': 'error',
             'message': 'Required modules not loaded. Please check the server logs.'
         }), 500
-        
+    
+    # Load balancers should hold traffic back until the caches are warm
     return jsonify({
-        'status': 'ok',
+        'status': 'ok' if warmer.ready else 'warming',
+        'ready': warmer.ready,
+        'warmup': warmer.status()['last'],
         'embedder': embedder.model is not None,
         'index_size': image_index.index.ntotal if hasattr(image_index, 'index') else 0,
-        'image_count': len(db.get_all_images())
-    })
+        'image_count': len(db.get_all_images()),
+        'collection': collection_manager.current().name,
+        'model': image_index.model_name
+    }), 200 if warmer.ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Expose latency histograms, cache hit rates, index size and memory use
+    in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Upload a single image file"""
+    """Upload one image file, or several as repeated "file" (or "files") parts.
+
+    Files are saved and acknowledged immediately; embedding and indexing
+    run in a background job whose progress is available at /api/jobs/<id>.
+    Several files share one job, which embeds them in batches and saves
+    the index and database once.
+    """
     if not MODULES_LOADED:
         return jsonify({'error': 'System not properly initialized'}), 500
         
-    if 'file' not in request.files:
+    files = request.files.getlist('file') + request.files.getlist('files')
+    if not files:
         return jsonify({'error': 'No file part'}), 400
     
-    file = request.files['file']
-    if file.filename == '':
+    files = [file for file in files if file.filename != '']
+    if not files:
         return jsonify({'error': 'No selected file'}), 400
     
-    if file and allowed_file(file.filename):
-        result = image_processor.upload_image(file, file.filename)
-        if result:
-            return jsonify({
-                'success': True,
-                'image': result
-            }), 200
-        else:
-            return jsonify({'error': 'Failed to process image'}), 500
+    if len(files) == 1:
+        file = files[0]
+        if file and allowed_file(file.filename):
+            file_path = image_processor.save_upload(file, file.filename)
+            job = submit_job('upload', file_path=file_path)
+            return job_accepted(job, image={
+                'path': image_processor.relative_path(file_path),
+                'status': job['status']
+            })
+        
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    rejected = [file.filename for file in files if not allowed_file(file.filename)]
+    file_paths = [image_processor.save_upload(file, file.filename) for file in files if allowed_file(file.filename)]
+    if not file_paths:
+        return jsonify({'error': 'Invalid file type', 'rejected': rejected}), 400
     
-    return jsonify({'error': 'Invalid file type'}), 400
+    job = submit_job('upload_batch', file_paths=file_paths)
+    return job_accepted(job, images=[
+        {'path': image_processor.relative_path(file_path), 'status': job['status']} for file_path in file_paths
+    ], rejected=rejected)
 
 @app.route('/api/search', methods=['POST'])
 def search():
@@ -84,32 +342,339 @@ def search():
     if not MODULES_LOADED:
         return jsonify({'error': 'System not properly initialized'}), 500
         
-    data = request.json
-    if not data:
-        return jsonify({'error': 'No data provided'}), 400
+    params, error = parse_search_request(request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # Perform search
+    start = time.perf_counter()
+    results = run_search(params)
+    log_search(params, time.perf_counter() - start)
+    return json_response({'results': results})
+
+def log_search(params, seconds):
+    """Record a search in the query log replayed by the warmer"""
+    collection = collection_manager.current().name
+    query_log.record(params['query'], params['image_id'], params['weight_text'], seconds,
+                     collection if collection != DEFAULT_COLLECTION else None)
+
+@app.route('/api/search/by-image', methods=['POST'])
+def search_by_image():
+    """Search with an uploaded image that is not added to the collection.
+
+    Multipart form with the image in "image" and optionally "query" (blended
+    in with "weightText"), "limit", "tags", "fields", "rerank", "threshold",
+    "maxResults", "normalize" and "diversity" as in /api/search. The image is
+    embedded in memory and nothing is written to disk.
+    """
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+    
+    file = request.files.get('image')
+    if file is None or not file.filename:
+        return jsonify({'error': 'No image provided'}), 400
+    
+    data, error = parse_search_form(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+    params, error = parse_search_request(data, probe=True)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    image_data = file.read()
+    if not is_image_data(image_data):
+        return jsonify({'error': 'Could not read image'}), 400
+    probe = embed_probe_image(image_data, image_index.model_name)
+    if probe is None:
+        return jsonify({'error': 'Could not embed image'}), 400
+    
+    results = run_probe_search(params, probe)
+    return json_response({'results': results})
+
+def parse_search_form(form):
+    """Convert the form fields of /api/search/by-image to a /api/search body; returns (data, error)"""
+    data = {'query': form.get('query', ''), 'tags': form.getlist('tags') or form.getlist('tag')}
+    if form.get('rerank'):
+        data['rerank'] = form['rerank']
+    if form.get('fields') is not None:
+        data['fields'] = [field.strip() for field in form['fields'].split(',') if field.strip()]
+    if form.get('normalize') is not None:
+        data['normalize'] = form['normalize'].lower() in ('1', 'true', 'yes')
+    
+    for name, kind in (('limit', int), ('maxResults', int), ('weightText', float),
+                       ('threshold', float), ('diversity', float)):
+        if form.get(name):
+            try:
+                data[name] = kind(form[name])
+            except ValueError:
+                return None, f"{name} must be {'an integer' if kind is int else 'a number'}"
+    return data, None
+
+def is_image_data(data):
+    """Whether bytes decode as an image, checked without writing them anywhere"""
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+        return True
+    except ImportError:
+        return bool(data)
+    except Exception:
+        return False
+
+def run_probe_search(params, probe):
+    """Search with an image embedding, blended with the text query if there is one"""
+    paths = None
+    if params['tags']:
+        paths = [image['path'] for image in db.get_images_by_tags(params['tags'])]
+    
+    text_vector = None
+    search_vector = probe
+    if params['query']:
+        text_vector = image_index.embedder.embed_text(params['query'])
+        if text_vector is None:
+            return []
+        search_vector = params['weight_text'] * text_vector + (1 - params['weight_text']) * probe
+        search_vector = search_vector / np.linalg.norm(search_vector)
+    
+    k = params['max_results'] if params['threshold'] is not None else params['limit']
+    results = image_index.search_by_vector(
+        search_vector, k, paths=paths, rerank=params['rerank'], threshold=params['threshold'],
+        normalize=params['normalize'], text_vector=text_vector, image_vector=probe,
+        weight_text=params['weight_text'] if params['query'] else 0.0, diversity=params['diversity']
+    )
+    return join_image_fields(results, params['fields'])
+
+def parse_search_request(data, probe=False):
+    """Validate a search request body.
+
+    Returns (params, error); shared by the Flask and ASGI search routes.
+    With `probe`, the query image is uploaded alongside, so the body may
+    hold no search terms of its own.
+    """
+    if not data and not probe:
+        return None, 'No data provided'
     
     # Get search parameters
-    query = data.get('query', '')
-    image_id = data.get('imageId')
-    limit = data.get('limit', 20)
-    weight_text = data.get('weightText', 0.7)
+    params = {
+        'query': data.get('query', ''),
+        'image_id': data.get('imageId'),
+        'limit': data.get('limit', 20),
+        'weight_text': data.get('weightText', 0.7),
+        'tags': data.get('tags') or [],
+        'mode': data.get('mode', 'vector'),
+        'rerank': data.get('rerank'),
+        'diversity': data.get('diversity', 0.3),
+        'threshold': data.get('threshold'),
+        'max_results': data.get('maxResults'),
+        'normalize': bool(data.get('normalize', False)),
+        'fields': data.get('fields', list(DEFAULT_RESULT_FIELDS))
+    }
+    
+    if isinstance(params['tags'], str):
+        params['tags'] = [params['tags']]
+    
+    # Weighted positive/negative prompts and images, e.g. "like 3 and 17, beach, not night"
+    params['positive'], error = parse_query_terms(data.get('positive'))
+    if error:
+        return None, f"positive: {error}"
+    params['negative'], error = parse_query_terms(data.get('negative'))
+    if error:
+        return None, f"negative: {error}"
+    
+    if params['image_id'] is not None and (not isinstance(params['image_id'], int) or isinstance(params['image_id'], bool)):
+        return None, 'imageId must be an integer'
     
     # Validate that at least one search parameter is provided
-    if not query and image_id is None:
-        return jsonify({'error': 'Either query or imageId must be provided'}), 400
+    if not probe and not params['query'] and params['image_id'] is None and not params['positive']:
+        return None, 'Either query, imageId or positive terms must be provided'
     
-    # Perform search
-    results = image_index.search(query, limit, image_id, weight_text)
-    return jsonify({'results': results}), 200
+    if params['mode'] not in SEARCH_MODES:
+        return None, f"mode must be one of: {', '.join(SEARCH_MODES)}"
+    
+    if params['rerank'] is not None and params['rerank'] not in RERANKERS:
+        return None, f"rerank must be one of: {', '.join(RERANKERS)}"
+    
+    if not isinstance(params['fields'], list) or any(field not in RESULT_FIELDS for field in params['fields']):
+        return None, f"fields must be a list of: {', '.join(RESULT_FIELDS)}"
+    
+    if not isinstance(params['limit'], int) or isinstance(params['limit'], bool) or params['limit'] < 1:
+        return None, 'limit must be a positive integer'
+    if not is_unit_number(params['weight_text']):
+        return None, 'weightText must be a number between 0 and 1'
+    if not is_unit_number(params['diversity']):
+        return None, 'diversity must be a number between 0 and 1'
+    
+    # Threshold searches return every match above the score, up to maxResults
+    if params['threshold'] is not None and (not isinstance(params['threshold'], (int, float)) or isinstance(params['threshold'], bool)):
+        return None, 'threshold must be a number'
+    if params['max_results'] is not None and (not isinstance(params['max_results'], int) or isinstance(params['max_results'], bool) or params['max_results'] < 1):
+        return None, 'maxResults must be a positive integer'
+    
+    return params, None
+
+def is_unit_number(value):
+    """Whether value is a JSON number in [0, 1]"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value <= 1
+
+def parse_query_terms(items):
+    """Parse a list of query terms into (kind, value, weight) tuples.
+
+    A term is a text prompt ("beach"), an image id (3), or an object with
+    "text" or "imageId" and an optional "weight" (default 1). Returns
+    (terms, error).
+    """
+    if items is None:
+        return [], None
+    if not isinstance(items, list):
+        items = [items]
+    
+    terms = []
+    for item in items:
+        weight = 1.0
+        if isinstance(item, dict):
+            weight = item.get('weight', 1.0)
+            if not isinstance(weight, (int, float)) or isinstance(weight, bool):
+                return None, 'weight must be a number'
+            item = item.get('text', item.get('imageId'))
+        
+        if isinstance(item, str) and item.strip():
+            terms.append(('text', item, float(weight)))
+        elif isinstance(item, int) and not isinstance(item, bool):
+            terms.append(('image', item, float(weight)))
+        else:
+            return None, 'each term must be a prompt, an image id, or an object with "text" or "imageId"'
+    return terms, None
+
+def run_search(params):
+    """Run a search validated by parse_search_request"""
+    paths = None
+    if params['tags']:
+        # Only consider images carrying every requested tag
+        paths = [image['path'] for image in db.get_images_by_tags(params['tags'])]
+    
+    if params['mode'] == 'hybrid' and keyword_query(params):
+        results = hybrid_search(params, paths)
+    else:
+        results = vector_search(params, params['limit'], paths)
+    return join_image_fields(results, params['fields'])
+
+def join_image_fields(results, fields):
+    """Add the requested database fields to each result with one batched lookup"""
+    if not fields or not results:
+        return results
+    
+    with SEARCH_SECONDS.time(stage='join_fields'):
+        images = db.get_images_by_paths([result['path'] for result in results])
+        for result, image in zip(results, images):
+            for field in fields:
+                if image is None:
+                    result[field] = None
+                elif field == 'db_id':
+                    result[field] = image['id']
+                else:
+                    result[field] = image.get(field)
+    return results
+
+def vector_search(params, k, paths=None):
+    """CLIP search for a plain query/imageId, or for a composed query"""
+    options = {
+        'paths': paths,
+        'rerank': params['rerank'],
+        'diversity': params['diversity'],
+        'threshold': params['threshold'],
+        'normalize': params['normalize']
+    }
+    if params['threshold'] is not None:
+        k = params['max_results']
+    
+    if not params['positive'] and not params['negative']:
+        return image_index.search(params['query'], k, params['image_id'], params['weight_text'], **options)
+    
+    # Fold the plain query and image into the positive terms
+    positive = list(params['positive'])
+    if params['query'] and params['image_id'] is not None:
+        positive += [('text', params['query'], params['weight_text']),
+                     ('image', params['image_id'], 1 - params['weight_text'])]
+    elif params['query']:
+        positive.append(('text', params['query'], 1.0))
+    elif params['image_id'] is not None:
+        positive.append(('image', params['image_id'], 1.0))
+    
+    return image_index.search_composed(positive, params['negative'], k, **options)
+
+def keyword_query(params):
+    """Text matched against the keyword index: the query plus positive prompts"""
+    texts = [params['query']] if params['query'] else []
+    texts += [value for kind, value, _ in params['positive'] if kind == 'text']
+    return ' '.join(texts)
+
+def hybrid_search(params, paths=None):
+    """Fuse CLIP similarity with BM25 over tags, descriptions and file names.
+
+    Both rankings are combined with reciprocal rank fusion, so exact name
+    and tag matches surface even when their CLIP score is unremarkable.
+    The returned score is the fused score.
+    """
+    limit = params['limit']
+    depth = max(limit * 3, HYBRID_DEPTH)
+    vector_results = vector_search(params, depth, paths)
+    with SEARCH_SECONDS.time(stage='keyword_search'):
+        keyword_results = db.search_keywords(keyword_query(params), depth, paths)
+    
+    with SEARCH_SECONDS.time(stage='fusion'):
+        fused = reciprocal_rank_fusion([
+            [result['path'] for result in vector_results],
+            [path for path, _ in keyword_results]
+        ])
+        
+        # Keyword-only hits need their index ids looked up
+        ids = {result['path']: result['id'] for result in vector_results}
+        missing = [path for path, _ in fused if path not in ids]
+        if missing:
+            ids.update(zip(missing, image_index.positions_for_paths(missing).tolist()))
+        
+        results = []
+        for path, score in fused:
+            # Skip database entries that are not in the index
+            if ids[path] < 0:
+                continue
+            results.append({'path': path, 'id': ids[path], 'score': score})
+            if len(results) >= limit:
+                break
+    return results
 
 @app.route('/api/images', methods=['GET'])
 def list_images():
-    """Get all images in the database"""
+    """Get all images in the database, optionally only those with all of ?tag=..."""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    tags = request.args.getlist('tag')
+    images = db.get_images_by_tags(tags) if tags else db.get_all_images()
+    return json_response({'images': images})
+
+@app.route('/api/tags', methods=['GET'])
+def list_tags():
+    """Get all tags in use with the number of images carrying each"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    tags = [{'tag': tag, 'count': count} for tag, count in db.get_tag_counts()]
+    return jsonify({'tags': tags, 'vocabulary_size': len(label_vocabulary.labels)}), 200
+
+@app.route('/api/tags/autotag', methods=['POST'])
+def autotag():
+    """Tag existing images against the label vocabulary in a background job.
+
+    Only untagged images are tagged unless {"overwrite": true} is given.
+    """
     if not MODULES_LOADED:
         return jsonify({'error': 'System not properly initialized'}), 500
         
-    images = db.get_all_images()
-    return jsonify({'images': images}), 200
+    data = request.get_json(silent=True) or {}
+    job = submit_job('autotag', overwrite=bool(data.get('overwrite', False)))
+    return job_accepted(job)
 
 @app.route('/api/images/<int:image_id>', methods=['GET'])
 def get_image(image_id):
@@ -140,19 +705,51 @@ def delete_image(image_id):
             return jsonify({'error': 'Failed to delete image from database'}), 500
         
         # Delete the physical file
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], image['filename'])
+        file_path = image_processor.absolute_path(image['path'])
         if os.path.exists(file_path):
             os.remove(file_path)
         
-        # We need to rebuild the index after deleting an image to ensure consistency
-        # This could be optimized for larger collections, but for now this is simpler
-        image_index.rebuild_index(UPLOAD_FOLDER)
+        # Remove it from the index; clusters and neighbour lists are updated in place
+        image_index.remove_images([image['path']])
         
         return jsonify({'success': True, 'message': f"Image {image_id} deleted successfully"}), 200
     except Exception as e:
         print(f"Error deleting image: {e}")
         return jsonify({'error': f'Error deleting image: {e}'}), 500
 
+@app.route('/api/images', methods=['DELETE'])
+def delete_images():
+    """Delete several images, given as {"ids": [...]}, with one index and database save"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    data = request.get_json(silent=True) or {}
+    image_ids = data.get('ids')
+    if not isinstance(image_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in image_ids):
+        return jsonify({'error': 'ids must be a list of image ids'}), 400
+    
+    try:
+        deleted = db.delete_images(image_ids)
+        
+        for image in deleted:
+            file_path = image_processor.absolute_path(image['path'])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        
+        # One pass over the index; clusters and neighbour lists are updated in place
+        if deleted:
+            image_index.remove_images([image['path'] for image in deleted])
+        
+        deleted_ids = {image['id'] for image in deleted}
+        return jsonify({
+            'success': True,
+            'deleted': sorted(deleted_ids),
+            'not_found': [i for i in dict.fromkeys(image_ids) if i not in deleted_ids]
+        }), 200
+    except Exception as e:
+        print(f"Error deleting images: {e}")
+        return jsonify({'error': f'Error deleting images: {e}'}), 500
+
 @app.route('/api/images/<int:image_id>/favorite', methods=['POST'])
 def toggle_favorite(image_id):
     """Toggle favorite status for an image"""
@@ -175,19 +772,88 @@ def get_favorites():
 
 @app.route('/api/reindex', methods=['POST'])
 def reindex():
-    """Reindex all images in the uploads folder"""
+    """Reindex all images in the uploads folder in a background job"""
     if not MODULES_LOADED:
         return jsonify({'error': 'System not properly initialized'}), 500
         
-    count = image_index.rebuild_index(UPLOAD_FOLDER)
-    return jsonify({
-        'success': True,
-        'count': count
-    }), 200
+    job = submit_job('reindex')
+    return job_accepted(job)
+
+@app.route('/api/neighbors/build', methods=['POST'])
+def build_neighbors():
+    """Precompute the neighbour graph for image-only searches in a background job"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    job = submit_job('neighbors')
+    return job_accepted(job)
+
+@app.route('/api/reconcile', methods=['POST'])
+def reconcile():
+    """Bring the database and index in line with the uploads folder in a background job"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    data = request.get_json(silent=True) or {}
+    job = submit_job('reconcile', dry_run=bool(data.get('dryRun', False)))
+    return job_accepted(job)
+
+@app.route('/api/model', methods=['GET'])
+def get_model():
+    """Get the embedding model of the index and the progress of any model migration"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    return jsonify(model_migration.status()), 200
+
+@app.route('/api/model/migrate', methods=['POST'])
+def migrate_model():
+    """Re-embed every image with another model in a background job, then switch to it.
+
+    Searches keep using the current model until the switch. Takes
+    {"model": "ViT-L/14"} and optionally "rate" (images per second) and
+    "batchSize". Submitting the same model again resumes a cancelled
+    migration.
+    """
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    data = request.get_json(silent=True) or {}
+    model_name = data.get('model')
+    if not isinstance(model_name, str) or not model_name:
+        return jsonify({'error': 'No model specified'}), 400
+    if model_name == image_index.model_name:
+        return jsonify({'error': f"The index already uses {model_name}"}), 400
+    
+    rate = data.get('rate')
+    if rate is not None and (not isinstance(rate, (int, float)) or isinstance(rate, bool) or rate <= 0):
+        return jsonify({'error': 'rate must be a positive number'}), 400
+    batch_size = data.get('batchSize', 32)
+    if not isinstance(batch_size, int) or batch_size < 1:
+        return jsonify({'error': 'batchSize must be a positive integer'}), 400
+    
+    job = submit_job('migrate_model', model_name=model_name, batch_size=batch_size, rate=rate)
+    return job_accepted(job)
+
+@app.route('/api/model/migrate', methods=['DELETE'])
+def discard_migration():
+    """Throw away an unfinished model migration; cancel its job first"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    if model_migration.read_state() is None:
+        return jsonify({'error': 'No migration in progress'}), 404
+    active = [job for job in job_queue.list_jobs(limit=None)
+              if job['type'] == 'migrate_model' and job['status'] in (QUEUED, RUNNING)
+              and job['params'].get('collection', DEFAULT_COLLECTION) == collection_manager.current().name]
+    if active:
+        return jsonify({'error': f"The migration is running; cancel job {active[0]['id']} first"}), 409
+    model_migration.discard()
+    return jsonify({'success': True}), 200
 
 @app.route('/api/batch-import', methods=['POST'])
 def batch_import():
-    """Import images from a directory on the server"""
+    """Import images from a directory on the server in a background job"""
     if not MODULES_LOADED:
         return jsonify({'error': 'System not properly initialized'}), 500
         
@@ -199,32 +865,125 @@ def batch_import():
     if not os.path.exists(directory):
         return jsonify({'error': 'Directory not found'}), 404
     
-    processed, failed = image_processor.batch_process_directory(directory)
+    job = submit_job('batch_import', directory=os.path.abspath(directory))
+    return job_accepted(job)
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Get recent background jobs, optionally filtered by status"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    status = request.args.get('status')
+    jobs = job_queue.list_jobs(status=status)
+    return jsonify({'jobs': jobs}), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status, progress and result of a background job"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    job = job_queue.get(job_id)
+    if job:
+        return jsonify({'job': job}), 200
+    return jsonify({'error': 'Job not found'}), 404
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running background job"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    job = job_queue.cancel(job_id)
+    if job:
+        return jsonify({'job': job}), 200
+    return jsonify({'error': 'Job not found'}), 404
+
+@app.route('/api/collections', methods=['GET'])
+def list_collections():
+    """List collections; loaded ones include their size and memory use"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    loaded = {collection.name: collection for collection in collection_manager.loaded()}
+    collections = [loaded[name].info() if name in loaded else {'name': name, 'loaded': False}
+                   for name in collection_manager.names()]
     return jsonify({
-        'success': True,
-        'processed': processed,
-        'failed': failed
+        'collections': collections,
+        'memory_bytes': collection_manager.resident_bytes(),
+        'memory_budget_bytes': collection_manager.memory_budget
     }), 200
 
+@app.route('/api/collections', methods=['POST'])
+def create_collection():
+    """Create an empty collection, e.g. {"name": "products"}"""
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    data = request.get_json(silent=True) or {}
+    try:
+        collection = collection_manager.create(data.get('name'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'collection': collection.info()}), 201
+
 @app.route('/api/clusters', methods=['GET'])
 def get_clusters():
-    """Get auto-generated semantic clusters of images"""
+    """Get auto-generated semantic clusters of images.
+
+    Each cluster lists up to `limit` images starting at `offset` (all of
+    them by default) along with its total size.
+    """
+    if not MODULES_LOADED:
+        return jsonify({'error': 'System not properly initialized'}), 500
+        
+    num_clusters = parse_num_clusters(request.args.get('num_clusters', 5))
+    offset, limit = parse_pagination(request.args, default_limit=None)
+    
+    # Get clusters
+    clusters = image_index.get_semantic_clusters(num_clusters=num_clusters, offset=offset, limit=limit)
+    
+    return jsonify({'clusters': clusters}), 200
+
+@app.route('/api/clusters/<int:cluster_id>/images', methods=['GET'])
+def get_cluster_images(cluster_id):
+    """Page through the images in one cluster"""
     if not MODULES_LOADED:
         return jsonify({'error': 'System not properly initialized'}), 500
         
-    # Get requested number of clusters (default to 5)
+    num_clusters = parse_num_clusters(request.args.get('num_clusters', 5))
+    offset, limit = parse_pagination(request.args)
+    
+    cluster = image_index.get_cluster_images(cluster_id, num_clusters=num_clusters, offset=offset, limit=limit)
+    if cluster:
+        return jsonify({'cluster': cluster}), 200
+    return jsonify({'error': 'Cluster not found'}), 404
+
+def parse_pagination(args, default_limit=50, max_limit=1000):
+    """Parse `offset` and `limit` query parameters"""
     try:
-        num_clusters = int(request.args.get('num_clusters', 5))
+        offset = max(0, int(args.get('offset', 0)))
     except ValueError:
+        offset = 0
+    
+    limit = args.get('limit', default_limit)
+    if limit is not None:
+        try:
+            limit = max(0, min(max_limit, int(limit)))
+        except ValueError:
+            limit = default_limit
+    return offset, limit
+
+def parse_num_clusters(value):
+    """Parse the requested number of clusters (default to 5)"""
+    try:
+        num_clusters = int(value)
+    except (TypeError, ValueError):
         num_clusters = 5
     
     # Ensure reasonable bounds
-    num_clusters = max(2, min(10, num_clusters))
-    
-    # Get clusters
-    clusters = image_index.get_semantic_clusters(num_clusters=num_clusters)
-    
-    return jsonify({'clusters': clusters}), 200
+    return max(2, min(10, num_clusters))
 
 # Set up routes for static files
 @app.route('/static/js/<path:filename>')
@@ -0,0 +1,157 @@
+"""
+ASGI entry point for the Image Retrieval System.
+
+Run with:
+  uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Search and clustering are served natively: the CPU-bound CLIP and FAISS work
+runs on a bounded executor and the endpoint answers 429 when its queue is
+full. Requests pick a collection with the X-Collection header or
+?collection=, as in the Flask app. Static files are served by Starlette, which hands them to the server as
+a file path (zero-copy sendfile) when the server supports it. All other routes
+are delegated to the Flask app, so the API is identical in both modes.
+"""
+
+import os
+import time
+import functools
+import contextlib
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+# Starlette's own WSGI adapter is deprecated in favour of a2wsgi
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from app import app as flask_app
+from app import MODULES_LOADED, parse_search_request, run_search, parse_num_clusters, parse_pagination
+from app import requested_collection, run_in_collection, start_background_workers, log_search
+from utils.executor import cpu_executor, ExecutorBusy
+from utils.metrics import HTTP_SECONDS
+from utils.serialization import dumps
+
+if MODULES_LOADED:
+    from utils.collection_manager import collection_manager
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+def not_initialized():
+    return JSONResponse({'error': 'System not properly initialized'}, status_code=500)
+
+def collection_not_found(name):
+    return JSONResponse({'error': f"Collection not found: {name}"}, status_code=404)
+
+def busy():
+    """Response sent when the CPU executor cannot take more work"""
+    return JSONResponse(
+        {'error': 'Server busy, please retry'},
+        status_code=429,
+        headers={'Retry-After': '1'}
+    )
+
+def timed(endpoint):
+    """Record a native route's latency in HTTP_SECONDS, labelled like the Flask routes"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                HTTP_SECONDS.observe(
+                    time.perf_counter() - start,
+                    endpoint=endpoint,
+                    method=request.method,
+                    status=status
+                )
+        return wrapper
+    return decorator
+
+@timed('/api/search')
+async def search(request):
+    """Search for images using text prompt and optionally a reference image"""
+    if not MODULES_LOADED:
+        return not_initialized()
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    params, error = parse_search_request(data)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+
+    collection = requested_collection(request.headers, request.query_params)
+    if collection and not collection_manager.exists(collection):
+        return collection_not_found(collection)
+
+    try:
+        results = await cpu_executor.run(run_in_collection, collection, search_and_log, params)
+    except ExecutorBusy:
+        return busy()
+    return Response(dumps({'results': results}), media_type='application/json')
+
+def search_and_log(params):
+    start = time.perf_counter()
+    results = run_search(params)
+    log_search(params, time.perf_counter() - start)
+    return results
+
+def semantic_clusters(**options):
+    return collection_manager.current().index.get_semantic_clusters(**options)
+
+@timed('/api/clusters')
+async def get_clusters(request):
+    """Get auto-generated semantic clusters of images"""
+    if not MODULES_LOADED:
+        return not_initialized()
+
+    num_clusters = parse_num_clusters(request.query_params.get('num_clusters', 5))
+    offset, limit = parse_pagination(request.query_params, default_limit=None)
+    collection = requested_collection(request.headers, request.query_params)
+    if collection and not collection_manager.exists(collection):
+        return collection_not_found(collection)
+
+    try:
+        clusters = await cpu_executor.run(
+            run_in_collection,
+            collection,
+            semantic_clusters,
+            num_clusters=num_clusters,
+            offset=offset,
+            limit=limit
+        )
+    except ExecutorBusy:
+        return busy()
+    return JSONResponse({'clusters': clusters})
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Start the background job workers in the serving process"""
+    if MODULES_LOADED:
+        start_background_workers()
+    yield
+    cpu_executor.shutdown(wait=False)
+
+routes = [
+    Route('/api/search', search, methods=['POST']),
+    Route('/api/clusters', get_clusters, methods=['GET']),
+    Mount('/static/uploads', StaticFiles(directory=os.path.join(STATIC_DIR, 'uploads'), check_dir=False)),
+    Mount('/static/collections', StaticFiles(directory=os.path.join(STATIC_DIR, 'collections'), check_dir=False)),
+    Mount('/static/js', StaticFiles(directory=os.path.join(STATIC_DIR, 'frontend', 'static', 'js'), check_dir=False)),
+    Mount('/static/css', StaticFiles(directory=os.path.join(STATIC_DIR, 'frontend', 'static', 'css'), check_dir=False)),
+    Mount('/static/media', StaticFiles(directory=os.path.join(STATIC_DIR, 'frontend', 'static', 'media'), check_dir=False)),
+    # Everything else (uploads, image management, jobs, frontend) is served by Flask
+    Mount('/', WSGIMiddleware(flask_app))
+]
+
+app = Starlette(routes=routes, lifespan=lifespan)
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Load test for the HTTP API: /api/search, /api/upload, /api/images and /api/clusters.
+
+By default a server is started in a temporary workspace with the stub
+embedder (IMAGE_EMBEDDER=stub) and a synthetic collection, so runs are
+offline and repeatable; --url targets a server that is already running.
+Requests are drawn from a weighted endpoint mix and driven by one of three
+profiles:
+
+  concurrency  a fixed number of clients, each sending its next request as
+               soon as the previous one returns (closed loop)
+  rate         requests arrive at a target rate whether or not earlier ones
+               have returned (open loop); latency is measured from the
+               scheduled arrival, so queueing in the server is included
+  replay       the searches of a query log (see utils/query_log.py) at their
+               recorded pace, sped up by --speed
+
+Several comma-separated --concurrency or --rate values run as consecutive
+stages of --duration seconds each, which makes it easy to find the knee of
+the latency curve. Throughput, p50/p95/p99 latency and error rates are
+reported per stage and endpoint; the JSON output records the commit and
+machine so runs on different commits can be compared.
+
+Usage:
+  python benchmarks/load_test.py --concurrency 1,4,16 --duration 20
+  python benchmarks/load_test.py --profile rate --rate 20,50,100 --mix search=80,images=10,clusters=5,upload=5
+  python benchmarks/load_test.py --profile replay --replay database/query_log.jsonl --speed 10
+  python benchmarks/load_test.py --server asgi --workers 4 --output load.json
+  python benchmarks/load_test.py --url http://localhost:5000 --concurrency 8
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+from collections import Counter
+
+# Add parent directory to path so we can import our modules
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.run_benchmarks import latency_summary, environment_info
+from benchmarks.synthetic import clustered_embeddings, synthetic_paths, random_queries, make_image_corpus
+
+ENDPOINTS = ('search', 'upload', 'images', 'clusters')
+PROFILES = ('concurrency', 'rate', 'replay')
+
+# Threaded werkzeug server for --server werkzeug; gunicorn modes go through run.py
+WERKZEUG_SERVER = (
+    "import sys, logging\n"
+    "logging.getLogger('werkzeug').setLevel(logging.ERROR)\n"
+    "from werkzeug.serving import run_simple\n"
+    "from app import app\n"
+    "run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)\n"
+)
+
+def parse_mix(value):
+    """Parse "search=80,images=20" into normalised endpoint weights"""
+    weights = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (expected one of {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError('the mix needs at least one endpoint with a positive weight')
+    return {name: weight / total for name, weight in weights.items()}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def seed_workspace(workspace, args):
+    """Create a synthetic index and database of args.size images in the workspace"""
+    from models.index import ImageIndex
+    from database.db import ImageDatabase
+
+    paths = synthetic_paths(args.size)
+    index = ImageIndex(dimension=args.dimension, index_dir=os.path.join(workspace, 'index'))
+    index.add_images(paths, clustered_embeddings(args.size, args.dimension))
+
+    database = ImageDatabase(os.path.join(workspace, 'database', 'images.json'))
+    for path in paths:
+        database.add_image(path, save=False)
+    database.save_db()
+
+def start_server(workspace, args):
+    """Start the server under test in the workspace; returns (process, base URL)"""
+    port = free_port()
+    env = dict(os.environ, IMAGE_EMBEDDER='stub', PYTHONPATH=REPO_ROOT, FLASK_RUN_PORT=str(port))
+    if args.server == 'werkzeug':
+        command = [sys.executable, '-c', WERKZEUG_SERVER, str(port)]
+    else:
+        command = [sys.executable, os.path.join(REPO_ROOT, 'run.py'), '--serve', '--host', '127.0.0.1']
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        if args.server == 'asgi':
+            command.append('--asgi')
+
+    log = open(os.path.join(workspace, 'server.log'), 'wb')
+    process = subprocess.Popen(command, cwd=workspace, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{port}"
+
+def wait_until_ready(base_url, process=None, timeout=120):
+    """Wait for /api/status to answer 200 (the server is loaded and warmed up)"""
+    client = Client(base_url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('The server exited during startup; see server.log in the workspace')
+        status, _ = client.request('GET', '/api/status')
+        if status == 200:
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"The server at {base_url} did not become ready in {timeout}s")
+
+class Client:
+    def __init__(self, base_url, timeout=60):
+        """HTTP client keeping one keep-alive connection per thread"""
+        url = urllib.parse.urlparse(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request; returns (status, response size), status 0 on connection errors"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, len(response.read())
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            return 0, 0
+
+class Workload:
+    def __init__(self, args, images):
+        """Builds the requests for each endpoint"""
+        self.args = args
+        self.images = images
+        self.queries = random_queries(args.queries, seed=3)
+        self.searches = None
+        if args.replay:
+            self.searches = read_query_log(args.replay)
+            if not self.searches:
+                raise SystemExit(f"No searches found in {args.replay}")
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def search_body(self, rng):
+        if self.searches is None:
+            return {'query': self.queries[rng.randrange(len(self.queries))], 'limit': self.args.k}
+        with self._lock:
+            entry = self.searches[self._next % len(self.searches)]
+            self._next += 1
+        return search_body(entry, self.args.k)
+
+    def send(self, client, endpoint, rng):
+        if endpoint == 'search':
+            body = json.dumps(self.search_body(rng))
+            return client.request('POST', '/api/search', body, {'Content-Type': 'application/json'})
+        if endpoint == 'upload':
+            name, data = self.images[rng.randrange(len(self.images))]
+            body, content_type = multipart_body('file', name, data)
+            return client.request('POST', '/api/upload', body, {'Content-Type': content_type})
+        if endpoint == 'images':
+            return client.request('GET', '/api/images')
+        return client.request('GET', f"/api/clusters?num_clusters={self.args.num_clusters}")
+
+def read_query_log(path):
+    """Entries of a query log and its rotated files, oldest first"""
+    from utils.query_log import QueryLog
+
+    return list(QueryLog(path, backups=9).entries())
+
+def search_body(entry, k):
+    """A /api/search body for a query log entry"""
+    body = {'query': entry.get('q', ''), 'limit': k}
+    if entry.get('i') is not None:
+        body['imageId'] = entry['i']
+    if entry.get('w') is not None:
+        body['weightText'] = entry['w']
+    return body
+
+def multipart_body(field, filename, data):
+    boundary = f"loadtest{random.getrandbits(64):016x}"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    return head + data + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+class Recorder:
+    def __init__(self):
+        """Thread-safe collection of (endpoint, status, seconds) samples"""
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, status, seconds):
+        with self._lock:
+            self.samples.append((endpoint, status, seconds))
+
+    def summary(self, elapsed):
+        """Throughput, latency percentiles and error rate per endpoint and overall"""
+        results = {}
+        groups = {endpoint: [s for s in self.samples if s[0] == endpoint] for endpoint in ENDPOINTS}
+        groups['all'] = self.samples
+        for endpoint, samples in groups.items():
+            if not samples:
+                continue
+            ok = [seconds for _, status, seconds in samples if 200 <= status < 300]
+            errors = len(samples) - len(ok)
+            summary = latency_summary(ok) if ok else {'count': 0}
+            summary.update({
+                'requests': len(samples),
+                'errors': errors,
+                'error_rate': errors / len(samples),
+                'throughput_rps': len(ok) / elapsed if elapsed > 0 else 0.0,
+                'status_counts': {str(status): count for status, count in sorted(Counter(s[1] for s in samples).items())}
+            })
+            results[endpoint] = summary
+        return results
+
+def choose(rng, mix):
+    return rng.choices(list(mix), weights=list(mix.values()))[0]
+
+def run_closed_loop(client, workload, mix, concurrency, duration, seed):
+    """`concurrency` clients sending back-to-back requests for `duration` seconds"""
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        while time.perf_counter() < deadline:
+            endpoint = choose(rng, mix)
+            start = time.perf_counter()
+            status, _ = workload.send(client, endpoint, rng)
+            recorder.add(endpoint, status, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.perf_counter() - start)
+
+def run_open_loop(client, workload, arrivals, max_in_flight, seed):
+    """Send requests at the given (offset seconds, endpoint) arrivals.
+
+    Latency runs from the scheduled arrival, so time spent waiting for a
+    free client thread or in the server's queue is counted.
+    """
+    recorder = Recorder()
+    pending = queue.Queue()
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            scheduled, endpoint = item
+            status, _ = workload.send(client, endpoint, rng)
+            recorder.add(endpoint, status, time.perf_counter() - scheduled)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(max_in_flight)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    for offset, endpoint in arrivals:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pending.put((start + offset, endpoint))
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.perf_counter() - start)
+
+def rate_arrivals(rate, duration, mix, arrival, seed):
+    """Arrival offsets at `rate` per second, Poisson or evenly spaced"""
+    rng = random.Random(seed)
+    arrivals = []
+    offset = 0.0
+    while True:
+        offset += rng.expovariate(rate) if arrival == 'poisson' else 1.0 / rate
+        if offset >= duration:
+            return arrivals
+        arrivals.append((offset, choose(rng, mix)))
+
+def replay_arrivals(entries, speed, duration=None):
+    """Arrival offsets of logged searches at their recorded pace.
+
+    Log times have one-second resolution, so searches logged in the same
+    second are spread evenly over it.
+    """
+    seconds = Counter(entry.get('t', 0) for entry in entries)
+    first = min(seconds) if seconds else 0
+    seen = Counter()
+    arrivals = []
+    for entry in entries:
+        t = entry.get('t', 0)
+        offset = (t - first + seen[t] / seconds[t]) / speed
+        seen[t] += 1
+        if duration is not None and offset >= duration:
+            break
+        arrivals.append((offset, 'search'))
+    return arrivals
+
+def print_summary(label, results):
+    print(f"\n{label}")
+    print(f"  {'endpoint':<10}{'requests':>9}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for endpoint, summary in results.items():
+        if summary['count']:
+            latencies = f"{summary['p50_ms']:>9.1f}{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}"
+        else:
+            latencies = f"{'-':>9}{'-':>9}{'-':>9}"
+        print(f"  {endpoint:<10}{summary['requests']:>9}{summary['throughput_rps']:>9.1f}{latencies}"
+              f"{summary['error_rate']:>7.1%}")
+
+def run_stages(client, workload, args):
+    """Run each stage of the profile; returns {label: {'endpoints': {...}, ...}}"""
+    stages = {}
+    if args.profile == 'concurrency':
+        for concurrency in args.concurrency:
+            label = f"concurrency_{concurrency}"
+            results = run_closed_loop(client, workload, args.mix, concurrency, args.duration, args.seed)
+            stages[label] = {'concurrency': concurrency, 'endpoints': results}
+            print_summary(label, results)
+    elif args.profile == 'rate':
+        for rate in args.rate:
+            label = f"rate_{rate:g}"
+            arrivals = rate_arrivals(rate, args.duration, args.mix, args.arrival, args.seed)
+            results = run_open_loop(client, workload, arrivals, args.max_in_flight, args.seed)
+            stages[label] = {'target_rps': rate, 'endpoints': results}
+            print_summary(label, results)
+    else:
+        arrivals = replay_arrivals(workload.searches, args.speed, args.duration)
+        label = f"replay_x{args.speed:g}"
+        results = run_open_loop(client, workload, arrivals, args.max_in_flight, args.seed)
+        stages[label] = {'speed': args.speed, 'endpoints': results}
+        print_summary(label, results)
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the image retrieval HTTP API')
+    parser.add_argument('--profile', choices=PROFILES, help='Load profile (default: replay with --replay, else concurrency)')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma-separated client counts, one stage each')
+    parser.add_argument('--rate', default='10,50', help='Comma-separated arrival rates (requests/s), one stage each')
+    parser.add_argument('--arrival', choices=('poisson', 'constant'), default='poisson', help='Arrival process for --profile rate')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Client threads for open-loop profiles')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds per stage (replay: cap on replayed time)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('search=80,images=10,clusters=5,upload=5'),
+                        help='Endpoint weights, e.g. search=80,images=10,clusters=5,upload=5')
+    parser.add_argument('--replay', help='Query log to replay; with other profiles its searches replace the synthetic queries')
+    parser.add_argument('--speed', type=float, default=1.0, help='Speed-up of the recorded pace for --profile replay')
+    parser.add_argument('--url', help='Test a running server instead of starting one')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn', 'asgi'), default='werkzeug',
+                        help='How to start the local server (gunicorn and asgi use run.py --serve)')
+    parser.add_argument('--workers', type=int, help='Worker processes for --server gunicorn/asgi')
+    parser.add_argument('--size', type=int, default=10000, help='Synthetic images in the local server\'s collection')
+    parser.add_argument('--dimension', type=int, default=512, help='Embedding dimension')
+    parser.add_argument('--queries', type=int, default=1000, help='Distinct synthetic search queries')
+    parser.add_argument('--k', type=int, default=20, help='Results per search')
+    parser.add_argument('--num-clusters', type=int, default=5, help='num_clusters for /api/clusters')
+    parser.add_argument('--upload-images', type=int, default=20, help='Distinct synthetic images sent to /api/upload')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for request choice and arrival times')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--keep-workspace', action='store_true', help='Do not delete the temporary workspace')
+
+    args = parser.parse_args()
+    args.profile = args.profile or ('replay' if args.replay else 'concurrency')
+    args.concurrency = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    args.rate = [float(r) for r in args.rate.split(',') if r.strip()]
+    if args.profile == 'replay' and not args.replay:
+        parser.error('--profile replay needs --replay PATH')
+
+    # The stub embedder must be selected before any model module is imported,
+    # and the module-level singletons must be created inside the workspace
+    os.environ['IMAGE_EMBEDDER'] = 'stub'
+    workspace = tempfile.mkdtemp(prefix='image-retrieval-load-')
+    original_cwd = os.getcwd()
+    process = None
+    try:
+        images = []
+        for path in make_image_corpus(os.path.join(workspace, 'corpus'), args.upload_images, seed=5):
+            with open(path, 'rb') as f:
+                images.append((os.path.basename(path), f.read()))
+        workload = Workload(args, images)
+
+        base_url = args.url
+        if base_url is None:
+            os.chdir(workspace)
+            print(f"Load test workspace: {workspace}")
+            seed_workspace(workspace, args)
+            process, base_url = start_server(workspace, args)
+        print(f"Waiting for {base_url} to be ready...")
+        wait_until_ready(base_url, process)
+
+        report = {'environment': environment_info(args), 'target': base_url,
+                  'stages': run_stages(Client(base_url), workload, args)}
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        os.chdir(original_cwd)
+        if not args.keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(report, indent=2) + '\n')
+        print(f"\nResults written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for search, ingestion, clustering and the database.
+
+Runs fully offline: the CLIP model is replaced by the deterministic stub
+embedder (IMAGE_EMBEDDER=stub) and all data is synthetic. Everything is
+written to a temporary workspace. Results are emitted as JSON so runs on
+different commits can be compared.
+
+Usage:
+  python benchmarks/run_benchmarks.py --output results.json
+  python benchmarks/run_benchmarks.py --sizes 10000,100000,1000000 --threads 4
+  python benchmarks/run_benchmarks.py --only search,clusters
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+
+import numpy as np
+
+# Add parent directory to path so we can import our modules
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.synthetic import clustered_embeddings, synthetic_paths, random_queries, make_image_corpus
+
+SECTIONS = ('search', 'ingest', 'clusters', 'database', 'http')
+
+def latency_summary(latencies):
+    """Summarise latencies (in seconds) as milliseconds percentiles"""
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'count': int(len(latencies_ms)),
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'max_ms': float(latencies_ms.max())
+    }
+
+def run_concurrent(fn, args_list, threads=1):
+    """Call fn(*args) for each args in args_list from `threads` threads.
+
+    Returns (per-call latencies, wall-clock seconds).
+    """
+    latencies = [None] * len(args_list)
+    next_call = iter(range(len(args_list)))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_call, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            fn(*args_list[i])
+            latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return latencies, time.perf_counter() - start
+
+def throughput_summary(latencies, elapsed):
+    summary = latency_summary(latencies)
+    summary['qps'] = len(latencies) / elapsed if elapsed > 0 else 0.0
+    return summary
+
+def build_index(index_dir, n, dimension, seed=0):
+    """Create an on-disk index of n synthetic embeddings; returns build seconds"""
+    from models.index import ImageIndex
+
+    embeddings = clustered_embeddings(n, dimension, seed=seed)
+    builder = ImageIndex(dimension=dimension, index_dir=index_dir)
+    start = time.perf_counter()
+    builder.add_images(synthetic_paths(n), embeddings)
+    return time.perf_counter() - start
+
+def bench_search(workspace, sizes, args):
+    """Search latency/QPS, index build and load time per collection size"""
+    from models.index import ImageIndex
+
+    results = {}
+    for n in sizes:
+        index_dir = os.path.join(workspace, f"index_{n}")
+        build_s = build_index(index_dir, n, args.dimension)
+
+        start = time.perf_counter()
+        index = ImageIndex(dimension=args.dimension, index_dir=index_dir)
+        load_s = time.perf_counter() - start
+
+        rng = np.random.default_rng(1)
+        queries = [(q, args.k) for q in random_queries(args.queries, seed=n)]
+        image_queries = [('', args.k, int(i)) for i in rng.integers(0, n, size=args.queries)]
+
+        # Warm up allocators and page cache
+        for q in queries[:10]:
+            index.search(*q)
+
+        text_latencies, text_elapsed = run_concurrent(index.search, queries)
+        image_latencies, image_elapsed = run_concurrent(index.search, image_queries)
+        result = {
+            'build_s': build_s,
+            'load_s': load_s,
+            'text_search': throughput_summary(text_latencies, text_elapsed),
+            'image_search': throughput_summary(image_latencies, image_elapsed)
+        }
+        if args.threads > 1:
+            latencies, elapsed = run_concurrent(index.search, queries, threads=args.threads)
+            result[f'text_search_{args.threads}_threads'] = throughput_summary(latencies, elapsed)
+
+        results[str(n)] = result
+        print(f"search n={n}: p50={result['text_search']['p50_ms']:.2f}ms qps={result['text_search']['qps']:.0f}")
+
+        if 'clusters' in args.only and n <= args.max_cluster_size:
+            start = time.perf_counter()
+            clusters = index.get_semantic_clusters(num_clusters=args.num_clusters)
+            results[str(n)]['clusters'] = {
+                'seconds': time.perf_counter() - start,
+                'num_clusters': len(clusters)
+            }
+            print(f"clusters n={n}: {results[str(n)]['clusters']['seconds']:.2f}s")
+
+        del index
+        shutil.rmtree(index_dir, ignore_errors=True)
+    return results
+
+def bench_ingest(workspace, args):
+    """Throughput of add_image, add_images, rebuild_index and batch import"""
+    from models.index import ImageIndex
+    from utils.image_processor import image_processor
+
+    index_dir = os.path.join(workspace, "index_ingest")
+    build_index(index_dir, args.ingest_base_size, args.dimension)
+    index = ImageIndex(dimension=args.dimension, index_dir=index_dir)
+
+    n = args.add_count
+    embeddings = clustered_embeddings(n, args.dimension, seed=7)
+    paths = synthetic_paths(n, prefix="uploads/added")
+
+    start = time.perf_counter()
+    for path, embedding in zip(paths, embeddings):
+        index.add_image(path, embedding.reshape(1, -1))
+    add_each_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.add_images(paths, embeddings)
+    add_batch_s = time.perf_counter() - start
+
+    corpus_dir = os.path.join(workspace, "corpus", "uploads")
+    make_image_corpus(corpus_dir, args.corpus_size)
+
+    start = time.perf_counter()
+    rebuilt = index.rebuild_index(corpus_dir)
+    rebuild_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    processed, failed = image_processor.batch_process_directory(corpus_dir)
+    import_s = time.perf_counter() - start
+
+    results = {
+        'base_index_size': args.ingest_base_size,
+        'add_image_saved_each': {'images': n, 'seconds': add_each_s, 'images_per_s': n / add_each_s},
+        'add_images_batch': {'images': n, 'seconds': add_batch_s, 'images_per_s': n / add_batch_s},
+        'rebuild_index': {'images': rebuilt, 'seconds': rebuild_s, 'images_per_s': rebuilt / rebuild_s},
+        'batch_import': {'images': processed, 'failed': failed, 'seconds': import_s,
+                         'images_per_s': processed / import_s}
+    }
+    print(f"ingest: add_image {results['add_image_saved_each']['images_per_s']:.1f}/s, "
+          f"add_images {results['add_images_batch']['images_per_s']:.0f}/s, "
+          f"rebuild {results['rebuild_index']['images_per_s']:.1f}/s")
+    return results
+
+def bench_database(workspace, args):
+    """Cost of the main ImageDatabase operations at a given size"""
+    from database.db import ImageDatabase
+
+    db_path = os.path.join(workspace, "db_bench", "images.json")
+    db = ImageDatabase(db_path=db_path)
+    n = args.db_size
+
+    start = time.perf_counter()
+    for path in synthetic_paths(n):
+        db.add_image(path, {'width': 96, 'height': 96, 'format': 'JPEG'}, save=False)
+    populate_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db.save_db()
+    save_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db = ImageDatabase(db_path=db_path)
+    load_s = time.perf_counter() - start
+
+    rng = np.random.default_rng(2)
+    ids = [(int(i),) for i in rng.integers(1, n + 1, size=args.queries)]
+    get_latencies, _ = run_concurrent(db.get_image, ids)
+    toggle_latencies, _ = run_concurrent(db.toggle_favorite, ids[:args.write_count])
+    add_latencies, _ = run_concurrent(db.add_image, [(p,) for p in synthetic_paths(args.write_count, prefix="uploads/db")])
+    favorite_latencies, _ = run_concurrent(db.get_favorites, [()] * 20)
+
+    results = {
+        'size': n,
+        'populate_per_row_us': populate_s / n * 1e6,
+        'save_db_s': save_s,
+        'load_db_s': load_s,
+        'get_image': latency_summary(get_latencies),
+        'toggle_favorite': latency_summary(toggle_latencies),
+        'add_image': latency_summary(add_latencies),
+        'get_favorites': latency_summary(favorite_latencies)
+    }
+    print(f"database n={n}: get_image p50={results['get_image']['p50_ms']:.3f}ms, "
+          f"toggle_favorite p50={results['toggle_favorite']['p50_ms']:.1f}ms")
+    return results
+
+def bench_http(workspace, args):
+    """End-to-end /api/search latency through a real HTTP server"""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from models.index import image_index
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    image_index.add_images(synthetic_paths(args.http_size), clustered_embeddings(args.http_size, args.dimension))
+
+    from app import app
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    port = server.server_port
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    local = threading.local()
+
+    def post_search(query):
+        # One keep-alive connection per client thread
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', port)
+        body = json.dumps({'query': query, 'limit': args.k})
+        local.conn.request('POST', '/api/search', body=body, headers={'Content-Type': 'application/json'})
+        response = local.conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+
+    try:
+        queries = [(q,) for q in random_queries(args.queries, seed=3)]
+        for q in queries[:10]:
+            post_search(*q)
+        results = {'index_size': args.http_size}
+        for concurrency in sorted({1, args.threads}):
+            latencies, elapsed = run_concurrent(post_search, queries, threads=concurrency)
+            results[f'search_concurrency_{concurrency}'] = throughput_summary(latencies, elapsed)
+            print(f"http concurrency={concurrency}: p50={results[f'search_concurrency_{concurrency}']['p50_ms']:.2f}ms")
+    finally:
+        server.shutdown()
+    return results
+
+def environment_info(args):
+    """Describe the commit and machine so results can be compared"""
+    def git(*cmd):
+        try:
+            return subprocess.check_output(['git', '-C', REPO_ROOT] + list(cmd), stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    try:
+        import faiss
+        faiss_version = faiss.__version__
+    except (ImportError, AttributeError):
+        faiss_version = None
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'faiss': faiss_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the image retrieval system offline')
+    parser.add_argument('--sizes', default='10000,100000', help='Comma-separated collection sizes for search benchmarks')
+    parser.add_argument('--dimension', type=int, default=512, help='Embedding dimension')
+    parser.add_argument('--queries', type=int, default=500, help='Queries per latency measurement')
+    parser.add_argument('--k', type=int, default=20, help='Results per search')
+    parser.add_argument('--threads', type=int, default=4, help='Client threads for concurrent measurements')
+    parser.add_argument('--num-clusters', type=int, default=5, help='Clusters for get_semantic_clusters')
+    parser.add_argument('--max-cluster-size', type=int, default=100000, help='Skip clustering above this size')
+    parser.add_argument('--ingest-base-size', type=int, default=10000, help='Index size before ingestion benchmarks')
+    parser.add_argument('--add-count', type=int, default=50, help='Images added in ingestion benchmarks')
+    parser.add_argument('--corpus-size', type=int, default=200, help='Synthetic images for rebuild/import benchmarks')
+    parser.add_argument('--db-size', type=int, default=10000, help='Rows in the database benchmark')
+    parser.add_argument('--write-count', type=int, default=20, help='Writes timed in the database benchmark')
+    parser.add_argument('--http-size', type=int, default=10000, help='Index size for the HTTP benchmark')
+    parser.add_argument('--backend', choices=('faiss', 'numpy'), help='Index search backend (default: faiss if installed)')
+    parser.add_argument('--only', default=','.join(SECTIONS), help=f"Comma-separated sections to run ({', '.join(SECTIONS)})")
+    parser.add_argument('--output', help='Write JSON results to this file (default: stdout)')
+    parser.add_argument('--keep-workspace', action='store_true', help='Do not delete the temporary workspace')
+
+    args = parser.parse_args()
+    args.only = [s.strip() for s in args.only.split(',') if s.strip()]
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+
+    # The stub embedder must be selected before any model module is imported,
+    # and the module-level singletons must be created inside the workspace
+    os.environ['IMAGE_EMBEDDER'] = 'stub'
+    if args.backend:
+        os.environ['INDEX_BACKEND'] = args.backend
+    workspace = tempfile.mkdtemp(prefix='image-retrieval-bench-')
+    original_cwd = os.getcwd()
+    os.chdir(workspace)
+    print(f"Benchmark workspace: {workspace}")
+
+    report = {'environment': environment_info(args), 'results': {}}
+    try:
+        if 'search' in args.only or 'clusters' in args.only:
+            report['results']['search'] = bench_search(workspace, sizes, args)
+        if 'ingest' in args.only:
+            report['results']['ingest'] = bench_ingest(workspace, args)
+        if 'database' in args.only:
+            report['results']['database'] = bench_database(workspace, args)
+        if 'http' in args.only:
+            report['results']['http'] = bench_http(workspace, args)
+    finally:
+        os.chdir(original_cwd)
+        if not args.keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Synthetic data for benchmarks: clustered embedding collections and a small
+on-disk image corpus. Everything is seeded so runs are reproducible.
+"""
+
+import os
+import numpy as np
+from pathlib import Path
+
+def clustered_embeddings(n, dimension=512, num_centers=64, spread=0.35, seed=0, chunk_size=100000):
+    """Generate n unit vectors drawn around num_centers random centres.
+
+    Real CLIP embeddings are far from uniform, so a mixture gives more
+    realistic clustering and search behaviour than pure noise. Generated in
+    chunks to keep peak memory near the size of the result.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_centers, dimension)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    embeddings = np.empty((n, dimension), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        assignment = rng.integers(0, num_centers, size=end - start)
+        noise = rng.standard_normal((end - start, dimension)).astype(np.float32)
+        block = centers[assignment] + noise * (spread / np.sqrt(dimension))
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        embeddings[start:end] = block
+    return embeddings
+
+def synthetic_paths(n, prefix="uploads/synthetic"):
+    """Relative image paths matching the layout used by the upload folder"""
+    return [f"{prefix}_{i:07d}.jpg" for i in range(n)]
+
+def random_queries(n, seed=0):
+    """Short pseudo-random text queries; distinct strings defeat the text cache"""
+    rng = np.random.default_rng(seed)
+    words = ["beach", "sunset", "dog", "cat", "city", "night", "mountain", "portrait",
+             "food", "car", "forest", "snow", "river", "building", "flower", "bird"]
+    return [" ".join(rng.choice(words, size=3)) + f" {i}" for i in range(n)]
+
+def make_image_corpus(directory, n, size=(96, 96), seed=0):
+    """Write n small random JPEG images to directory and return their paths"""
+    from PIL import Image
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(n):
+        pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+        path = os.path.join(directory, f"synthetic_{i:05d}.jpg")
+        Image.fromarray(pixels).save(path, quality=85)
+        paths.append(path)
+    return paths
@@ -1,89 +1,288 @@
 import os
 import json
+import threading
+import contextlib
 from datetime import datetime
 from pathlib import Path
+from utils.filelock import FileLock
+from utils.metrics import DB_SECONDS
+from database.keyword_index import KeywordIndex
 
 class ImageDatabase:
     def __init__(self, db_path="database/images.json"):
         self.db_path = db_path
+        self.lock = threading.RLock()
+        # Serialises writes across processes (e.g. production server workers)
+        self.write_lock = FileLock(f"{db_path}.lock")
+        # Modification stamp of the file contents we hold in memory
+        self._stamp = None
+        # Whether there are changes added with save=False not yet on disk
+        self._dirty = False
+        # Lookups by id and path, and tag -> set of image ids carrying it,
+        # kept in step with self.images
+        self.by_id = {}
+        self.by_path = {}
+        self.tag_index = {}
+        # Highest id ever seen, so ids are never reused after deletes
+        self.max_id = 0
+        # BM25 index over tags, descriptions and file names, keyed by image id
+        self.keywords = KeywordIndex()
         Path(os.path.dirname(db_path)).mkdir(parents=True, exist_ok=True)
         self.load_db()
     
+    @DB_SECONDS.timed(op='load_db')
     def load_db(self):
         """Load the database from disk or create a new one"""
-        if os.path.exists(self.db_path):
-            with open(self.db_path, 'r') as f:
-                self.images = json.load(f)
-        else:
-            self.images = []
-            self.save_db()
+        with self.write_lock, self.lock:
+            if os.path.exists(self.db_path):
+                with open(self.db_path, 'r') as f:
+                    self.images = json.load(f)
+                self._stamp = self._file_stamp()
+            else:
+                self.images = []
+                self.save_db()
+            self._rebuild_indexes()
     
+    @DB_SECONDS.timed(op='save_db')
     def save_db(self):
         """Save the database to disk"""
-        with open(self.db_path, 'w') as f:
-            json.dump(self.images, f, indent=2)
+        with self.write_lock, self.lock:
+            # Write to a temporary file first so readers never see a partial file
+            tmp_path = f"{self.db_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.images, f, indent=2)
+            os.replace(tmp_path, self.db_path)
+            self._stamp = self._file_stamp()
+            self._dirty = False
+    
+    def reload_if_changed(self):
+        """Reload the database if another process has written it.
+
+        Unsaved changes are never discarded; they are written over the file
+        on the next save. Returns True if the database was reloaded.
+        """
+        if self._dirty or self._file_stamp() == self._stamp:
+            return False
+        with self.write_lock, self.lock:
+            # Check again now that no other process is mid-save
+            if self._dirty or self._file_stamp() == self._stamp:
+                return False
+            self.load_db()
+            return True
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """Lock the database across processes and bring it up to date for a write"""
+        with self.write_lock, self.lock:
+            self.reload_if_changed()
+            yield
+    
+    def _rebuild_indexes(self):
+        self.by_id = {}
+        self.by_path = {}
+        self.tag_index = {}
+        self.max_id = 0
+        self.keywords.clear()
+        for image in self.images:
+            self._index_image(image)
+
+    def _index_image(self, image, remove=False):
+        """Add an image to (or remove it from) the lookup, tag and keyword indexes"""
+        if remove:
+            self.keywords.remove(image['id'])
+            if self.by_id.get(image['id']) is image:
+                del self.by_id[image['id']]
+            if self.by_path.get(image.get('path')) is image:
+                del self.by_path[image['path']]
+        else:
+            self.keywords.add(image['id'], image)
+            self.by_id.setdefault(image['id'], image)
+            self.by_path.setdefault(image.get('path'), image)
+            self.max_id = max(self.max_id, image['id'])
+        for tag in image.get('tags') or []:
+            ids = self.tag_index.setdefault(tag, set())
+            if remove:
+                ids.discard(image['id'])
+                if not ids:
+                    del self.tag_index[tag]
+            else:
+                ids.add(image['id'])
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
     
-    def add_image(self, image_path, metadata=None):
-        """Add an image to the database with metadata"""
+    @DB_SECONDS.timed(op='add_image')
+    def add_image(self, image_path, metadata=None, save=True, tags=None):
+        """Add an image to the database with metadata.
+
+        `tags` overrides any tags given in metadata. Pass save=False when
+        adding many images and call save_db() once at the end.
+        """
         if metadata is None:
             metadata = {}
         
-        # Create image entry
-        image_entry = {
-            'id': len(self.images) + 1,
-            'path': image_path,
-            'uploaded_at': datetime.now().isoformat(),
-            'favorites': False,
-            'tags': metadata.get('tags', []),
-            'description': metadata.get('description', ''),
-            'metadata': metadata
-        }
-        
-        self.images.append(image_entry)
-        self.save_db()
+        with self.transaction():
+            # Create image entry
+            image_entry = {
+                'id': self.max_id + 1,
+                'path': image_path,
+                'uploaded_at': datetime.now().isoformat(),
+                'favorites': False,
+                'tags': list(tags) if tags is not None else metadata.get('tags', []),
+                'description': metadata.get('description', ''),
+                'metadata': metadata
+            }
+            
+            self.images.append(image_entry)
+            self._index_image(image_entry)
+            if save:
+                self.save_db()
+            else:
+                self._dirty = True
         return image_entry
     
+    @DB_SECONDS.timed(op='get_image')
     def get_image(self, image_id):
         """Get an image by ID"""
-        for image in self.images:
-            if image['id'] == image_id:
-                return image
-        return None
+        return self.by_id.get(image_id)
+    
+    @DB_SECONDS.timed(op='get_images_by_paths')
+    def get_images_by_paths(self, paths):
+        """Get the images for a list of paths in one step (None where unknown)"""
+        with self.lock:
+            return [self.by_path.get(path) for path in paths]
     
+    @DB_SECONDS.timed(op='update_image')
     def update_image(self, image_id, updates):
         """Update an image's metadata"""
-        for i, image in enumerate(self.images):
-            if image['id'] == image_id:
-                self.images[i].update(updates)
+        with self.transaction():
+            image = self.by_id.get(image_id)
+            if image is not None:
+                self._index_image(image, remove=True)
+                image.update(updates)
+                self._index_image(image)
                 self.save_db()
-                return self.images[i]
-        return None
+            return image
+
+    @DB_SECONDS.timed(op='update_images')
+    def update_images(self, updates, save=True):
+        """Apply {image_id: updates} to many images with a single save.
+
+        Returns the number of images updated.
+        """
+        count = 0
+        with self.transaction():
+            for image in self.images:
+                changes = updates.get(image['id'])
+                if changes:
+                    self._index_image(image, remove=True)
+                    image.update(changes)
+                    self._index_image(image)
+                    count += 1
+            if count:
+                if save:
+                    self.save_db()
+                else:
+                    self._dirty = True
+        return count
     
+    @DB_SECONDS.timed(op='delete_image')
     def delete_image(self, image_id):
         """Remove an image from the database"""
-        for i, image in enumerate(self.images):
-            if image['id'] == image_id:
-                deleted = self.images.pop(i)
-                self.save_db()
-                return deleted
+        with self.transaction():
+            for i, image in enumerate(self.images):
+                if image['id'] == image_id:
+                    deleted = self.images.pop(i)
+                    self._index_image(deleted, remove=True)
+                    self.save_db()
+                    return deleted
         return None
     
+    @DB_SECONDS.timed(op='renumber_duplicate_ids')
+    def renumber_duplicate_ids(self):
+        """Give every image sharing an id with an earlier one a fresh id.
+
+        Older databases assigned ids as len(images) + 1, which repeats ids
+        after a delete. Returns the number of images renumbered.
+        """
+        with self.transaction():
+            seen = set()
+            renumbered = 0
+            for image in self.images:
+                if image['id'] in seen:
+                    image['id'] = self.max_id + 1
+                    self.max_id = image['id']
+                    renumbered += 1
+                seen.add(image['id'])
+            if renumbered:
+                self._rebuild_indexes()
+                self.save_db()
+        return renumbered
+    
+    @DB_SECONDS.timed(op='delete_images')
+    def delete_images(self, image_ids, save=True):
+        """Remove many images with a single save. Returns the deleted entries."""
+        image_ids = set(image_ids)
+        with self.transaction():
+            deleted = [image for image in self.images if image['id'] in image_ids]
+            if deleted:
+                self.images = [image for image in self.images if image['id'] not in image_ids]
+                for image in deleted:
+                    self._index_image(image, remove=True)
+                if save:
+                    self.save_db()
+                else:
+                    self._dirty = True
+        return deleted
+    
     def get_all_images(self):
         """Get all images in the database"""
         return self.images
     
+    @DB_SECONDS.timed(op='get_images_by_tags')
+    def get_images_by_tags(self, tags):
+        """Get the images carrying every one of the given tags"""
+        with self.lock:
+            ids = None
+            for tag in tags:
+                tagged = self.tag_index.get(tag, set())
+                ids = set(tagged) if ids is None else ids & tagged
+                if not ids:
+                    return []
+            if ids is None:
+                return list(self.images)
+            return [self.by_id[image_id] for image_id in sorted(ids)]
+
+    @DB_SECONDS.timed(op='search_keywords')
+    def search_keywords(self, query, k=20, paths=None):
+        """Top-k (path, score) pairs matching a keyword query by BM25"""
+        with self.lock:
+            return self.keywords.search(query, k, paths)
+
+    def get_tag_counts(self):
+        """Number of images per tag, most common first"""
+        with self.lock:
+            counts = [(tag, len(ids)) for tag, ids in self.tag_index.items()]
+        return sorted(counts, key=lambda item: (-item[1], item[0]))
+
+    @DB_SECONDS.timed(op='get_favorites')
     def get_favorites(self):
         """Get all favorited images"""
         return [image for image in self.images if image.get('favorites', False)]
     
+    @DB_SECONDS.timed(op='toggle_favorite')
     def toggle_favorite(self, image_id):
         """Toggle favorite status for an image"""
-        for i, image in enumerate(self.images):
-            if image['id'] == image_id:
-                self.images[i]['favorites'] = not self.images[i].get('favorites', False)
+        with self.transaction():
+            image = self.by_id.get(image_id)
+            if image is not None:
+                image['favorites'] = not image.get('favorites', False)
                 self.save_db()
-                return self.images[i]
-        return None
+            return image
 
 # Create singleton instance
 db = ImageDatabase() 
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+import re
+import math
+import heapq
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    """Lowercase alphanumeric tokens; splits file names like IMG_1234 too"""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+def image_tokens(image):
+    """Tokens for an image entry: its tags, description and file name"""
+    tokens = []
+    for tag in image.get('tags') or []:
+        tokens.extend(tokenize(tag))
+    tokens.extend(tokenize(image.get('description', '')))
+    tokens.extend(tokenize(os.path.splitext(os.path.basename(image.get('path', '')))[0]))
+    return tokens
+
+class KeywordIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        """Inverted index over image tags, descriptions and file names, scored with BM25.
+
+        Documents are added and removed one at a time, so the index is kept
+        up to date as images are added rather than rebuilt. Not thread-safe
+        on its own; ImageDatabase updates and queries it under its lock.
+        """
+        self.k1 = k1
+        self.b = b
+        # term -> {doc_id: term frequency}
+        self.postings = {}
+        # doc_id -> (path, length in tokens, distinct terms)
+        self.documents = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id, image):
+        """Index an image entry, replacing any previous version of it"""
+        self.remove(doc_id)
+        tokens = image_tokens(image)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            self.postings.setdefault(token, {})[doc_id] = count
+        self.documents[doc_id] = (image.get('path'), len(tokens), tuple(counts))
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id):
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return
+        self.total_length -= document[1]
+        for token in document[2]:
+            docs = self.postings[token]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[token]
+
+    def clear(self):
+        self.postings = {}
+        self.documents = {}
+        self.total_length = 0
+
+    def search(self, query, k=20, paths=None):
+        """Top-k (path, score) pairs for a free-text query by BM25.
+
+        If `paths` is given, only images with those paths are returned.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.documents:
+            return []
+
+        num_docs = len(self.documents)
+        avg_length = self.total_length / num_docs if num_docs else 0
+        scores = {}
+        for term in terms:
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                length = self.documents[doc_id][1]
+                norm = 1 - self.b + self.b * (length / avg_length if avg_length else 0)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+        if paths is not None:
+            paths = set(paths)
+            scores = {doc_id: s for doc_id, s in scores.items() if self.documents[doc_id][0] in paths}
+
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.documents[doc_id][0], score) for doc_id, score in ranked]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of keys with reciprocal rank fusion.
+
+    Each key scores sum(1 / (k + rank)) over the lists it appears in, so
+    items ranked well by several retrievers rise to the top without having
+    to calibrate their raw scores against each other. Returns (key, score)
+    pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -0,0 +1,198 @@
+import os
+import numpy as np
+
+# Prefer FAISS k-means; fall back to scikit-learn's MiniBatchKMeans
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+class ClusterState:
+    def __init__(self, centroids, assignments, names, generation, fit_size):
+        """Centroids and per-image cluster assignments for one value of k"""
+        self.centroids = centroids
+        self.assignments = assignments
+        self.names = list(names)
+        self.generation = generation
+        self.fit_size = fit_size
+        self._order = None
+        self._offsets = None
+
+    @property
+    def k(self):
+        return len(self.centroids)
+
+    def members(self, cluster_id, offset=0, limit=None):
+        """Positions of the images in a cluster, sliced for pagination"""
+        if self._order is None:
+            # Sort positions by cluster once, so each page is a slice
+            self._order = np.argsort(self.assignments, kind='stable')
+            counts = np.bincount(self.assignments, minlength=self.k)
+            self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        start = self._offsets[cluster_id] + offset
+        end = self._offsets[cluster_id + 1]
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._order[start:end]
+
+    def size(self, cluster_id):
+        self.members(cluster_id, 0, 0)
+        return int(self._offsets[cluster_id + 1] - self._offsets[cluster_id])
+
+    def extend(self, embeddings):
+        """Assign new images to their nearest centroid"""
+        if len(embeddings) == 0:
+            return
+        new_assignments = nearest_centroids(self.centroids, embeddings)
+        self.assignments = np.concatenate([self.assignments, new_assignments])
+        self._order = None
+        self._offsets = None
+
+    def remove(self, keep):
+        """Drop removed images, given a boolean mask over the old positions"""
+        self.assignments = self.assignments[keep]
+        self._order = None
+        self._offsets = None
+
+class ClusterStore:
+    def __init__(self, index_dir, refit_growth=2.0):
+        """Persisted k-means clusterings of the index, one file per k.
+
+        Each file records the index generation it matches, so a clustering
+        is reused until the index is rebuilt, and new images are assigned
+        to existing centroids as they are added. Once the index has grown
+        by `refit_growth` times since the last fit, centroids are refit.
+        """
+        self.index_dir = index_dir
+        self.refit_growth = refit_growth
+        self._states = {}
+
+    def _path(self, k):
+        return os.path.join(self.index_dir, f"clusters_k{k}.npz")
+
+    def get(self, k, generation, size):
+        """Get a clustering that matches the index, or None if it must be (re)fit"""
+        state = self._states.get(k)
+        if state is None or len(state.assignments) != size:
+            state = self._load(k)
+            if state is None or state.generation != generation or len(state.assignments) != size:
+                return None
+            self._states[k] = state
+        if size > state.fit_size * self.refit_growth:
+            return None
+        return state
+
+    def fit(self, k, embeddings, generation, name_fn=None):
+        """Cluster embeddings into k groups and persist the result.
+
+        `name_fn(centroids)` returns a display name per cluster.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        centroids = kmeans(embeddings, k)
+        assignments = nearest_centroids(centroids, embeddings)
+        names = name_fn(centroids) if name_fn else [f"Cluster {i + 1}" for i in range(k)]
+        state = ClusterState(centroids, assignments, names, generation, len(embeddings))
+        self._states[k] = state
+        self._save(k, state)
+        return state
+
+    def extend(self, embeddings, previous_size, generation):
+        """Assign newly added images in every clustering that was up to date"""
+        for k in self.known_ks():
+            state = self.get(k, generation, previous_size)
+            if state is not None:
+                state.extend(embeddings)
+            else:
+                self._states.pop(k, None)
+
+    def remove(self, keep, previous_size, generation):
+        """Drop removed images from every clustering that was up to date"""
+        for k in self.known_ks():
+            state = self.get(k, generation, previous_size)
+            if state is not None and int(keep.sum()) >= k:
+                state.remove(keep)
+            else:
+                self._states.pop(k, None)
+
+    def save(self, generation):
+        """Persist in-memory clusterings as matching the given index generation"""
+        for k, state in self._states.items():
+            state.generation = generation
+            self._save(k, state)
+
+    def clear(self, delete_files=False):
+        """Forget in-memory clusterings, e.g. after the index was reloaded or rebuilt"""
+        self._states = {}
+        if delete_files:
+            for k in self.known_ks():
+                try:
+                    os.remove(self._path(k))
+                except OSError:
+                    pass
+
+    def known_ks(self):
+        ks = set(self._states)
+        if os.path.isdir(self.index_dir):
+            for name in os.listdir(self.index_dir):
+                if name.startswith('clusters_k') and name.endswith('.npz'):
+                    try:
+                        ks.add(int(name[len('clusters_k'):-len('.npz')]))
+                    except ValueError:
+                        pass
+        return sorted(ks)
+
+    def _load(self, k):
+        path = self._path(k)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return ClusterState(
+                    data['centroids'],
+                    data['assignments'],
+                    [str(name) for name in data['names']],
+                    int(data['generation']),
+                    int(data['fit_size'])
+                )
+        except Exception as e:
+            print(f"Error loading clusters for k={k}: {e}")
+            return None
+
+    def _save(self, k, state):
+        path = self._path(k)
+        try:
+            with open(f"{path}.tmp", 'wb') as f:
+                np.savez(
+                    f,
+                    centroids=state.centroids,
+                    assignments=state.assignments,
+                    names=np.array(state.names),
+                    generation=state.generation,
+                    fit_size=state.fit_size
+                )
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            print(f"Error saving clusters for k={k}: {e}")
+
+def kmeans(embeddings, k, niter=20, seed=42):
+    """Compute k centroids with FAISS k-means, or MiniBatchKMeans without FAISS"""
+    if FAISS_AVAILABLE:
+        clustering = faiss.Kmeans(embeddings.shape[1], k, niter=niter, seed=seed, spherical=True, verbose=False)
+        clustering.train(embeddings)
+        return clustering.centroids.astype(np.float32)
+
+    from sklearn.cluster import MiniBatchKMeans
+    clustering = MiniBatchKMeans(n_clusters=k, random_state=seed, batch_size=4096, n_init=3)
+    clustering.fit(embeddings)
+    centroids = clustering.cluster_centers_.astype(np.float32)
+    return centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+def nearest_centroids(centroids, embeddings, block_size=65536):
+    """Index of the most similar centroid for each embedding"""
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, centroids.shape[1])
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), block_size):
+        block = embeddings[start:start + block_size]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
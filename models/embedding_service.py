@@ -0,0 +1,414 @@
+"""
+Out-of-process embedding server and its client.
+
+One server process holds the CLIP model and serves embeddings over HTTP, on
+a Unix socket ("unix:/path/to/socket") or TCP ("http://host:port"). Texts
+and image paths from concurrent requests are coalesced into shared batches
+before they reach the model. Web workers, import scripts and the reconciler
+use EmbeddingClient in place of ImageEmbedder by setting EMBEDDING_SERVER to
+the server's address, and then never import torch.
+
+Requests are JSON ({"texts": [...]} or {"paths": [...]}, with an optional
+"model" to use another model than the server's default); embeddings come
+back as raw float32 rows with the shape in the X-Embedding-Shape header and
+the rows of unreadable images in X-Missing. On TCP the server only reads
+image paths under its allowed roots (the app's static folder by default),
+so the port can't be used to read other files.
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import http.client
+import socketserver
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import numpy as np
+from utils.metrics import EMBED_SECONDS
+
+# Uploads and collections live here; the default allowed root on TCP
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+
+def parse_address(address):
+    """('unix', path) or ('tcp', (host, port)) for an EMBEDDING_SERVER address"""
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    parsed = urlparse(address if '://' in address else f"http://{address}")
+    return 'tcp', (parsed.hostname or '127.0.0.1', parsed.port or 5055)
+
+class RequestBatcher:
+    def __init__(self, fn, max_batch=64, max_wait=0.005, name='embed-batcher'):
+        """Coalesce items submitted by concurrent callers into batched calls.
+
+        `fn(items)` returns one result per item. A batch is dispatched once
+        it holds `max_batch` items or `max_wait` seconds after its first
+        request arrived, whichever comes first.
+        """
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def submit(self, items):
+        """Queue items and return a Future for their results"""
+        future = concurrent.futures.Future()
+        self._queue.put((list(items), future))
+        return future
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            count = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                count += len(request[0])
+
+            items = [item for request_items, _ in pending for item in request_items]
+            try:
+                results = self.fn(items)
+                if results is None:
+                    raise RuntimeError("Embedding model not loaded")
+                start = 0
+                for request_items, future in pending:
+                    future.set_result(results[start:start + len(request_items)])
+                    start += len(request_items)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+
+# Every web worker thread may connect at once; the default backlog of 5 refuses them
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+class _ThreadingTCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+class EmbeddingServer:
+    def __init__(self, embedder, address, max_batch=64, max_wait=0.005, allowed_roots=None):
+        """Serve `embedder` at `address` (see parse_address).
+
+        Image paths must lie under one of `allowed_roots`. On a Unix socket,
+        whose file permissions already limit who can connect, any path is
+        accepted unless roots are given; on TCP they default to STATIC_DIR.
+        """
+        self.embedder = embedder
+        self.address = address
+        if allowed_roots is None and parse_address(address)[0] == 'tcp':
+            allowed_roots = [STATIC_DIR]
+        self.allowed_roots = None if allowed_roots is None else [os.path.realpath(root) for root in allowed_roots]
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # (model name, kind) -> RequestBatcher; other models are loaded on
+        # first request (see models.image_embedder.get_embedder)
+        self._batchers = {}
+        self._batchers_lock = threading.Lock()
+        self._server = None
+
+    def batcher(self, kind, model_name=None):
+        """The batcher for 'texts', 'bulk_texts' or 'images' of a model"""
+        key = (model_name or self.embedder.model_name, kind)
+        with self._batchers_lock:
+            if key not in self._batchers:
+                embedder = self.embedder
+                if model_name and model_name != self.embedder.model_name:
+                    from models.image_embedder import get_embedder
+                    embedder = get_embedder(model_name)
+                # Query texts go through the text cache; bulk texts (label
+                # vocabularies) are batched separately so they don't evict queries
+                fn = {
+                    'texts': lambda texts: embedder.embed_texts(texts, cache=True),
+                    'bulk_texts': embedder.embed_texts,
+                    'images': embedder.embed_images
+                }[kind]
+                self._batchers[key] = RequestBatcher(fn, self.max_batch, self.max_wait, name=f"{kind}-batcher")
+            return self._batchers[key]
+
+    def path_allowed(self, path):
+        """Whether an image path sent by a client may be read"""
+        if self.allowed_roots is None:
+            return True
+        real = os.path.realpath(path)
+        return any(os.path.commonpath([real, root]) == root for root in self.allowed_roots)
+
+    def info(self):
+        return {
+            'model_name': self.embedder.model_name,
+            'loaded': self.embedder.model is not None,
+            'pid': os.getpid()
+        }
+
+    def serve_forever(self):
+        kind, target = parse_address(self.address)
+        handler = self._handler()
+        if kind == 'unix':
+            # A socket left behind by a previous server would block the bind
+            if os.path.exists(target):
+                os.remove(target)
+            self._server = _ThreadingUnixHTTPServer(target, handler)
+        else:
+            self._server = _ThreadingTCPHTTPServer(target, handler)
+        print(f"Embedding server listening on {self.address}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if kind == 'unix' and os.path.exists(target):
+                os.remove(target)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open so clients don't reconnect per request
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args, **kwargs):
+                pass
+
+            def send_body(self, status, body, content_type, headers=()):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, status, payload):
+                self.send_body(status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+            def do_GET(self):
+                if self.path == '/info':
+                    self.send_json(200, server.info())
+                else:
+                    self.send_json(404, {'error': 'Not found'})
+
+            def do_POST(self):
+                if self.path == '/embed/image-data':
+                    self.embed_image_data()
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    data = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self.send_json(400, {'error': 'Invalid JSON'})
+                    return
+
+                model_name = data.get('model')
+                if self.path == '/embed/texts':
+                    batcher = server.batcher('texts' if data.get('cache', True) else 'bulk_texts', model_name)
+                    items = data.get('texts')
+                elif self.path == '/embed/images':
+                    batcher, items = server.batcher('images', model_name), data.get('paths')
+                else:
+                    self.send_json(404, {'error': 'Not found'})
+                    return
+                if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+                    self.send_json(400, {'error': 'Expected a list of strings'})
+                    return
+                if self.path == '/embed/images' and not all(server.path_allowed(item) for item in items):
+                    self.send_json(403, {'error': 'Image paths must be under the server\'s allowed roots'})
+                    return
+
+                try:
+                    results = batcher.submit(items).result()
+                except Exception as e:
+                    self.send_json(503, {'error': str(e)})
+                    return
+
+                self.send_embeddings(results)
+
+            def embed_image_data(self):
+                """Embed one image sent as the raw request body"""
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    results = server.batcher('images', self.headers.get('X-Model')).submit([io.BytesIO(data)]).result()
+                except Exception as e:
+                    self.send_json(503, {'error': str(e)})
+                    return
+                self.send_embeddings(results)
+
+            def send_embeddings(self, results):
+                # Image batches hold None for unreadable files; send zero rows
+                missing = [i for i, row in enumerate(results) if row is None]
+                if len(results) == 0:
+                    embeddings = np.zeros((0, 0), dtype=np.float32)
+                elif missing and len(missing) == len(results):
+                    embeddings = np.zeros((len(results), 0), dtype=np.float32)
+                else:
+                    dimension = next(np.size(row) for row in results if row is not None)
+                    embeddings = np.zeros((len(results), dimension), dtype=np.float32)
+                    for i, row in enumerate(results):
+                        if row is not None:
+                            embeddings[i] = np.ravel(row)
+                self.send_body(200, embeddings.tobytes(), 'application/octet-stream', [
+                    ('X-Embedding-Shape', f"{embeddings.shape[0]},{embeddings.shape[1]}"),
+                    ('X-Missing', ','.join(map(str, missing)))
+                ])
+
+        return Handler
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class EmbeddingClient:
+    def __init__(self, address, timeout=60, model_name=None):
+        """Drop-in replacement for ImageEmbedder backed by an EmbeddingServer.
+
+        Uses the server's model unless `model_name` names another one. Each
+        thread keeps its own keep-alive connection. Like ImageEmbedder,
+        methods print errors and return None when embedding fails, including
+        when the server cannot be reached.
+        """
+        self.address = address
+        self.timeout = timeout
+        self._model_name = model_name
+        self._local = threading.local()
+        self._info = None
+        print(f"Using embedding server at {address}")
+
+    @property
+    def model_name(self):
+        if self._model_name:
+            return self._model_name
+        info = self.info()
+        return info['model_name'] if info else None
+
+    @property
+    def model(self):
+        """Truthy when the server is reachable and its model is loaded, like ImageEmbedder.model"""
+        info = self.info()
+        if self._model_name:
+            return self._model_name if info else None
+        return info['model_name'] if info and info['loaded'] else None
+
+    def info(self):
+        """The server's model details, or None if it can't be reached.
+
+        Cached until a request fails or a kept-alive connection is reset,
+        since the server may have been restarted with another model.
+        """
+        if self._info is None:
+            try:
+                status, _, body = self._request('GET', '/info')
+                if status == 200:
+                    self._info = json.loads(body)
+            except OSError as e:
+                print(f"Embedding server not reachable: {e}")
+        return self._info
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            kind, target = parse_address(self.address)
+            if kind == 'unix':
+                connection = _UnixHTTPConnection(target, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(*target, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method, path, payload=None, body=None, headers=None):
+        if payload is not None:
+            body = json.dumps(payload).encode('utf-8')
+            headers = {'Content-Type': 'application/json'}
+        headers = headers or {}
+        # Retry once on a fresh connection if a kept-alive one was closed
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.headers, response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                self._local.connection = None
+                self._info = None
+                if attempt:
+                    raise
+
+    def _embed(self, path, payload, kind, body=None):
+        headers = None
+        if self._model_name:
+            if payload is not None:
+                payload['model'] = self._model_name
+            else:
+                headers = {'X-Model': self._model_name}
+        if body is not None:
+            headers = {**(headers or {}), 'Content-Type': 'application/octet-stream'}
+        try:
+            with EMBED_SECONDS.time(kind=kind, stage='remote'):
+                status, headers, body = self._request('POST', path, payload, body=body, headers=headers)
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Error reaching embedding server: {e}")
+            return None, []
+        if status != 200:
+            print(f"Embedding server error: {json.loads(body).get('error')}")
+            self._info = None
+            return None, []
+        rows, dimension = (int(value) for value in headers['X-Embedding-Shape'].split(','))
+        embeddings = np.frombuffer(body, dtype=np.float32).reshape(rows, dimension).copy()
+        missing = [int(i) for i in headers.get('X-Missing', '').split(',') if i]
+        return embeddings, missing
+
+    def embed_image(self, image_path):
+        """Generate embedding for an image file"""
+        return self.embed_images([image_path])[0]
+
+    def embed_images(self, image_paths, batch_size=32):
+        """Generate embeddings for many image files; None for images that could not be read"""
+        # The server resolves paths itself
+        image_paths = [os.path.abspath(path) for path in image_paths]
+        embeddings, missing = self._embed('/embed/images', {'paths': image_paths}, 'image_batch')
+        if embeddings is None:
+            return [None] * len(image_paths)
+        missing = set(missing)
+        return [None if i in missing else embeddings[i:i + 1] for i in range(len(image_paths))]
+
+    def embed_image_data(self, data):
+        """Generate embedding for an image given as bytes; the server never writes it to disk"""
+        embeddings, missing = self._embed('/embed/image-data', None, 'image', body=data)
+        if embeddings is None or missing:
+            return None
+        return embeddings[:1]
+
+    def embed_text(self, text):
+        """Generate embedding for text query"""
+        embeddings = self.embed_texts([text], cache=True)
+        return None if embeddings is None else embeddings[:1]
+
+    def embed_texts(self, texts, batch_size=256, cache=False):
+        """Generate embeddings for many texts; with cache=True the server's query cache is used"""
+        embeddings, _ = self._embed('/embed/texts', {'texts': list(texts), 'cache': cache}, 'text_batch')
+        return embeddings
+
+    def compute_similarity(self, image_embedding, text_embedding):
+        """Compute cosine similarity between image and text embeddings"""
+        from models.image_embedder import compute_similarity
+        return compute_similarity(image_embedding, text_embedding)
@@ -1,15 +1,35 @@
-import torch
 import numpy as np
+import io
 import os
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
+from utils.metrics import EMBED_SECONDS, CACHE_REQUESTS
 
-# Handle potential CLIP import errors more gracefully
-try:
-    import clip
-    CLIP_AVAILABLE = True
-except ImportError:
-    print("WARNING: CLIP model not available. Please install it with: pip install git+https://github.com/openai/CLIP.git")
-    CLIP_AVAILABLE = False
+# Address of a shared embedding server (see models/embedding_service.py);
+# when set, this process is a client and never loads torch or the model
+EMBEDDING_SERVER = os.environ.get('EMBEDDING_SERVER')
+LOAD_MODEL = not EMBEDDING_SERVER and os.environ.get('IMAGE_EMBEDDER') != 'stub'
+
+# Model used for new indexes; an existing index records the model that
+# built it and is always queried with that model (see get_embedder)
+DEFAULT_MODEL = 'stub' if os.environ.get('IMAGE_EMBEDDER') == 'stub' else os.environ.get('CLIP_MODEL', 'ViT-B/32')
+
+TORCH_AVAILABLE = CLIP_AVAILABLE = False
+if LOAD_MODEL:
+    try:
+        import torch
+        TORCH_AVAILABLE = True
+    except ImportError:
+        print("WARNING: PyTorch not available. Please install it with: pip install torch torchvision")
+    
+    # Handle potential CLIP import errors more gracefully
+    try:
+        import clip
+        CLIP_AVAILABLE = True
+    except ImportError:
+        print("WARNING: CLIP model not available. Please install it with: pip install git+https://github.com/openai/CLIP.git")
 
 try:
     from PIL import Image
@@ -19,13 +39,19 @@ except ImportError:
     PIL_AVAILABLE = False
 
 class ImageEmbedder:
-    def __init__(self, model_name="ViT-B/32"):
+    def __init__(self, model_name=DEFAULT_MODEL):
         """Initialize the CLIP model for image embedding"""
         self.model = None
         self.preprocess = None
         self.device = "cpu"
+        self.model_name = model_name
         
-        if not CLIP_AVAILABLE or not PIL_AVAILABLE:
+        # LRU cache of text embeddings; repeated queries skip the text encoder
+        self.text_cache_size = int(os.environ.get('TEXT_CACHE_SIZE', 1024))
+        self._text_cache = OrderedDict()
+        self._text_cache_lock = threading.Lock()
+        
+        if not TORCH_AVAILABLE or not CLIP_AVAILABLE or not PIL_AVAILABLE:
             print("WARNING: Required dependencies not available. Image embedding will not work.")
             return
             
@@ -51,55 +77,303 @@ class ImageEmbedder:
                 return None
                 
             # Load and preprocess image
-            image = Image.open(image_path).convert("RGB")
-            image_input = self.preprocess(image).unsqueeze(0).to(self.device)
+            with EMBED_SECONDS.time(kind='image', stage='decode'):
+                image = Image.open(image_path).convert("RGB")
+                image_input = self.preprocess(image).unsqueeze(0).to(self.device)
             
             # Generate embedding
-            with torch.no_grad():
-                image_features = self.model.encode_image(image_input)
-                
-            # Normalize features
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            return image_features.cpu().numpy()
+            with EMBED_SECONDS.time(kind='image', stage='encode'):
+                with torch.no_grad():
+                    image_features = self.model.encode_image(image_input)
+                    
+                # Normalize features
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                return image_features.cpu().numpy()
             
         except Exception as e:
             print(f"Error embedding image {image_path}: {e}")
             return None
             
+    def embed_image_data(self, data):
+        """Generate embedding for an image given as bytes, without writing it to disk"""
+        return self.embed_images([io.BytesIO(data)])[0]
+            
+    def embed_images(self, image_paths, batch_size=32):
+        """Generate embeddings for many image files, batched through the image encoder.
+
+        Paths may also be binary file objects. Returns a list with a (1, d)
+        array per path, or None for images that could not be read.
+        """
+        results = [None] * len(image_paths)
+        if self.model is None or self.preprocess is None:
+            print(f"Cannot embed images: CLIP model not loaded")
+            return results
+        
+        for start in range(0, len(image_paths), batch_size):
+            rows, inputs = [], []
+            with EMBED_SECONDS.time(kind='image_batch', stage='decode'):
+                for i in range(start, min(start + batch_size, len(image_paths))):
+                    try:
+                        with Image.open(image_paths[i]) as image:
+                            inputs.append(self.preprocess(image.convert("RGB")))
+                        rows.append(i)
+                    except Exception as e:
+                        print(f"Error embedding image {image_paths[i]}: {e}")
+            if not inputs:
+                continue
+            
+            try:
+                with EMBED_SECONDS.time(kind='image_batch', stage='encode'):
+                    with torch.no_grad():
+                        image_features = self.model.encode_image(torch.stack(inputs).to(self.device))
+                    image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                    image_features = image_features.cpu().numpy().astype(np.float32)
+                for row, features in zip(rows, image_features):
+                    results[row] = features.reshape(1, -1)
+            except Exception as e:
+                print(f"Error embedding {len(inputs)} images: {e}")
+        return results
+            
     def embed_text(self, text):
         """Generate embedding for text query"""
         if self.model is None:
             print(f"Cannot embed text: CLIP model not loaded")
             return None
             
+        with self._text_cache_lock:
+            cached = self._text_cache.get(text)
+            if cached is not None:
+                self._text_cache.move_to_end(text)
+        if cached is not None:
+            CACHE_REQUESTS.inc(cache='text_embedding', result='hit')
+            return cached
+        CACHE_REQUESTS.inc(cache='text_embedding', result='miss')
+            
         try:
             # Tokenize and encode text
-            text_input = clip.tokenize([text]).to(self.device)
-            with torch.no_grad():
-                text_features = self.model.encode_text(text_input)
-                
-            # Normalize features
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            return text_features.cpu().numpy()
+            with EMBED_SECONDS.time(kind='text', stage='encode'):
+                text_input = clip.tokenize([text]).to(self.device)
+                with torch.no_grad():
+                    text_features = self.model.encode_text(text_input)
+                    
+                # Normalize features
+                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+                text_features = text_features.cpu().numpy()
+            
+            # Cached arrays are shared between callers, so keep them read-only
+            text_features.setflags(write=False)
+            
+            if self.text_cache_size > 0:
+                with self._text_cache_lock:
+                    self._text_cache[text] = text_features
+                    if len(self._text_cache) > self.text_cache_size:
+                        self._text_cache.popitem(last=False)
+            return text_features
             
         except Exception as e:
             print(f"Error embedding text '{text}': {e}")
             return None
             
+    def embed_texts(self, texts, batch_size=256, cache=False):
+        """Generate embeddings for many texts, batched through the text encoder.
+
+        With cache=True, texts in the query cache are not re-encoded and new
+        embeddings are added to it; leave it off for bulk work such as label
+        vocabularies so they don't evict user queries. Returns an (n, d)
+        array, or None if the model is not loaded.
+        """
+        if self.model is None:
+            print(f"Cannot embed text: CLIP model not loaded")
+            return None
+        
+        if cache:
+            return self._embed_texts_cached(texts, batch_size)
+            
+        try:
+            batches = []
+            for start in range(0, len(texts), batch_size):
+                with EMBED_SECONDS.time(kind='text_batch', stage='encode'):
+                    text_input = clip.tokenize(texts[start:start + batch_size], truncate=True).to(self.device)
+                    with torch.no_grad():
+                        text_features = self.model.encode_text(text_input)
+                    text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+                    batches.append(text_features.cpu().numpy().astype(np.float32))
+            return np.vstack(batches)
+            
+        except Exception as e:
+            print(f"Error embedding {len(texts)} texts: {e}")
+            return None
+            
+    def _embed_texts_cached(self, texts, batch_size):
+        cached = {}
+        with self._text_cache_lock:
+            for text in texts:
+                if text in self._text_cache:
+                    self._text_cache.move_to_end(text)
+                    cached[text] = self._text_cache[text].reshape(-1)
+        
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        CACHE_REQUESTS.inc(len(texts) - len(missing), cache='text_embedding', result='hit')
+        CACHE_REQUESTS.inc(len(missing), cache='text_embedding', result='miss')
+        if missing:
+            embeddings = self.embed_texts(missing, batch_size)
+            if embeddings is None:
+                return None
+            with self._text_cache_lock:
+                for text, embedding in zip(missing, embeddings):
+                    features = embedding.reshape(1, -1)
+                    features.setflags(write=False)
+                    cached[text] = embedding
+                    if self.text_cache_size > 0:
+                        self._text_cache[text] = features
+                        if len(self._text_cache) > self.text_cache_size:
+                            self._text_cache.popitem(last=False)
+        return np.vstack([cached[text] for text in texts]).astype(np.float32)
+            
     def compute_similarity(self, image_embedding, text_embedding):
         """Compute cosine similarity between image and text embeddings"""
-        if image_embedding is None or text_embedding is None:
-            return 0.0
+        return compute_similarity(image_embedding, text_embedding)
+
+class StubEmbedder:
+    def __init__(self, dimension=512, model_name='stub'):
+        """Deterministic stand-in for CLIP used by benchmarks and load tests.
+
+        Embeddings are random unit vectors seeded from a hash of the image
+        bytes or the text, so they are stable across runs and processes and
+        need neither torch nor model weights. Stubs with other model names
+        give different vectors, which is enough to exercise model upgrades.
+        """
+        self.model = 'stub'
+        self.model_name = model_name
+        self.dimension = dimension
+        print("Using stub embedder (IMAGE_EMBEDDER=stub); results are not semantically meaningful")
+        
+    def _vector(self, data):
+        if self.model_name != 'stub':
+            data = self.model_name.encode('utf-8') + b'\0' + data
+        seed = int.from_bytes(hashlib.sha256(data).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).reshape(1, -1)
+        
+    def embed_image(self, image_path):
+        """Generate embedding for an image file"""
+        try:
+            with EMBED_SECONDS.time(kind='image', stage='encode'):
+                with open(image_path, 'rb') as f:
+                    return self._vector(f.read())
+        except OSError as e:
+            print(f"Error embedding image {image_path}: {e}")
+            return None
+            
+    def embed_image_data(self, data):
+        """Generate embedding for an image given as bytes"""
+        with EMBED_SECONDS.time(kind='image', stage='encode'):
+            return self._vector(data)
             
-        # Convert to torch tensors if they are numpy arrays
-        if isinstance(image_embedding, np.ndarray):
-            image_embedding = torch.from_numpy(image_embedding)
-        if isinstance(text_embedding, np.ndarray):
-            text_embedding = torch.from_numpy(text_embedding)
+    def embed_images(self, image_paths, batch_size=32):
+        """Generate embeddings for many image files (or binary file objects)"""
+        return [self.embed_image_data(path.read()) if hasattr(path, 'read') else self.embed_image(path)
+                for path in image_paths]
             
-        # Compute cosine similarity
-        similarity = (image_embedding @ text_embedding.T).item()
-        return similarity
+    def embed_text(self, text):
+        """Generate embedding for text query"""
+        with EMBED_SECONDS.time(kind='text', stage='encode'):
+            return self._vector(text.encode('utf-8'))
+            
+    def embed_texts(self, texts, batch_size=256, cache=False):
+        """Generate embeddings for many texts"""
+        with EMBED_SECONDS.time(kind='text_batch', stage='encode'):
+            return np.vstack([self._vector(text.encode('utf-8')) for text in texts])
+            
+    def compute_similarity(self, image_embedding, text_embedding):
+        """Compute cosine similarity between image and text embeddings"""
+        return compute_similarity(image_embedding, text_embedding)
+
+def compute_similarity(image_embedding, text_embedding):
+    """Compute cosine similarity between normalized embeddings"""
+    if image_embedding is None or text_embedding is None:
+        return 0.0
+        
+    # Accept torch tensors as well as numpy arrays
+    if hasattr(image_embedding, 'cpu'):
+        image_embedding = image_embedding.cpu().numpy()
+    if hasattr(text_embedding, 'cpu'):
+        text_embedding = text_embedding.cpu().numpy()
+        
+    return float(np.dot(np.ravel(image_embedding), np.ravel(text_embedding)))
+
+def _create_embedder(model_name=None):
+    # EMBEDDING_SERVER makes it a client of a shared embedding server and
+    # IMAGE_EMBEDDER=stub swaps in the offline stub
+    if EMBEDDING_SERVER:
+        from models.embedding_service import EmbeddingClient
+        return EmbeddingClient(EMBEDDING_SERVER, model_name=model_name)
+    if os.environ.get('IMAGE_EMBEDDER') == 'stub':
+        return StubEmbedder(model_name=model_name or 'stub')
+    return ImageEmbedder(model_name or DEFAULT_MODEL)
 
 # Create singleton instance
-embedder = ImageEmbedder() 
\ No newline at end of file
+embedder = _create_embedder()
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+def get_embedder(model_name=None):
+    """The embedder for a model, loading it on first use; the default one for None.
+
+    Used while migrating an index to another model, and by every index to
+    embed queries with the model its vectors came from.
+    """
+    if model_name is None or model_name == DEFAULT_MODEL:
+        return embedder
+    with _embedders_lock:
+        if model_name not in _embedders:
+            _embedders[model_name] = _create_embedder(model_name)
+        return _embedders[model_name]
+
+class EmbeddingCache:
+    def __init__(self, max_size=256):
+        """Thread-safe LRU cache of read-only embeddings"""
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+        
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        value.setflags(write=False)
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+# Embeddings of query images (see embed_probe_image), keyed by content hash
+probe_cache = EmbeddingCache(int(os.environ.get('PROBE_CACHE_SIZE', 256)))
+
+def embed_probe_image(data, model_name=None):
+    """Embedding of a query image given as bytes, for searches that don't add it to the index.
+
+    Nothing is written to disk. Embeddings are cached by the hash of the
+    bytes, so probing with the same picture again skips the image encoder.
+    Returns None if the image can't be read.
+    """
+    key = (model_name or DEFAULT_MODEL, hashlib.sha256(data).hexdigest())
+    embedding = probe_cache.get(key)
+    if embedding is not None:
+        CACHE_REQUESTS.inc(cache='probe_embedding', result='hit')
+        return embedding
+    CACHE_REQUESTS.inc(cache='probe_embedding', result='miss')
+    
+    embedding = get_embedder(model_name).embed_image_data(data)
+    if embedding is not None:
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        probe_cache.put(key, embedding)
+    return embedding
@@ -1,32 +1,133 @@
 import numpy as np
 import os
 import json
+import threading
 from pathlib import Path
-from models.image_embedder import embedder
+from models.image_embedder import DEFAULT_MODEL, get_embedder
+from utils.filelock import FileLock
+from utils.metrics import SEARCH_SECONDS, INGEST_SECONDS
+from models.clustering import ClusterStore
+from models.neighbors import NeighborGraph
+from models.metadata_store import MetadataStore
+from models.labels import label_vocabulary
+from models.rerank import RERANKERS
+from models.numpy_index import NumpyIndex
 
 # Import FAISS directly with proper error handling
 try:
     import faiss
     FAISS_AVAILABLE = True
 except ImportError:
-    print("ERROR: FAISS is not available. Vector search functionality will not work.")
+    print("WARNING: FAISS is not available, using the slower NumPy search backend.")
     print("Please install FAISS with: conda install -c conda-forge faiss-cpu")
     FAISS_AVAILABLE = False
 
+# Search backends: 'faiss' (default when installed) or 'numpy'
+INDEX_BACKENDS = ('faiss', 'numpy')
+
+class IndexSnapshot:
+    def __init__(self, index, embeddings, metadata, generation):
+        """A consistent view of an ImageIndex, searched without holding its lock.
+
+        Writers never change these objects in place: adds and removals swap
+        in a new FAISS index, embeddings matrix and metadata columns, and
+        NumPy indexes only append past the rows a snapshot covers.
+        """
+        self.index = index
+        self.embeddings = embeddings
+        self.metadata = metadata
+        self.generation = generation
+
+    def format_results(self, scores, positions):
+        """Result dicts for a row of (scores, positions), gathering ids and paths in bulk"""
+        positions = np.asarray(positions, dtype=np.int64)
+        valid = (positions >= 0) & (positions < len(self.metadata))
+        positions = positions[valid]
+        scores = np.asarray(scores)[valid].tolist()
+        ids = self.metadata.ids(positions).tolist()
+        paths = self.metadata.paths(positions)
+        return [{'path': path, 'id': image_id, 'score': score}
+                for path, image_id, score in zip(paths, ids, scores)]
+
+    def range_search(self, search_vector, radius, positions=None):
+        """All images scoring at least radius, best first, shaped like a FAISS result"""
+        if positions is not None:
+            scores, indices = self.search_subset(search_vector, positions, len(positions))
+            keep = scores[0] >= radius
+            return scores[:, keep], indices[:, keep]
+        
+        if not isinstance(self.index, NumpyIndex):
+            # FAISS keeps scores strictly above the radius; step just below it
+            # so a score equal to the radius is kept, as with NumpyIndex
+            radius = np.nextafter(np.float32(radius), np.float32(-np.inf))
+        lims, scores, indices = self.index.range_search(np.ascontiguousarray(search_vector, dtype=np.float32), radius)
+        scores, indices = scores[lims[0]:lims[1]], indices[lims[0]:lims[1]]
+        order = np.argsort(-scores, kind='stable')
+        return scores[order].reshape(1, -1), indices[order].reshape(1, -1)
+
+    def rerank(self, search_vector, candidates, k, scorer='exact', **context):
+        """Re-score candidate positions against the full-precision embeddings.
+
+        Returns (scores, positions) shaped like a FAISS result.
+        """
+        if isinstance(scorer, str):
+            scorer = RERANKERS[scorer]
+        candidates = candidates[candidates >= 0]
+        if self.embeddings is None or len(candidates) == 0:
+            return np.empty((1, 0), dtype=np.float32), np.empty((1, 0), dtype=np.int64)
+        
+        order, scores = scorer(search_vector, self.embeddings[candidates], k, **context)
+        return np.asarray(scores).reshape(1, -1), candidates[order].reshape(1, -1)
+
+    def search_subset(self, search_vector, positions, k):
+        """Exact top-k among the given positions, shaped like a FAISS result"""
+        if self.embeddings is not None:
+            positions = positions[(positions >= 0) & (positions < len(self.embeddings))]
+        if self.embeddings is None or len(positions) == 0 or k <= 0:
+            return np.empty((1, 0), dtype=np.float32), np.empty((1, 0), dtype=np.int64)
+        scores = self.embeddings[positions] @ search_vector.reshape(-1)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return scores[top].reshape(1, -1), positions[top].reshape(1, -1)
+
 class ImageIndex:
-    def __init__(self, dimension=512, index_dir="index"):
-        """Initialize FAISS index for image search"""
+    def __init__(self, dimension=512, index_dir="index", backend=None, model_name=None):
+        """Initialize the vector index for image search.
+
+        The FAISS backend keeps its own copy of the vectors in
+        image_index.faiss. The NumPy backend searches the saved embedding
+        matrix directly, memory-mapped, so it needs nothing beyond NumPy;
+        choose it with backend='numpy' or INDEX_BACKEND=numpy.
+
+        The embedding model is recorded in model.json and queries are always
+        embedded with it; `model_name` (default: DEFAULT_MODEL) and
+        `dimension` only apply to an index that has no record yet.
+        """
         self.dimension = dimension
+        self.model_name = model_name or DEFAULT_MODEL
         self.index_dir = index_dir
+        backend = backend or os.environ.get('INDEX_BACKEND') or ('faiss' if FAISS_AVAILABLE else 'numpy')
+        if backend not in INDEX_BACKENDS:
+            raise ValueError(f"Unknown index backend: {backend}")
+        if backend == 'faiss' and not FAISS_AVAILABLE:
+            print("WARNING: FAISS backend requested but not available, using NumPy")
+            backend = 'numpy'
+        self.backend = backend
         self.index_path = os.path.join(index_dir, "image_index.faiss")
+        # Columnar metadata files share this prefix; the JSON file is the
+        # legacy format, read once and replaced on the next save
+        self.metadata_prefix = os.path.join(index_dir, "image_metadata")
         self.metadata_path = os.path.join(index_dir, "image_metadata.json")
         self.embeddings_path = os.path.join(index_dir, "image_embeddings.npy")
+        self.generation_path = os.path.join(index_dir, "generation")
+        self.model_path = os.path.join(index_dir, "model.json")
         
         # Create index directory if it doesn't exist
         Path(index_dir).mkdir(parents=True, exist_ok=True)
         
-        # Initialize image metadata
-        self.image_metadata = []
+        # Initialize image metadata (path and id per index position)
+        self.image_metadata = MetadataStore()
         
         # Cache of image embeddings
         self.image_embeddings = None
@@ -34,108 +135,367 @@ class ImageIndex:
         # Initialize index
         self.index = None
         
+        # Generation of the on-disk snapshot this instance holds; bumped on
+        # every save so other processes know to reload
+        self.generation = 0
+        
+        # Whether images were added with save=False and not yet saved
+        self._dirty = False
+        
+        # Index being built with another model while a model migration runs;
+        # new images are embedded into it as well (see utils/migration.py)
+        self.shadow = None
+        
+        # Persisted k-means clusterings, kept in step with the index
+        self.clusters = ClusterStore(index_dir)
+        self._cluster_lock = threading.Lock()
+        
+        # Precomputed top-k neighbours, serving image-only searches
+        self.neighbors = NeighborGraph(index_dir)
+        self._neighbor_lock = threading.Lock()
+        
+        # Random sample of embeddings used to normalise scores
+        self._score_sample = None
+        self._score_sample_key = None
+        
+        # Bumped whenever positions are reassigned (reload, rebuild, removal),
+        # so work done on a snapshot knows whether it still applies
+        self.layout_version = 0
+        
+        # Guards the index, metadata and embeddings against concurrent
+        # updates from background jobs
+        self.lock = threading.RLock()
+        
+        # Serialises writes to the on-disk index across processes
+        self.write_lock = FileLock(os.path.join(index_dir, ".lock"))
+        
         # Load existing index or create a new one
         self.load_or_create_index()
         
     def load_or_create_index(self):
         """Load existing index or create a new one"""
-        if not FAISS_AVAILABLE:
-            print("ERROR: FAISS is not available, index features will not work")
-            return
+        with self.write_lock:
+            generation = self.read_generation()
             
-        if os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
-            try:
-                # Load existing index
-                self.index = faiss.read_index(self.index_path)
-                with open(self.metadata_path, 'r') as f:
-                    self.image_metadata = json.load(f)
+            # The model may have changed since the last load (a migration
+            # cut over in another process)
+            model = self.read_model()
+            if model:
+                self.model_name = model['model_name']
+                self.dimension = model['dimension']
+            
+            image_metadata = MetadataStore.load(self.metadata_prefix)
+            if image_metadata is None and os.path.exists(self.metadata_path):
+                image_metadata = MetadataStore.load_json(self.metadata_path)
+            
+            if image_metadata is not None and (os.path.exists(self.index_path) or os.path.exists(self.embeddings_path)):
+                try:
+                    # Load embeddings if available, memory-mapped: the NumPy
+                    # backend searches them in place, and reopening an index
+                    # only costs page-cache reads. Adds and removals replace
+                    # the array with an in-memory copy
+                    if os.path.exists(self.embeddings_path):
+                        image_embeddings = np.load(self.embeddings_path, mmap_mode='r')
+                    else:
+                        image_embeddings = None
                     
-                # Load embeddings if available
-                if os.path.exists(self.embeddings_path):
-                    self.image_embeddings = np.load(self.embeddings_path)
-                else:
-                    # Create embeddings array for existing images
-                    self.image_embeddings = np.zeros((len(self.image_metadata), self.dimension), dtype=np.float32)
-                
-                print(f"Loaded index with {len(self.image_metadata)} images")
-            except Exception as e:
-                print(f"Error loading index: {e}")
+                    if self.backend == 'faiss' and os.path.exists(self.index_path):
+                        index = faiss.read_index(self.index_path)
+                        if image_embeddings is None:
+                            # Create embeddings array for existing images
+                            image_embeddings = np.zeros((len(image_metadata), self.dimension), dtype=np.float32)
+                        elif index.ntotal != len(image_embeddings):
+                            # Last saved by the NumPy backend
+                            index = self._new_index(image_embeddings)
+                    elif image_embeddings is not None:
+                        index = self._new_index(image_embeddings)
+                    else:
+                        # Only a FAISS index was saved; recover its vectors
+                        if not FAISS_AVAILABLE:
+                            raise RuntimeError("index was saved without embeddings and FAISS is not available")
+                        image_embeddings = faiss.read_index(self.index_path).reconstruct_n(0, len(image_metadata))
+                        index = self._new_index(image_embeddings)
+                    
+                    if self.backend == 'numpy':
+                        image_embeddings = index.embeddings
+                    
+                    print(f"Loaded index with {len(image_metadata)} images ({self.backend} backend)")
+                except Exception as e:
+                    print(f"Error loading index: {e}")
+                    # Create new index
+                    index = self._new_index()
+                    image_metadata = MetadataStore()
+                    image_embeddings = np.zeros((0, self.dimension), dtype=np.float32)
+                    print("Created new index after failed load")
+            else:
                 # Create new index
-                self.index = faiss.IndexFlatIP(self.dimension)
-                self.image_metadata = []
-                self.image_embeddings = np.zeros((0, self.dimension), dtype=np.float32)
-                print("Created new index after failed load")
+                index = self._new_index()
+                image_metadata = MetadataStore()
+                image_embeddings = np.zeros((0, self.dimension), dtype=np.float32)
+                print("Created new index")
+            
+            with self.lock:
+                self.index = index
+                self.image_metadata = image_metadata
+                self.image_embeddings = image_embeddings
+                self.generation = generation
+                self.clusters.clear()
+                self.neighbors.clear()
+                self.layout_version += 1
+            
+    def _new_index(self, embeddings=None):
+        """An empty index for the configured backend, optionally filled with embeddings"""
+        if self.backend == 'numpy':
+            return NumpyIndex(self.dimension, embeddings)
+        index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
+        if embeddings is not None and len(embeddings):
+            index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+        return index
+    
+    def _add_vectors(self, embeddings):
+        """Add vectors to the index and the embeddings cache"""
+        if self.backend == 'numpy':
+            self.index.add(embeddings)
+        else:
+            # Copy rather than grow in place, so snapshots being searched stay valid
+            index = faiss.clone_index(self.index)
+            index.add(embeddings)
+            self.index = index
+        if self.backend == 'numpy':
+            # The NumPy index stores the embeddings itself
+            self.image_embeddings = self.index.embeddings
+        elif self.image_embeddings is not None and len(self.image_embeddings) > 0:
+            self.image_embeddings = np.vstack([self.image_embeddings, embeddings])
         else:
-            # Create new index
-            self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
-            self.image_metadata = []
-            self.image_embeddings = np.zeros((0, self.dimension), dtype=np.float32)
-            print("Created new index")
+            self.image_embeddings = np.array(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+    
+    def resident_bytes(self):
+        """Approximate memory held by this index, not counting memory-mapped arrays"""
+        def resident(array):
+            return 0 if array is None or isinstance(array, np.memmap) else array.nbytes
+        
+        with self.lock:
+            total = resident(self.image_embeddings) + resident(self.neighbors.neighbors) + resident(self.neighbors.scores)
+            if self.backend == 'faiss' and self.index is not None:
+                # A flat FAISS index keeps its own float32 copy of every vector
+                total += self.index.ntotal * self.dimension * 4
+            total += self.image_metadata.resident_bytes()
+        return total
+    
+    @property
+    def embedder(self):
+        """Embedder for the model this index was built with"""
+        return get_embedder(self.model_name)
+    
+    @property
+    def labels(self):
+        """Label vocabulary embedded with this index's model"""
+        return label_vocabulary.for_model(self.model_name)
+    
+    def read_model(self):
+        """The recorded {'model_name', 'dimension'} of the index, or None for older indexes"""
+        try:
+            with open(self.model_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def read_generation(self):
+        """Read the generation of the snapshot currently on disk"""
+        try:
+            with open(self.generation_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+            
+    def reload_if_changed(self):
+        """Reload the index if another process saved a newer snapshot.
+
+        Unsaved additions are never discarded; they are written over the
+        snapshot on the next save. Returns True if the index was reloaded.
+        """
+        if self._dirty or self.read_generation() == self.generation:
+            return False
+        with self.write_lock:
+            # Check again now that no other process is mid-save
+            if self._dirty or self.read_generation() == self.generation:
+                return False
+            print("Index snapshot changed on disk, reloading")
+            self.load_or_create_index()
+            return True
             
     def save_index(self):
         """Save index and metadata to disk"""
-        if not FAISS_AVAILABLE or self.index is None:
-            print("ERROR: Cannot save index - FAISS not available or index not initialized")
+        if self.index is None:
+            print("ERROR: Cannot save index - index not initialized")
             return
             
-        if len(self.image_metadata) > 0:
-            try:
-                faiss.write_index(self.index, self.index_path)
-                with open(self.metadata_path, 'w') as f:
-                    json.dump(self.image_metadata, f, indent=2)
+        with self.write_lock, self.lock, INGEST_SECONDS.time(stage='index_save'):
+            if len(self.image_metadata) > 0:
+                try:
+                    # Write each file to the side and rename it into place so
+                    # readers in other processes never load a partial file
+                    if self.backend == 'faiss':
+                        faiss.write_index(self.index, f"{self.index_path}.tmp")
+                        os.replace(f"{self.index_path}.tmp", self.index_path)
+                    elif os.path.exists(self.index_path):
+                        # The embeddings file is the NumPy index; drop the stale FAISS copy
+                        os.remove(self.index_path)
+                    
+                    self.image_metadata.save(self.metadata_prefix)
+                    if os.path.exists(self.metadata_path):
+                        os.remove(self.metadata_path)
+                        
+                    # Save embeddings
+                    if self.image_embeddings is not None and len(self.image_embeddings) > 0:
+                        with open(f"{self.embeddings_path}.tmp", 'wb') as f:
+                            np.save(f, self.image_embeddings)
+                        os.replace(f"{self.embeddings_path}.tmp", self.embeddings_path)
                     
-                # Save embeddings
-                if self.image_embeddings is not None and len(self.image_embeddings) > 0:
-                    np.save(self.embeddings_path, self.image_embeddings)
+                    if self.read_model() != {'model_name': self.model_name, 'dimension': self.dimension}:
+                        with open(f"{self.model_path}.tmp", 'w') as f:
+                            json.dump({'model_name': self.model_name, 'dimension': self.dimension}, f)
+                        os.replace(f"{self.model_path}.tmp", self.model_path)
                     
-                print(f"Saved index with {len(self.image_metadata)} images")
-            except Exception as e:
-                print(f"Error saving index: {e}")
+                    # Publish the new snapshot
+                    self.generation = self.read_generation() + 1
+                    with open(f"{self.generation_path}.tmp", 'w') as f:
+                        f.write(str(self.generation))
+                    os.replace(f"{self.generation_path}.tmp", self.generation_path)
+                    self._dirty = False
+                    self.clusters.save(self.generation)
+                    if len(self.neighbors) == len(self.image_metadata):
+                        self.neighbors.save(self.generation)
+                        
+                    print(f"Saved index with {len(self.image_metadata)} images")
+                except Exception as e:
+                    print(f"Error saving index: {e}")
             
-    def add_image(self, image_path, embedding=None):
-        """Add image to the index"""
-        if not FAISS_AVAILABLE or self.index is None:
-            print("ERROR: Cannot add to index - FAISS not available or index not initialized")
+    def add_image(self, image_path, embedding=None, save=True, model_name=None):
+        """Add image to the index.
+
+        Pass save=False when adding many images and call save_index() once
+        at the end instead of rewriting the index after every image.
+        `model_name` is the model that produced `embedding`; if the index
+        has switched to another model since, nothing is added.
+        """
+        if self.index is None:
+            print("ERROR: Cannot add to index - index not initialized")
             return False
             
         if embedding is None:
             # Generate embedding if not provided
-            embedding = embedder.embed_image(image_path)
+            embedding = self.embedder.embed_image(image_path)
             
         if embedding is not None:
             try:
-                # Add to index
-                self.index.add(embedding)
-                self.image_metadata.append({
-                    'path': image_path,
-                    'id': len(self.image_metadata)
-                })
-                
-                # Add to embeddings cache
-                if self.image_embeddings is not None:
-                    self.image_embeddings = np.vstack([self.image_embeddings, embedding])
-                else:
-                    self.image_embeddings = np.array([embedding])
-                
-                self.save_index()
+                with self.write_lock:
+                    # Pick up images added by other processes before appending
+                    if save:
+                        self.reload_if_changed()
+                    if model_name is not None and model_name != self.model_name:
+                        print(f"Not adding {image_path}: embedded with {model_name}, index uses {self.model_name}")
+                        return False
+                    
+                    with self.lock, INGEST_SECONDS.time(stage='index_add'):
+                        # Assign to existing clusters
+                        previous_size = len(self.image_metadata)
+                        self.clusters.extend(embedding, previous_size, self.generation)
+                        
+                        # Add to index and embeddings cache
+                        self._add_vectors(embedding)
+                        self.image_metadata.append(image_path)
+                        
+                        # Update the neighbour lists
+                        self.neighbors.extend(embedding, self.image_embeddings, previous_size, self.generation)
+                    
+                    if save:
+                        self.save_index()
+                    else:
+                        self._dirty = True
                 return True
             except Exception as e:
                 print(f"Error adding image to index: {e}")
         
         return False
         
-    def search(self, query, k=20, image_id=None, weight_text=0.7):
-        """Search for images similar to query text, optionally combine with an image"""
-        if not FAISS_AVAILABLE or self.index is None:
-            print("ERROR: Cannot search - FAISS not available or index not initialized")
+    def add_images(self, image_paths, embeddings, save=True, model_name=None):
+        """Add many images with precomputed embeddings in one step.
+
+        Returns the number of images added; none are added if `model_name`
+        (the model that produced the embeddings) is not the index's model.
+        """
+        if self.index is None:
+            print("ERROR: Cannot add to index - index not initialized")
+            return 0
+            
+        if len(image_paths) == 0:
+            return 0
+            
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(image_paths), -1)
+        
+        try:
+            with self.write_lock:
+                if save:
+                    self.reload_if_changed()
+                if model_name is not None and model_name != self.model_name:
+                    print(f"Not adding {len(image_paths)} images: embedded with {model_name}, index uses {self.model_name}")
+                    return 0
+                
+                with self.lock, INGEST_SECONDS.time(stage='index_add'):
+                    start = len(self.image_metadata)
+                    self.clusters.extend(embeddings, start, self.generation)
+                    self._add_vectors(embeddings)
+                    self.image_metadata.extend(image_paths)
+                    self.neighbors.extend(embeddings, self.image_embeddings, start, self.generation)
+                
+                if save:
+                    self.save_index()
+                else:
+                    self._dirty = True
+            return len(image_paths)
+        except Exception as e:
+            print(f"Error adding images to index: {e}")
+            return 0
+        
+    @SEARCH_SECONDS.timed(stage='total')
+    def search(self, query, k=20, image_id=None, weight_text=0.7, paths=None,
+               rerank=None, candidate_factor=10, diversity=0.3, threshold=None, normalize=False):
+        """Search for images similar to query text, optionally combine with an image.
+
+        If `paths` is given, only those images are considered; they are scored
+        exactly against the cached embeddings instead of searching the index.
+
+        With `rerank` (a name from RERANKERS or a scorer function), search
+        runs in two stages: k * candidate_factor candidates are fetched from
+        the index, then re-scored against the full-precision embeddings and
+        the best k kept.
+
+        With `threshold`, every image scoring at least the threshold is
+        returned (at most k, or all of them if k is None) using a range
+        search. With `normalize`, scores are reported, and thresholds read,
+        as standard deviations above the query's mean score over a sample
+        of the collection, which is far more stable across models than raw
+        cosine similarity.
+        """
+        if self.index is None:
+            print("ERROR: Cannot search - index not initialized")
             return []
             
         if self.index.ntotal == 0:
             return []
         
+        # Image-only searches are served from the precomputed neighbour lists
+        if not query and image_id is not None and paths is None and not rerank and threshold is None and not normalize:
+            results = self.similar_images(image_id, k)
+            if results is not None:
+                return results
+        
+        text_embedding = image_embedding = None
+        
         # Case 1: Only text search
         if image_id is None or image_id < 0 or image_id >= len(self.image_metadata):
-            text_embedding = embedder.embed_text(query)
+            text_embedding = self.embedder.embed_text(query)
             if text_embedding is None:
                 return []
                 
@@ -144,7 +504,7 @@ class ImageIndex:
         # Case 2: Combined text and image search
         elif query:
             # Get text embedding
-            text_embedding = embedder.embed_text(query)
+            text_embedding = self.embedder.embed_text(query)
             if text_embedding is None:
                 return []
                 
@@ -166,26 +526,283 @@ class ImageIndex:
                 return []
                 
             search_vector = image_embedding
+        
+        return self.search_by_vector(
+            search_vector, k, paths=paths, rerank=rerank, candidate_factor=candidate_factor,
+            threshold=threshold, normalize=normalize,
+            text_vector=text_embedding, image_vector=image_embedding,
+            weight_text=weight_text, diversity=diversity
+        )
+    
+    @SEARCH_SECONDS.timed(stage='total')
+    def search_composed(self, positive, negative=(), k=20, paths=None, rerank=None,
+                        candidate_factor=10, diversity=0.3, threshold=None, normalize=False):
+        """Search with weighted sets of positive and negative text prompts and images.
+
+        Terms are (kind, value, weight) tuples, kind 'text' or 'image' (an
+        index id). All prompts are embedded in one batch and the terms are
+        combined into a single query vector, positives added and negatives
+        subtracted, so the whole query costs one index pass.
+        """
+        if self.index is None:
+            print("ERROR: Cannot search - index not initialized")
+            return []
             
+        if self.index.ntotal == 0:
+            return []
+        
+        search_vector = self.compose_query(positive, negative)
+        if search_vector is None:
+            return []
+        return self.search_by_vector(search_vector, k, paths=paths, rerank=rerank,
+                                     candidate_factor=candidate_factor, threshold=threshold,
+                                     normalize=normalize, diversity=diversity)
+    
+    def compose_query(self, positive, negative=()):
+        """Combine weighted positive and negative terms into one unit query vector"""
+        terms = [(kind, value, weight) for kind, value, weight in positive]
+        terms += [(kind, value, -weight) for kind, value, weight in negative]
+        if not terms:
+            return None
+        
+        texts = [value for kind, value, _ in terms if kind == 'text']
+        text_vectors = self.embedder.embed_texts(texts, cache=True) if texts else None
+        if texts and text_vectors is None:
+            return None
+        
+        image_ids = [value for kind, value, _ in terms if kind == 'image']
+        with self.lock:
+            if image_ids and (self.image_embeddings is None or
+                              any(not 0 <= i < len(self.image_embeddings) for i in image_ids)):
+                return None
+            image_vectors = self.image_embeddings[image_ids] if image_ids else None
+        
+        # Stack vectors in the same order as their weights and sum in one product
+        weights = np.array([weight for kind, _, weight in terms if kind == 'text'] +
+                           [weight for kind, _, weight in terms if kind == 'image'], dtype=np.float32)
+        vectors = np.vstack([v for v in (text_vectors, image_vectors) if v is not None])
+        search_vector = (weights @ vectors).reshape(1, -1)
+        
+        norm = np.linalg.norm(search_vector)
+        if norm == 0:
+            return None
+        return (search_vector / norm).astype(np.float32)
+    
+    def search_by_vector(self, search_vector, k=20, paths=None, rerank=None, candidate_factor=10,
+                         threshold=None, normalize=False, **context):
+        """Search the index with a query vector; see search() for the options.
+
+        `context` (text_vector, image_vector, weight_text, diversity) is
+        passed to the reranker. Only taking the snapshot holds the lock, so
+        searches on different threads run in parallel.
+        """
         try:
-            # Search the index
-            scores, indices = self.index.search(search_vector, min(k, self.index.ntotal))
+            with self.lock:
+                snapshot = self.snapshot()
+                positions = self.positions_for_paths(paths) if paths is not None else None
             
-            # Format results
-            results = []
-            for i, idx in enumerate(indices[0]):
-                if idx < len(self.image_metadata):
-                    results.append({
-                        'path': self.image_metadata[idx]['path'],
-                        'id': self.image_metadata[idx]['id'],
-                        'score': float(scores[0][i])
-                    })
+            if normalize:
+                mean, std = self.score_statistics(search_vector)
             
-            return results
+            if threshold is not None:
+                # Everything above the threshold, best first, capped at k
+                radius = mean + threshold * std if normalize else threshold
+                with SEARCH_SECONDS.time(stage='range_search'):
+                    scores, indices = snapshot.range_search(search_vector, radius, positions)
+                if k is not None and not rerank:
+                    scores, indices = scores[:, :k], indices[:, :k]
+            else:
+                # Search the index, fetching extra candidates if they will be reranked
+                fetch = k * candidate_factor if rerank else k
+                with SEARCH_SECONDS.time(stage='candidates' if rerank else 'index_search'):
+                    if positions is not None:
+                        scores, indices = snapshot.search_subset(search_vector, positions, fetch)
+                    else:
+                        scores, indices = snapshot.index.search(search_vector, min(fetch, snapshot.index.ntotal))
+            
+            if rerank:
+                with SEARCH_SECONDS.time(stage='rerank'):
+                    rerank_k = k if k is not None else indices.shape[1]
+                    scores, indices = snapshot.rerank(search_vector, indices[0], rerank_k, rerank, **context)
+            
+            if normalize:
+                scores = (scores - mean) / std
+            
+            # Format results
+            with SEARCH_SECONDS.time(stage='format_results'):
+                return snapshot.format_results(scores[0], indices[0])
         except Exception as e:
             print(f"Error searching index: {e}")
             return []
     
+    def snapshot(self):
+        """The current index, embeddings and metadata, for searching without the lock"""
+        with self.lock:
+            index = self.index
+            if self.backend == 'numpy':
+                # A view over the rows added so far; later adds go past its end
+                index = NumpyIndex(self.dimension, self.index.embeddings, block_size=self.index.block_size)
+            return IndexSnapshot(index, self.image_embeddings, self.image_metadata.snapshot(), self.generation)
+    
+    def format_results(self, scores, positions):
+        """Result dicts for a row of (scores, positions), gathering ids and paths in bulk"""
+        return self.snapshot().format_results(scores, positions)
+    
+    def range_search(self, search_vector, radius, paths=None):
+        """All images scoring at least radius, best first, shaped like a FAISS result"""
+        with self.lock:
+            snapshot = self.snapshot()
+            positions = self.positions_for_paths(paths) if paths is not None else None
+        return snapshot.range_search(search_vector, radius, positions)
+    
+    def score_statistics(self, search_vector, sample_size=2048):
+        """Mean and standard deviation of a query's scores over a sample of the collection.
+
+        Used to normalise scores: how far a match stands out from a typical
+        image, rather than a raw cosine whose range depends on the model and
+        the kind of query.
+        """
+        with self.lock:
+            key = (self.layout_version, len(self.image_metadata) // max(sample_size, 1))
+            if self._score_sample_key != key:
+                embeddings = self.image_embeddings
+                if embeddings is None or len(embeddings) == 0:
+                    return 0.0, 1.0
+                rng = np.random.default_rng(0)
+                count = min(sample_size, len(embeddings))
+                rows = np.sort(rng.choice(len(embeddings), size=count, replace=False))
+                self._score_sample = np.ascontiguousarray(embeddings[rows], dtype=np.float32)
+                self._score_sample_key = key
+            sample = self._score_sample
+        
+        scores = sample @ search_vector.reshape(-1)
+        return float(scores.mean()), float(max(scores.std(), 1e-6))
+    
+    def similar_images(self, image_id, k=20):
+        """Top-k most similar images from the neighbour graph, or None if it can't answer"""
+        with self.lock:
+            if not self.neighbors.get(self.generation, len(self.image_metadata)):
+                return None
+            with SEARCH_SECONDS.time(stage='neighbor_lookup'):
+                found = self.neighbors.lookup(image_id, k)
+                if found is None:
+                    return None
+                scores, positions = found
+                return self.format_results(scores, positions)
+    
+    def build_neighbor_graph(self, progress=None, batch_size=1024):
+        """Compute the top-k neighbours of every image with batched index searches.
+
+        Searches hold the index lock one batch at a time, so queries keep
+        being served. Images added meanwhile are merged in at the end; if
+        the index is rebuilt or images are removed meanwhile, the graph is
+        discarded. Returns the number of images covered.
+        """
+        if self.index is None:
+            print("ERROR: Cannot build neighbour graph - index not initialized")
+            return 0
+        
+        with self._neighbor_lock:
+            with self.lock:
+                layout = self.layout_version
+                generation = self.generation
+                embeddings = self.image_embeddings
+                size = len(self.image_metadata)
+                if embeddings is None or len(embeddings) != self.index.ntotal:
+                    embeddings = self.index.reconstruct_n(0, self.index.ntotal)
+            
+            def search_snapshot(queries, k):
+                # Ask for extra results to cover images added since the
+                # snapshot, then keep only positions inside it
+                with self.lock:
+                    extra = self.index.ntotal - size
+                    scores, positions = self.index.search(queries, k + extra)
+                if extra:
+                    inside = positions < size
+                    order = np.argsort(~inside, axis=1, kind='stable')[:, :k]
+                    scores = np.take_along_axis(scores, order, axis=1)
+                    positions = np.take_along_axis(positions, order, axis=1)
+                return scores, positions
+            
+            graph = NeighborGraph(self.index_dir, self.neighbors.k)
+            graph.build(embeddings, search_snapshot, generation, batch_size, progress)
+            
+            with self.lock:
+                if self.layout_version != layout:
+                    print("Index changed while building the neighbour graph, discarding it")
+                    graph.clear(delete_file=True)
+                    return 0
+                if len(self.image_metadata) > size:
+                    graph.extend(self.image_embeddings[size:], self.image_embeddings, size, generation)
+                graph.save(self.generation)
+                self.neighbors = graph
+                return len(graph)
+    
+    def remove_images(self, image_paths, save=True):
+        """Remove images from the index by path.
+
+        Remaining images keep their order and are renumbered; clusterings and
+        neighbour lists are updated rather than recomputed. Returns the number
+        of images removed.
+        """
+        if self.index is None:
+            print("ERROR: Cannot remove from index - index not initialized")
+            return 0
+        
+        try:
+            with self.write_lock:
+                if save:
+                    self.reload_if_changed()
+                
+                with self.lock, INGEST_SECONDS.time(stage='index_remove'):
+                    positions = np.unique(self.positions_for_paths(image_paths))
+                    positions = positions[positions >= 0]
+                    if len(positions) == 0:
+                        return 0
+                    
+                    previous_size = len(self.image_metadata)
+                    keep = np.ones(previous_size, dtype=bool)
+                    keep[positions] = False
+                    
+                    # Flat indexes shift later vectors down, matching the renumbering
+                    if self.backend == 'numpy':
+                        self.index.remove_ids(positions.astype(np.int64))
+                    else:
+                        index = faiss.clone_index(self.index)
+                        index.remove_ids(positions.astype(np.int64))
+                        self.index = index
+                    self.image_metadata = self.image_metadata.select(keep)
+                    if self.backend == 'numpy':
+                        self.image_embeddings = self.index.embeddings
+                    elif self.image_embeddings is not None and len(self.image_embeddings) == previous_size:
+                        self.image_embeddings = self.image_embeddings[keep]
+                    
+                    self.clusters.remove(keep, previous_size, self.generation)
+                    self.neighbors.remove(keep, previous_size, self.generation, self.image_embeddings, self.index.search)
+                    self.layout_version += 1
+                
+                if save:
+                    self.save_index()
+                else:
+                    self._dirty = True
+            return len(positions)
+        except Exception as e:
+            print(f"Error removing images from index: {e}")
+            return 0
+    
+    def rerank(self, search_vector, candidates, k, scorer='exact', **context):
+        """Re-score candidate positions against the full-precision embeddings"""
+        return self.snapshot().rerank(search_vector, candidates, k, scorer, **context)
+    
+    def positions_for_paths(self, paths):
+        """Index positions of the given image paths, -1 for paths not in the index"""
+        with self.lock:
+            return self.image_metadata.positions(list(paths))
+    
+    def search_subset(self, search_vector, positions, k):
+        """Exact top-k among the given positions, shaped like a FAISS result"""
+        return self.snapshot().search_subset(search_vector, positions, k)
+    
     def get_embedding_by_id(self, image_id):
         """Get the embedding for an image by ID"""
         if image_id < 0 or image_id >= len(self.image_metadata):
@@ -196,141 +813,193 @@ class ImageIndex:
             return self.image_embeddings[image_id].reshape(1, -1)
             
         # Otherwise, get the image path and embed it
-        image_path = self.image_metadata[image_id]['path']
+        image_path = self.image_metadata.path(image_id)
         full_path = os.path.join('static', 'uploads', image_path)
         
         if os.path.exists(full_path):
-            return embedder.embed_image(full_path)
+            return self.embedder.embed_image(full_path)
         
         return None
         
-    def rebuild_index(self, image_dir):
-        """Rebuild the entire index from images in the specified directory"""
-        if not FAISS_AVAILABLE:
-            print("ERROR: Cannot rebuild index - FAISS not available")
-            return 0
-            
+    def rebuild_index(self, image_dir, progress=None, path_root=None):
+        """Rebuild the entire index from images in the specified directory.
+
+        The new index is built off to the side and swapped in at the end, so
+        searches keep being served from the old index while images are
+        re-embedded. `progress(done, total)` is called after each image and
+        may raise to abort the rebuild, leaving the old index in place.
+        Paths are stored relative to `path_root` (default: the parent of
+        image_dir).
+        """
         try:
-            # Reset index
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.image_metadata = []
-            self.image_embeddings = np.zeros((0, self.dimension), dtype=np.float32)
-            
             # Get list of images
-            count = 0
+            image_files = []
             for root, _, files in os.walk(image_dir):
                 for file in files:
                     if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                        image_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(image_path, start=os.path.dirname(image_dir))
-                        
-                        # Embed and add to index
-                        embedding = embedder.embed_image(image_path)
-                        if embedding is not None:
-                            self.add_image(rel_path, embedding)
-                            count += 1
+                        image_files.append(os.path.join(root, file))
             
-            self.save_index()
-            return count
+            metadata = []
+            embeddings = []
+            for i, image_path in enumerate(image_files):
+                rel_path = os.path.relpath(image_path, start=path_root if path_root is not None else os.path.dirname(image_dir))
+                
+                # Embed the image
+                embedding = self.embedder.embed_image(image_path)
+                if embedding is not None:
+                    metadata.append(rel_path)
+                    embeddings.append(embedding.reshape(-1))
+                
+                if progress:
+                    progress(i + 1, len(image_files))
+            
+            if embeddings:
+                embeddings = np.array(embeddings, dtype=np.float32)
+            else:
+                embeddings = np.zeros((0, self.dimension), dtype=np.float32)
+            
+            index = self._new_index(embeddings)
+            if self.backend == 'numpy':
+                embeddings = index.embeddings
+            
+            # Swap in the new index
+            with self.write_lock:
+                with self.lock:
+                    self.index = index
+                    self.image_metadata = MetadataStore.from_paths(metadata)
+                    self.image_embeddings = embeddings
+                    self.clusters.clear(delete_files=True)
+                    self.neighbors.clear(delete_file=True)
+                    self.layout_version += 1
+                self.save_index()
+            return len(metadata)
         except Exception as e:
+            # Background jobs pass a progress callback and record the error
+            # (or cancellation) themselves
+            if progress:
+                raise
             print(f"Error rebuilding index: {e}")
             return 0
 
-    def get_semantic_clusters(self, num_clusters=5):
-        """Cluster the images into semantic groups using K-means"""
-        if not FAISS_AVAILABLE or self.index is None or self.index.ntotal == 0:
-            print("ERROR: Cannot create clusters - FAISS not available or no images indexed")
+    def switch_model(self, model_name, embeddings):
+        """Replace every vector with one from another embedding model and save.
+
+        `embeddings` holds a row for each index position, so positions (and
+        the image ids handed out by searches) are unchanged. Callers hold
+        write_lock so no image is added between building the rows and the
+        swap. Clusters and neighbour lists belong to the old vectors and are
+        dropped.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with self.write_lock:
+            with self.lock:
+                if len(embeddings) != len(self.image_metadata):
+                    raise ValueError(f"Expected {len(self.image_metadata)} embeddings, got {len(embeddings)}")
+                self.model_name = model_name
+                self.dimension = embeddings.shape[1]
+                self.index = self._new_index(embeddings)
+                self.image_embeddings = self.index.embeddings if self.backend == 'numpy' else embeddings
+                self.clusters.clear(delete_files=True)
+                self.neighbors.clear(delete_file=True)
+                self.layout_version += 1
+            self.save_index()
+
+    def get_semantic_clusters(self, num_clusters=5, offset=0, limit=None):
+        """Cluster the images into semantic groups using k-means.
+
+        Clusterings are persisted and updated as images are added, so this
+        is normally a cache read. `offset` and `limit` page through the
+        images listed for each cluster; `size` is always the full count.
+        """
+        if self.index is None or self.index.ntotal == 0:
+            print("ERROR: Cannot create clusters - no images indexed")
             return []
             
         try:
             # Need at least 2 images
             if self.index.ntotal < 2:
                 return [{
+                    'id': 0,
                     'name': 'All Images',
-                    'images': [{'id': img['id'], 'path': img['path']} for img in self.image_metadata]
+                    'size': len(self.image_metadata),
+                    'images': self.image_metadata.records(np.arange(len(self.image_metadata)))
                 }]
             
-            # Use fewer clusters if we have few images
-            actual_clusters = min(num_clusters, self.index.ntotal // 2)
-            
-            # Load necessary packages for clustering
-            from sklearn.cluster import KMeans
-            
-            # Get embeddings
-            if self.image_embeddings is None or len(self.image_embeddings) != self.index.ntotal:
-                print("WARNING: Embedding cache not available, using index vectors")
-                # Since we can't directly extract vectors from FAISS index,
-                # we'll need to get them from the image files again
-                embeddings = []
-                for img in self.image_metadata:
-                    image_path = os.path.join('static', 'uploads', img['path'])
-                    if os.path.exists(image_path):
-                        emb = embedder.embed_image(image_path)
-                        if emb is not None:
-                            embeddings.append(emb.reshape(-1))
-                        else:
-                            embeddings.append(np.zeros(self.dimension))
-                    else:
-                        embeddings.append(np.zeros(self.dimension))
-                embeddings = np.array(embeddings)
-            else:
-                embeddings = self.image_embeddings
-            
-            # Run K-means clustering
-            kmeans = KMeans(n_clusters=actual_clusters, random_state=42)
-            clusters = kmeans.fit_predict(embeddings)
-            
-            # Determine cluster labels by finding the most representative images
-            # and using CLIP to generate descriptions
-            cluster_centers = kmeans.cluster_centers_
-            cluster_labels = []
-            
-            # For each cluster, find the common themes using CLIP text encoder in reverse
-            for i in range(actual_clusters):
-                # Get the embedding center
-                center = cluster_centers[i].reshape(1, -1)
-                
-                # Use a list of common categories to find the closest match
-                common_categories = [
-                    "landscape", "portrait", "animals", "food", "architecture",
-                    "nature", "urban", "abstract", "people", "objects",
-                    "technology", "art", "black and white", "colorful", "vintage"
-                ]
-                
-                category_embeddings = np.array([
-                    embedder.embed_text(f"a photo of {category}").reshape(-1)
-                    for category in common_categories
-                ])
-                
-                # Calculate similarities
-                similarities = np.dot(center, category_embeddings.T).reshape(-1)
-                best_match_idx = similarities.argmax()
-                
-                # Get the best matching category
-                best_category = common_categories[best_match_idx]
-                cluster_labels.append(f"{best_category.title()} Images")
+            state = self.get_cluster_state(num_clusters)
             
             # Organize images by cluster
             result = []
-            for i in range(actual_clusters):
-                cluster_images = []
-                for j, cluster_idx in enumerate(clusters):
-                    if cluster_idx == i and j < len(self.image_metadata):
-                        cluster_images.append({
-                            'id': self.image_metadata[j]['id'],
-                            'path': self.image_metadata[j]['path']
-                        })
-                
-                result.append({
-                    'id': i,
-                    'name': cluster_labels[i],
-                    'images': cluster_images
-                })
+            with self.lock:
+                for i in range(state.k):
+                    members = state.members(i, offset, limit)
+                    result.append({
+                        'id': i,
+                        'name': state.names[i],
+                        'size': state.size(i),
+                        'images': self.image_metadata.records(members[members < len(self.image_metadata)])
+                    })
             
             return result
         except Exception as e:
             print(f"Error creating semantic clusters: {e}")
             return []
+            
+    def get_cluster_images(self, cluster_id, num_clusters=5, offset=0, limit=50):
+        """Get one page of the images in a cluster, or None if there is no such cluster"""
+        if self.index is None or self.index.ntotal < 2:
+            return None
+            
+        state = self.get_cluster_state(num_clusters)
+        if cluster_id < 0 or cluster_id >= state.k:
+            return None
+            
+        with self.lock:
+            members = state.members(cluster_id, offset, limit)
+            return {
+                'id': cluster_id,
+                'name': state.names[cluster_id],
+                'size': state.size(cluster_id),
+                'offset': offset,
+                'images': self.image_metadata.records(members[members < len(self.image_metadata)])
+            }
+            
+    def get_cluster_state(self, num_clusters):
+        """Get the clustering for num_clusters, fitting it if there is none yet"""
+        # Use fewer clusters if we have few images
+        k = min(num_clusters, self.index.ntotal // 2)
+        
+        with self._cluster_lock:
+            with self.lock:
+                state = self.clusters.get(k, self.generation, len(self.image_metadata))
+                if state is not None:
+                    return state
+                
+                # Snapshot the embeddings; adds replace the array rather than
+                # modifying it, so the fit can run without blocking searches
+                generation = self.generation
+                layout = self.layout_version
+                embeddings = self.image_embeddings
+                if embeddings is None or len(embeddings) != self.index.ntotal:
+                    print("WARNING: Embedding cache not available, using index vectors")
+                    embeddings = self.index.reconstruct_n(0, self.index.ntotal)
+            
+            state = self.clusters.fit(k, embeddings, generation, name_fn=self.name_clusters)
+            
+            # Assign images added while we were fitting
+            with self.lock:
+                if self.layout_version != layout:
+                    # Images were removed or the index reloaded; refit next time
+                    self.clusters.clear()
+                elif len(self.image_metadata) > len(state.assignments):
+                    state.extend(self.image_embeddings[len(state.assignments):])
+            return state
+            
+    def name_clusters(self, centroids):
+        """Name each cluster after the vocabulary label closest to its centroid"""
+        labels = self.labels.best_labels(centroids)
+        if labels is None:
+            return [f"Cluster {i + 1}" for i in range(len(centroids))]
+        return [f"{label.title()} Images" for label in labels]
 
 # Create singleton instance
 image_index = ImageIndex() 
\ No newline at end of file
@@ -0,0 +1,138 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from models.image_embedder import embedder as default_embedder, get_embedder
+
+DEFAULT_VOCABULARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "label_vocabulary.txt")
+
+# CLIP's learned logit scale, used to turn similarities into probabilities
+CLIP_LOGIT_SCALE = 100.0
+
+class LabelVocabulary:
+    def __init__(self, vocabulary_path=None, cache_dir="index", prompt="a photo of {}", embedder=None):
+        """Vocabulary of text labels with their embeddings cached on disk.
+
+        The label embeddings are computed once, in batches, and reused until
+        the vocabulary, prompt or embedding model changes. They are used to
+        name clusters and to tag images by zero-shot classification.
+        """
+        self.vocabulary_path = vocabulary_path or os.environ.get('LABEL_VOCABULARY', DEFAULT_VOCABULARY_PATH)
+        self.cache_dir = cache_dir
+        self.cache_path = os.path.join(cache_dir, "label_embeddings.npz")
+        self.prompt = prompt
+        self.embedder = embedder if embedder is not None else default_embedder
+        self.labels = self.load_labels(self.vocabulary_path)
+        self._embeddings = None
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def for_model(self, model_name):
+        """The same vocabulary embedded with another model (this one for None or the same model)"""
+        if model_name is None or model_name == getattr(self.embedder, 'model_name', None):
+            return self
+        with self._lock:
+            if model_name not in self._models:
+                vocabulary = LabelVocabulary(self.vocabulary_path, self.cache_dir, self.prompt, get_embedder(model_name))
+                # Keep each model's cache so switching back and forth doesn't recompute them
+                slug = re.sub(r'[^A-Za-z0-9_.-]+', '-', model_name)
+                vocabulary.cache_path = os.path.join(self.cache_dir, f"label_embeddings-{slug}.npz")
+                self._models[model_name] = vocabulary
+            return self._models[model_name]
+
+    @staticmethod
+    def load_labels(path):
+        """Read labels, one per line, ignoring blank lines, comments and duplicates"""
+        labels = []
+        seen = set()
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    label = line.strip()
+                    if label and not label.startswith('#') and label not in seen:
+                        seen.add(label)
+                        labels.append(label)
+        except OSError as e:
+            print(f"Error loading label vocabulary {path}: {e}")
+        return labels
+
+    def cache_key(self):
+        """Identify the vocabulary, prompt and model the cached embeddings belong to"""
+        data = json.dumps([getattr(self.embedder, 'model_name', None), self.prompt, self.labels])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @property
+    def embeddings(self):
+        """(num_labels, d) label embeddings, loaded from cache or computed once"""
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = self._load_or_compute()
+        return self._embeddings
+
+    def _load_or_compute(self):
+        if not self.labels:
+            return None
+
+        key = self.cache_key()
+        if os.path.exists(self.cache_path):
+            try:
+                with np.load(self.cache_path, allow_pickle=False) as data:
+                    if str(data['key']) == key:
+                        return data['embeddings']
+            except Exception as e:
+                print(f"Error loading label embeddings: {e}")
+
+        print(f"Embedding {len(self.labels)} vocabulary labels...")
+        embeddings = self.embedder.embed_texts([self.prompt.format(label) for label in self.labels])
+        if embeddings is None:
+            return None
+        embeddings = embeddings.astype(np.float32)
+
+        try:
+            Path(os.path.dirname(self.cache_path)).mkdir(parents=True, exist_ok=True)
+            with open(f"{self.cache_path}.tmp", 'wb') as f:
+                np.savez(f, key=key, embeddings=embeddings)
+            os.replace(f"{self.cache_path}.tmp", self.cache_path)
+        except Exception as e:
+            print(f"Error saving label embeddings: {e}")
+        return embeddings
+
+    def best_labels(self, vectors):
+        """Closest label for each vector (e.g. cluster centroids), or None"""
+        if self.embeddings is None:
+            return None
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.embeddings.shape[1])
+        best = np.argmax(vectors @ self.embeddings.T, axis=1)
+        return [self.labels[i] for i in best]
+
+    def tag(self, image_embeddings, top_k=5, min_probability=0.05):
+        """Zero-shot tag a batch of image embeddings.
+
+        Each image gets up to top_k labels whose softmax probability over
+        the whole vocabulary is at least min_probability. Returns one list
+        of labels per image (empty lists if no vocabulary is available).
+        """
+        image_embeddings = np.asarray(image_embeddings, dtype=np.float32)
+        if self.embeddings is None:
+            return [[] for _ in range(len(image_embeddings))]
+        image_embeddings = image_embeddings.reshape(-1, self.embeddings.shape[1])
+
+        logits = CLIP_LOGIT_SCALE * (image_embeddings @ self.embeddings.T)
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        top_k = min(top_k, len(self.labels))
+        top = np.argpartition(-probabilities, top_k - 1, axis=1)[:, :top_k]
+        tags = []
+        for row, candidates in zip(probabilities, top):
+            candidates = candidates[np.argsort(-row[candidates])]
+            tags.append([self.labels[i] for i in candidates if row[i] >= min_probability])
+        return tags
+
+# Create singleton instance
+label_vocabulary = LabelVocabulary()
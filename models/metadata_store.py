@@ -0,0 +1,205 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+def path_hash(path):
+    """Stable 64-bit hash of an image path, used to look paths up without a dict"""
+    return int.from_bytes(hashlib.blake2b(path.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class MetadataStore:
+    # Column name -> file suffix; each column is one .npy file
+    COLUMNS = ('ids', 'offsets', 'paths', 'hashes')
+
+    def __init__(self, ids=None, offsets=None, blob=None, hashes=None):
+        """Columnar per-image metadata: ids and paths, by index position.
+
+        Paths are packed into one UTF-8 byte array with an offsets column,
+        and 64-bit path hashes allow batched path -> position lookups, so
+        millions of images cost a few arrays instead of millions of Python
+        objects. Loaded columns are memory-mapped and shared between worker
+        processes. Images appended since the last save are kept in small
+        Python lists until the store is saved again.
+        """
+        self._ids = ids if ids is not None else np.zeros(0, dtype=np.int64)
+        self._offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self._blob = blob if blob is not None else np.zeros(0, dtype=np.uint8)
+        self._hashes = hashes if hashes is not None else np.zeros(0, dtype=np.uint64)
+        self._tail_paths = []
+        self._tail_ids = []
+        self._tail_hashes = []
+        self._hash_order = None
+        self._hash_order_size = None
+
+    @classmethod
+    def from_paths(cls, paths, ids=None):
+        """Build a store from a list of paths (ids default to positions)"""
+        encoded = [path.encode('utf-8') for path in paths]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+        ids = np.arange(len(paths), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        hashes = np.array([path_hash(path) for path in paths], dtype=np.uint64)
+        return cls(ids, offsets, blob, hashes)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a store from legacy [{'path', 'id'}] records"""
+        return cls.from_paths([record['path'] for record in records], [record['id'] for record in records])
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        """Load the columns saved under `prefix`, or None if they don't exist"""
+        files = [f"{prefix}_{column}.npy" for column in cls.COLUMNS]
+        if not all(os.path.exists(path) for path in files):
+            return None
+        mode = 'r' if mmap else None
+        return cls(*[np.load(path, mmap_mode=mode) for path in files])
+
+    @classmethod
+    def load_json(cls, path):
+        """Load a legacy image_metadata.json file"""
+        with open(path, 'r') as f:
+            return cls.from_records(json.load(f))
+
+    def save(self, prefix):
+        """Write every column next to its final name, then rename it into place"""
+        self.compact()
+        for column, array in zip(self.COLUMNS, (self._ids, self._offsets, self._blob, self._hashes)):
+            path = f"{prefix}_{column}.npy"
+            with open(f"{path}.tmp", 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(f"{path}.tmp", path)
+
+    def __len__(self):
+        return len(self._ids) + len(self._tail_ids)
+
+    def resident_bytes(self):
+        """Memory held by columns that are not memory-mapped"""
+        columns = (self._ids, self._offsets, self._blob, self._hashes)
+        return sum(column.nbytes for column in columns if not isinstance(column, np.memmap))
+
+    def compact(self):
+        """Fold images appended since loading into the columns"""
+        if not self._tail_ids:
+            return
+        tail = [path.encode('utf-8') for path in self._tail_paths]
+        tail_offsets = self._offsets[-1] + np.cumsum([len(data) for data in tail], dtype=np.int64)
+        self._offsets = np.concatenate([self._offsets, tail_offsets])
+        self._blob = np.concatenate([self._blob, np.frombuffer(b''.join(tail), dtype=np.uint8)])
+        self._ids = np.concatenate([self._ids, np.array(self._tail_ids, dtype=np.int64)])
+        self._hashes = np.concatenate([self._hashes, np.array(self._tail_hashes, dtype=np.uint64)])
+        self._tail_paths, self._tail_ids, self._tail_hashes = [], [], []
+
+    def snapshot(self):
+        """A copy that later appends and compactions don't affect.
+
+        The columns are shared, since compaction replaces them rather than
+        writing into them; only the unsaved tail is copied.
+        """
+        store = MetadataStore(self._ids, self._offsets, self._blob, self._hashes)
+        store._tail_paths, store._tail_ids, store._tail_hashes = list(self._tail_paths), list(self._tail_ids), list(self._tail_hashes)
+        return store
+
+    def append(self, path, image_id=None):
+        self._tail_paths.append(path)
+        self._tail_ids.append(len(self) if image_id is None else image_id)
+        self._tail_hashes.append(path_hash(path))
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+
+    def path(self, position):
+        base = len(self._ids)
+        if position >= base:
+            return self._tail_paths[position - base]
+        return self._blob[self._offsets[position]:self._offsets[position + 1]].tobytes().decode('utf-8')
+
+    def paths(self, positions):
+        """Paths for an array of positions"""
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1)
+        base = len(self._ids)
+        in_base = positions < base
+        if in_base.all():
+            return self._decode(positions)
+        result = [None] * len(positions)
+        for i, path in zip(np.nonzero(in_base)[0].tolist(), self._decode(positions[in_base])):
+            result[i] = path
+        for i in np.nonzero(~in_base)[0].tolist():
+            result[i] = self._tail_paths[positions[i] - base]
+        return result
+
+    def _decode(self, positions, chunk_size=8192):
+        """Decode the saved paths at `positions`, a chunk of them per gather over the blob"""
+        paths = []
+        for start in range(0, len(positions), chunk_size):
+            chunk = positions[start:start + chunk_size]
+            starts = np.asarray(self._offsets[chunk])
+            lengths = np.asarray(self._offsets[chunk + 1]) - starts
+            # Copy the paths into one NUL-separated buffer (paths never contain
+            # NUL), so the chunk is decoded and split with one call each
+            first = np.cumsum(lengths) - lengths
+            within = np.arange(lengths.sum()) - np.repeat(first, lengths)
+            source = np.repeat(starts, lengths) + within
+            target = np.repeat(first + np.arange(len(chunk)), lengths) + within
+            packed = np.zeros(lengths.sum() + len(chunk) - 1, dtype=np.uint8)
+            packed[target] = self._blob[source]
+            paths.extend(packed.tobytes().decode('utf-8').split('\0'))
+        return paths
+
+    def ids(self, positions):
+        """Ids for an array of positions, gathered in one step when possible"""
+        positions = np.asarray(positions, dtype=np.int64)
+        base = len(self._ids)
+        if not self._tail_ids or (len(positions) and positions.max() < base):
+            return np.asarray(self._ids[positions])
+        tail = np.array(self._tail_ids, dtype=np.int64)
+        in_base = positions < base
+        result = np.empty(len(positions), dtype=np.int64)
+        result[in_base] = self._ids[positions[in_base]]
+        result[~in_base] = tail[positions[~in_base] - base]
+        return result
+
+    def records(self, positions):
+        """[{'id', 'path'}] for the given positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        return [{'id': image_id, 'path': path}
+                for image_id, path in zip(self.ids(positions).tolist(), self.paths(positions))]
+
+    def all_paths(self):
+        return self.paths(np.arange(len(self)))
+
+    def positions(self, paths):
+        """Positions of the given paths, -1 for unknown paths, via a sorted hash column"""
+        if len(self) != self._hash_order_size:
+            self.compact()
+            self._hash_order = np.argsort(self._hashes, kind='stable')
+            self._hash_order_size = len(self)
+
+        positions = np.full(len(paths), -1, dtype=np.int64)
+        if len(self) == 0 or len(paths) == 0:
+            return positions
+        hashes = np.array([path_hash(path) for path in paths], dtype=np.uint64)
+        sorted_hashes = self._hashes[self._hash_order]
+        slots = np.minimum(np.searchsorted(sorted_hashes, hashes), len(sorted_hashes) - 1)
+        found = sorted_hashes[slots] == hashes
+        candidates = self._hash_order[slots]
+        for i in np.nonzero(found)[0]:
+            # Guard against hash collisions
+            if self.path(int(candidates[i])) == paths[i]:
+                positions[i] = candidates[i]
+        return positions
+
+    def select(self, keep):
+        """A new store with only the positions where keep is True, ids renumbered"""
+        self.compact()
+        kept = np.nonzero(keep)[0]
+        lengths = (self._offsets[1:] - self._offsets[:-1])[kept]
+        offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Gather the kept byte ranges with one mask over the blob
+        byte_mask = np.repeat(keep, self._offsets[1:] - self._offsets[:-1])
+        blob = np.asarray(self._blob)[byte_mask]
+        return MetadataStore(np.arange(len(kept), dtype=np.int64), offsets, blob, np.asarray(self._hashes)[kept])
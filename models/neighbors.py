@@ -0,0 +1,183 @@
+import os
+import numpy as np
+
+class NeighborGraph:
+    def __init__(self, index_dir, k=32):
+        """Persisted top-k neighbour lists for every image in the index.
+
+        Row i holds the positions and inner-product scores of the k images
+        most similar to image i (itself included, as a full search would
+        return it), best first, padded with -1 when the index is smaller
+        than k. Like the clusterings, the file records the index generation
+        it matches and the lists are updated in place as images are added
+        and removed.
+        """
+        self.path = os.path.join(index_dir, "neighbors.npz")
+        self.k = k
+        self.neighbors = None
+        self.scores = None
+        self.generation = None
+
+    def __len__(self):
+        return 0 if self.neighbors is None else len(self.neighbors)
+
+    def get(self, generation, size):
+        """Whether the graph matches the index, loading it from disk if needed"""
+        if self.neighbors is None or len(self.neighbors) != size:
+            if not self._load() or self.generation != generation or len(self.neighbors) != size:
+                self.clear()
+                return False
+        return True
+
+    def lookup(self, position, k):
+        """(scores, positions) of the top-k neighbours of an image, or None if k is too large"""
+        if self.neighbors is None or k > self.k or not 0 <= position < len(self.neighbors):
+            return None
+        positions = self.neighbors[position, :k]
+        valid = positions >= 0
+        return self.scores[position, :k][valid], positions[valid]
+
+    def build(self, embeddings, search_fn, generation, batch_size=1024, progress=None):
+        """Compute every neighbour list with batched searches.
+
+        `search_fn(queries, k)` returns FAISS-style (scores, positions).
+        `progress(done, total)` is called after each batch and may raise to
+        abort the build.
+        """
+        n = len(embeddings)
+        k = min(self.k, n)
+        neighbors = np.full((n, self.k), -1, dtype=np.int32)
+        scores = np.full((n, self.k), -np.inf, dtype=np.float32)
+        for start in range(0, n, batch_size):
+            batch = np.ascontiguousarray(embeddings[start:start + batch_size], dtype=np.float32)
+            batch_scores, batch_positions = search_fn(batch, k)
+            neighbors[start:start + len(batch), :k] = batch_positions
+            scores[start:start + len(batch), :k] = batch_scores
+            if progress:
+                progress(min(start + batch_size, n), n)
+
+        self.neighbors = neighbors
+        self.scores = scores
+        self.generation = generation
+        self._save()
+
+    def extend(self, new_embeddings, all_embeddings, previous_size, generation):
+        """Add rows for newly added images and let them into existing rows.
+
+        `all_embeddings` includes the new images. Only rows where a new image
+        beats the current k-th neighbour are touched.
+        """
+        if not self.get(generation, previous_size):
+            return
+        new_embeddings = np.asarray(new_embeddings, dtype=np.float32).reshape(-1, all_embeddings.shape[1])
+        m = len(new_embeddings)
+        if m == 0:
+            return
+        new_positions = np.arange(previous_size, previous_size + m, dtype=np.int32)
+
+        # Existing rows: merge in new images that beat the current worst neighbour
+        if previous_size:
+            new_scores = all_embeddings[:previous_size] @ new_embeddings.T
+            rows = np.nonzero(new_scores.max(axis=1) > self.scores[:, -1])[0]
+            if len(rows):
+                candidates = np.concatenate([self.neighbors[rows], np.broadcast_to(new_positions, (len(rows), m))], axis=1)
+                candidate_scores = np.concatenate([self.scores[rows], new_scores[rows]], axis=1)
+                self.neighbors[rows], self.scores[rows] = self._top_k(candidates, candidate_scores)
+
+        # New rows: exact top-k over the whole collection
+        scores = new_embeddings @ all_embeddings.T
+        positions = np.broadcast_to(np.arange(len(all_embeddings), dtype=np.int32), scores.shape)
+        new_neighbors, new_neighbor_scores = self._top_k(positions, scores)
+        self.neighbors = np.concatenate([self.neighbors, new_neighbors])
+        self.scores = np.concatenate([self.scores, new_neighbor_scores])
+
+    def remove(self, keep, previous_size, generation, embeddings, search_fn):
+        """Drop removed images and renumber the rest.
+
+        `keep` is a boolean mask over the old positions and `embeddings`
+        the remaining images. Rows that lost a neighbour are recomputed with
+        `search_fn` against the updated index.
+        """
+        if not self.get(generation, previous_size):
+            return
+        remap = np.full(previous_size + 1, -1, dtype=np.int32)
+        remap[:previous_size][keep] = np.arange(int(keep.sum()), dtype=np.int32)
+        # Padding (-1) indexes the extra last slot and stays -1
+        kept = self.neighbors[keep]
+        self.neighbors = remap[kept]
+        self.scores = self.scores[keep]
+
+        lost = np.nonzero(((self.neighbors < 0) & (kept >= 0)).any(axis=1))[0]
+        if len(lost):
+            self.refill(lost, embeddings, search_fn)
+
+    def refill(self, rows, embeddings, search_fn, batch_size=1024):
+        """Recompute the given rows with batched searches"""
+        k = min(self.k, len(embeddings))
+        for start in range(0, len(rows), batch_size):
+            batch_rows = rows[start:start + batch_size]
+            batch_scores, batch_positions = search_fn(np.ascontiguousarray(embeddings[batch_rows], dtype=np.float32), k)
+            self.neighbors[batch_rows] = -1
+            self.scores[batch_rows] = -np.inf
+            self.neighbors[batch_rows, :k] = batch_positions
+            self.scores[batch_rows, :k] = batch_scores
+
+    def _top_k(self, positions, scores):
+        """Best self.k (positions, scores) per row, best first, padded with -1"""
+        k = min(self.k, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), scores.shape).copy()
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+
+        out_positions = np.full((len(scores), self.k), -1, dtype=np.int32)
+        out_scores = np.full((len(scores), self.k), -np.inf, dtype=np.float32)
+        out_positions[:, :k] = np.take_along_axis(positions, top, axis=1)
+        out_scores[:, :k] = np.take_along_axis(scores, top, axis=1)
+        # Padding slots that made it into the top k stay padding
+        out_positions[~np.isfinite(out_scores)] = -1
+        return out_positions, out_scores
+
+    def save(self, generation):
+        """Persist the graph as matching the given index generation"""
+        if self.neighbors is None:
+            return
+        self.generation = generation
+        self._save()
+
+    def clear(self, delete_file=False):
+        """Forget the in-memory graph, e.g. after the index was reloaded or rebuilt"""
+        self.neighbors = None
+        self.scores = None
+        self.generation = None
+        if delete_file:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if data['neighbors'].shape[1] != self.k:
+                    return False
+                self.neighbors = data['neighbors']
+                self.scores = data['scores']
+                self.generation = int(data['generation'])
+            return True
+        except Exception as e:
+            print(f"Error loading neighbour graph: {e}")
+            return False
+
+    def _save(self):
+        try:
+            with open(f"{self.path}.tmp", 'wb') as f:
+                np.savez(f, neighbors=self.neighbors, scores=self.scores, generation=self.generation)
+            os.replace(f"{self.path}.tmp", self.path)
+        except Exception as e:
+            print(f"Error saving neighbour graph: {e}")
@@ -0,0 +1,159 @@
+import os
+import concurrent.futures
+import numpy as np
+
+# Shared by every NumpyIndex; NumPy releases the GIL inside matrix
+# multiplies, so blocks scanned on different threads run in parallel
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        threads = int(os.environ.get('SEARCH_THREADS', os.cpu_count() or 1))
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix='search-block')
+    return _executor
+
+class NumpyIndex:
+    def __init__(self, dimension, embeddings=None, block_size=65536, scales=None):
+        """Exact inner-product index in plain NumPy, used when FAISS is unavailable.
+
+        Implements the part of the FAISS IndexFlatIP interface ImageIndex
+        uses (ntotal, add, search, range_search, remove_ids, reconstruct_n).
+        Searches scan the embedding matrix in blocks of `block_size` rows on
+        a thread pool, take each block's top k with argpartition and merge
+        them. `embeddings` is used as-is, so a memory-mapped matrix is
+        scanned straight from the page cache; the first add copies it into
+        memory. Rows are appended into spare capacity and removals build a
+        new array, so views returned by `embeddings` never change.
+
+        With `scales`, `embeddings` holds quantized codes (e.g. int8) for
+        vectors codes * scales. The scales are folded into the queries and
+        codes are converted one block at a time, so the matrix is never
+        expanded to float32 as a whole; such an index is read-only.
+        """
+        self.d = dimension
+        self.block_size = block_size
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.zeros((0, dimension), dtype=np.float32)
+        if self.scales is None and embeddings.dtype != np.float32:
+            embeddings = embeddings.astype(np.float32)
+        self._data = embeddings
+        self.ntotal = len(self._data)
+
+    @property
+    def embeddings(self):
+        """The stored vectors, by position"""
+        return self._data[:self.ntotal]
+
+    def add(self, vectors):
+        if self.scales is not None:
+            raise ValueError("Quantized indexes are read-only")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.d)
+        needed = self.ntotal + len(vectors)
+        if needed > len(self._data) or not self._data.flags.writeable:
+            # Grow geometrically so repeated single adds stay cheap
+            data = np.empty((max(needed, int(len(self._data) * 1.5), 1024), self.d), dtype=np.float32)
+            data[:self.ntotal] = self._data[:self.ntotal]
+            self._data = data
+        self._data[self.ntotal:needed] = vectors
+        self.ntotal = needed
+
+    def reset(self):
+        self._data = np.zeros((0, self.d), dtype=np.float32)
+        self.ntotal = 0
+
+    def reconstruct_n(self, start, n):
+        vectors = np.array(self._data[start:start + n], dtype=np.float32)
+        return vectors * self.scales if self.scales is not None else vectors
+
+    def remove_ids(self, ids):
+        """Remove positions, shifting later vectors down like a flat FAISS index.
+
+        Returns the number of vectors removed.
+        """
+        if self.scales is not None:
+            raise ValueError("Quantized indexes are read-only")
+        keep = np.ones(self.ntotal, dtype=bool)
+        ids = np.asarray(ids, dtype=np.int64)
+        keep[ids[(ids >= 0) & (ids < self.ntotal)]] = False
+        removed = self.ntotal - int(keep.sum())
+        if removed:
+            self._data = self.embeddings[keep]
+            self.ntotal = len(self._data)
+        return removed
+
+    def _blocks(self):
+        return [(start, min(start + self.block_size, self.ntotal)) for start in range(0, self.ntotal, self.block_size)]
+
+    def _prepare(self, queries):
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.d)
+        return queries * self.scales if self.scales is not None else queries
+
+    def _block(self, data, start, stop):
+        block = data[start:stop]
+        return block if block.dtype == np.float32 else block.astype(np.float32)
+
+    def _map_blocks(self, fn):
+        """Run fn(start, stop) over every block, in parallel when there is more than one"""
+        blocks = self._blocks()
+        if len(blocks) <= 1:
+            return [fn(start, stop) for start, stop in blocks]
+        return list(_get_executor().map(lambda block: fn(*block), blocks))
+
+    def search(self, queries, k):
+        """Top-k (scores, positions) for each query row, padded with -inf and -1"""
+        queries = self._prepare(queries)
+        nq = len(queries)
+        scores = np.full((nq, k), -np.inf, dtype=np.float32)
+        positions = np.full((nq, k), -1, dtype=np.int64)
+        if k <= 0 or self.ntotal == 0:
+            return scores, positions
+        data = self._data
+
+        def scan(start, stop):
+            block_scores = queries @ self._block(data, start, stop).T
+            top = _top_k(block_scores, k)
+            return np.take_along_axis(block_scores, top, axis=1), top + start
+
+        results = self._map_blocks(scan)
+        candidate_scores = np.concatenate([s for s, _ in results], axis=1)
+        candidate_positions = np.concatenate([p for _, p in results], axis=1)
+
+        # Merge the per-block winners
+        top = _top_k(candidate_scores, k)
+        top_scores = np.take_along_axis(candidate_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        found = top.shape[1]
+        scores[:, :found] = np.take_along_axis(top_scores, order, axis=1)
+        positions[:, :found] = np.take_along_axis(np.take_along_axis(candidate_positions, top, axis=1), order, axis=1)
+        return scores, positions
+
+    def range_search(self, queries, radius):
+        """Every position scoring at least radius, as FAISS-style (lims, scores, positions)"""
+        queries = self._prepare(queries)
+        data = self._data
+
+        def scan(start, stop):
+            block_scores = queries @ self._block(data, start, stop).T
+            rows, cols = np.nonzero(block_scores >= radius)
+            return rows, block_scores[rows, cols], cols.astype(np.int64) + start
+
+        results = self._map_blocks(scan)
+        if not results:
+            return np.zeros(len(queries) + 1, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        rows = np.concatenate([r for r, _, _ in results])
+        scores = np.concatenate([s for _, s, _ in results])
+        positions = np.concatenate([p for _, _, p in results])
+
+        # Group the hits by query
+        order = np.argsort(rows, kind='stable')
+        lims = np.zeros(len(queries) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(queries)), out=lims[1:])
+        return lims, scores[order], positions[order]
+
+def _top_k(scores, k):
+    """Column indexes of the k largest scores in each row, unordered"""
+    if k >= scores.shape[1]:
+        return np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
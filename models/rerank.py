@@ -0,0 +1,69 @@
+"""
+Second-stage scorers for two-stage retrieval.
+
+A scorer receives the query vector, the full-precision embeddings of the
+candidates returned by the index and the number of results wanted, and
+returns (order, scores): positions into the candidate list, best first, and
+their scores. Extra search context (text_vector, image_vector, weight_text,
+diversity) is passed as keyword arguments; scorers ignore what they don't use.
+"""
+
+import numpy as np
+
+def exact(query, embeddings, k, **context):
+    """Exact inner product against the full-precision embeddings"""
+    scores = embeddings @ query.reshape(-1)
+    order = np.argsort(-scores)[:k]
+    return order, scores[order]
+
+def mmr(query, embeddings, k, diversity=0.3, **context):
+    """Maximal marginal relevance: trade relevance against similarity to results already picked.
+
+    `diversity` is 0 for pure relevance and 1 for pure novelty.
+    """
+    relevance = embeddings @ query.reshape(-1)
+    k = min(k, len(embeddings))
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = embeddings @ embeddings[selected[0]]
+    available = np.ones(len(embeddings), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        marginal = (1 - diversity) * relevance - diversity * redundancy
+        marginal[~available] = -np.inf
+        best = int(np.argmax(marginal))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, embeddings @ embeddings[best])
+
+    order = np.array(selected, dtype=np.int64)
+    return order, relevance[order]
+
+def fusion(query, embeddings, k, text_vector=None, image_vector=None, weight_text=0.7, **context):
+    """Weighted text/image fusion on standardised per-modality similarities.
+
+    Image-to-image similarities run much higher than text-to-image ones, so
+    averaging the raw vectors lets the image dominate. Scoring each modality
+    separately and standardising over the candidates makes weight_text mean
+    what it says. Falls back to exact scoring for single-modality queries.
+    """
+    if text_vector is None or image_vector is None:
+        return exact(query, embeddings, k)
+
+    def standardise(scores):
+        return (scores - scores.mean()) / (scores.std() + 1e-6)
+
+    text_scores = embeddings @ text_vector.reshape(-1)
+    image_scores = embeddings @ image_vector.reshape(-1)
+    scores = weight_text * standardise(text_scores) + (1 - weight_text) * standardise(image_scores)
+    order = np.argsort(-scores)[:k]
+    return order, scores[order]
+
+RERANKERS = {
+    'exact': exact,
+    'mmr': mmr,
+    'fusion': fusion
+}
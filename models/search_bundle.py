@@ -0,0 +1,210 @@
+"""
+Read-only search bundle for serverless deployments.
+
+A bundle is a directory exported from a full installation that answers
+searches with NumPy alone: int8 image embeddings with per-dimension scales,
+the index's columnar path/id metadata, the database fields of each image
+and a table of precomputed text embeddings for common queries (the label
+vocabulary, the tags in use and any extra queries given at export time).
+Every array is memory-mapped on load, so a cold start only reads the
+manifest and builds the query lookup table.
+"""
+
+import os
+import json
+import time
+import numpy as np
+from models.metadata_store import MetadataStore
+from models.numpy_index import NumpyIndex
+from database.keyword_index import tokenize
+
+BUNDLE_FORMAT = 1
+
+# Database fields stored for each image, as in /api/search results
+BUNDLE_FIELDS = ('db_id', 'favorites', 'tags', 'description', 'uploaded_at', 'metadata')
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+def quantize(embeddings):
+    """Symmetric int8 codes and per-dimension scales for an (n, d) matrix"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=0) / 127.0 if len(embeddings) else np.ones(embeddings.shape[1], dtype=np.float32)
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(embeddings / scales), -127, 127).astype(np.int8)
+    return codes, scales
+
+def _save(path, array):
+    with open(f"{path}.tmp", 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(f"{path}.tmp", path)
+
+def _pack_strings(strings):
+    """UTF-8 strings packed into (offsets, blob) arrays"""
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+def _unpack_string(offsets, blob, i):
+    return blob[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+def export_bundle(output_dir, image_index, db, embedder, queries=(), batch_size=256):
+    """Write a search bundle for the current index and database.
+
+    `queries` are extra texts to precompute embeddings for, on top of the
+    label vocabulary and the tags in use. Returns the manifest.
+    """
+    from models.labels import label_vocabulary
+
+    os.makedirs(output_dir, exist_ok=True)
+    with image_index.lock:
+        metadata = MetadataStore.from_paths(image_index.image_metadata.all_paths(),
+                                            image_index.image_metadata.ids(np.arange(len(image_index.image_metadata))))
+        embeddings = np.array(image_index.image_embeddings[:len(metadata)], dtype=np.float32)
+        generation = image_index.generation
+
+    # Image embeddings and metadata
+    codes, scales = quantize(embeddings)
+    _save(os.path.join(output_dir, 'codes.npy'), codes)
+    _save(os.path.join(output_dir, 'scales.npy'), scales)
+    metadata.save(os.path.join(output_dir, 'image_metadata'))
+
+    # Database fields by index position, as one JSON object per image
+    images = db.get_images_by_paths(metadata.all_paths())
+    fields = []
+    for image in images:
+        if image is None:
+            fields.append('{}')
+            continue
+        row = {field: image.get(field) for field in BUNDLE_FIELDS if field != 'db_id'}
+        row['db_id'] = image['id']
+        fields.append(json.dumps(row, separators=(',', ':')))
+    offsets, blob = _pack_strings(fields)
+    _save(os.path.join(output_dir, 'fields_offsets.npy'), offsets)
+    _save(os.path.join(output_dir, 'fields_blob.npy'), blob)
+
+    # Common queries, embedded as /api/search embeds them
+    texts = list(label_vocabulary.labels) + [tag for tag, _ in db.get_tag_counts()] + list(queries)
+    texts = list(dict.fromkeys(normalize_query(text) for text in texts if text and text.strip()))
+    query_embeddings = []
+    for start in range(0, len(texts), batch_size):
+        batch = embedder.embed_texts(texts[start:start + batch_size])
+        if batch is None:
+            raise RuntimeError("Text embedding failed; is the model loaded?")
+        query_embeddings.append(np.asarray(batch, dtype=np.float32))
+    query_embeddings = np.vstack(query_embeddings) if query_embeddings else np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+    offsets, blob = _pack_strings(texts)
+    _save(os.path.join(output_dir, 'query_offsets.npy'), offsets)
+    _save(os.path.join(output_dir, 'query_blob.npy'), blob)
+    _save(os.path.join(output_dir, 'query_embeddings.npy'), query_embeddings.astype(np.float16))
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'model_name': getattr(embedder, 'model_name', None),
+        'dimension': int(embeddings.shape[1]) if embeddings.ndim == 2 else image_index.dimension,
+        'images': len(metadata),
+        'queries': len(texts),
+        'index_generation': generation,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    with open(os.path.join(output_dir, 'manifest.json.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(output_dir, 'manifest.json.tmp'), os.path.join(output_dir, 'manifest.json'))
+    return manifest
+
+class SearchBundle:
+    def __init__(self, bundle_dir, block_size=8192):
+        """Load an exported bundle, memory-mapping every array"""
+        def load(name):
+            return np.load(os.path.join(bundle_dir, f"{name}.npy"), mmap_mode='r')
+
+        with open(os.path.join(bundle_dir, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format: {self.manifest.get('format')}")
+
+        self.dimension = self.manifest['dimension']
+        # Small blocks keep the float32 copy of each int8 block small
+        self.index = NumpyIndex(self.dimension, load('codes'), block_size=block_size, scales=load('scales'))
+        self.metadata = MetadataStore.load(os.path.join(bundle_dir, 'image_metadata'))
+        self._fields_offsets, self._fields_blob = load('fields_offsets'), load('fields_blob')
+
+        self.query_embeddings = load('query_embeddings')
+        offsets, blob = load('query_offsets'), load('query_blob')
+        self.queries = {_unpack_string(offsets, blob, i): i for i in range(len(offsets) - 1)}
+        # Single-word entries, used to approximate queries not in the table
+        self.words = {text: row for text, row in self.queries.items() if ' ' not in text}
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def text_embedding(self, query):
+        """Embedding of a query from the table, or None if it can't be approximated.
+
+        Unknown queries fall back to the mean embedding of their words that
+        are in the table.
+        """
+        text = normalize_query(query)
+        row = self.queries.get(text)
+        if row is not None:
+            rows = [row]
+        else:
+            rows = [self.words[word] for word in tokenize(text) if word in self.words]
+            if not rows:
+                return None
+        vector = np.asarray(self.query_embeddings[rows], dtype=np.float32).mean(axis=0)
+        return (vector / (np.linalg.norm(vector) + 1e-12)).reshape(1, -1)
+
+    def image_embedding(self, image_id):
+        if image_id is None or not 0 <= image_id < len(self):
+            return None
+        vector = self.index.reconstruct_n(image_id, 1)
+        return vector / (np.linalg.norm(vector) + 1e-12)
+
+    def search(self, query='', image_id=None, k=20, weight_text=0.7, fields=BUNDLE_FIELDS):
+        """Search like ImageIndex.search, returning result dicts with the requested fields.
+
+        Returns None if the query is not covered by the bundle.
+        """
+        text_vector = self.text_embedding(query) if query else None
+        image_vector = self.image_embedding(image_id)
+        if query and text_vector is None:
+            return None
+        if text_vector is not None and image_vector is not None:
+            search_vector = weight_text * text_vector + (1 - weight_text) * image_vector
+            search_vector = search_vector / np.linalg.norm(search_vector)
+        elif text_vector is not None or image_vector is not None:
+            search_vector = text_vector if text_vector is not None else image_vector
+        else:
+            return []
+
+        scores, positions = self.index.search(search_vector, min(k, len(self)))
+        valid = positions[0] >= 0
+        return self.format_results(scores[0][valid], positions[0][valid], fields)
+
+    def format_results(self, scores, positions, fields=BUNDLE_FIELDS):
+        ids = self.metadata.ids(positions).tolist()
+        paths = self.metadata.paths(positions)
+        results = []
+        for path, image_id, score, position in zip(paths, ids, scores.tolist(), positions.tolist()):
+            result = {'path': path, 'id': image_id, 'score': score}
+            if fields:
+                row = json.loads(_unpack_string(self._fields_offsets, self._fields_blob, position))
+                for field in fields:
+                    result[field] = row.get(field)
+            results.append(result)
+        return results
+
+    def images(self):
+        """Every image's database fields, like /api/images"""
+        images = []
+        for position in range(len(self)):
+            row = json.loads(_unpack_string(self._fields_offsets, self._fields_blob, position))
+            if row:
+                image = {key: value for key, value in row.items() if key != 'db_id'}
+                image['id'] = row['db_id']
+                image['path'] = self.metadata.path(position)
+                images.append(image)
+        return images
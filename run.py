@@ -5,8 +5,17 @@ import subprocess
 import webbrowser
 import time
 import sys
+import threading
 from pathlib import Path
 
+# gunicorn is only needed for the production serve mode
+try:
+    from gunicorn.app.base import BaseApplication
+    GUNICORN_AVAILABLE = True
+except ImportError:
+    BaseApplication = object
+    GUNICORN_AVAILABLE = False
+
 def setup_env():
     """Set up the environment if needed"""
     # Create necessary directories
@@ -33,13 +42,11 @@ def verify_dependencies():
         # Try to import FAISS
         try:
             import faiss
-            faiss_available = True
         except ImportError:
-            faiss_available = False
-            print("ERROR: FAISS not available. Vector search will not work.")
+            print("WARNING: FAISS not available. Search will use the slower NumPy backend.")
             print("Please run 'conda install -c conda-forge faiss-cpu' to install FAISS.")
         
-        return clip_available and faiss_available
+        return clip_available
     except ImportError as e:
         print(f"ERROR: Missing critical dependency: {e}")
         print("Please run 'python setup.py' to install all dependencies.")
@@ -128,15 +135,196 @@ def run_app(dev_mode=False):
         os.environ['FLASK_RUN_PORT'] = port
         subprocess.run(['python', 'app.py'])
 
+def configure_worker_threads(num_threads):
+    """Limit torch and FAISS to num_threads so workers don't oversubscribe the CPUs"""
+    # Clients of an embedding server never load torch
+    if not os.environ.get('EMBEDDING_SERVER'):
+        try:
+            import torch
+            torch.set_num_threads(num_threads)
+        except ImportError:
+            pass
+    
+    try:
+        import faiss
+        faiss.omp_set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+def start_embedding_server(address, timeout=300):
+    """Start the shared embedding server and make this process and its workers its clients.
+
+    Returns the server process, or None if it did not come up in time.
+    """
+    import atexit
+    
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'embedding_server.py')
+    process = subprocess.Popen([sys.executable, script, '--address', address])
+    atexit.register(process.terminate)
+    
+    from models.embedding_service import EmbeddingClient
+    client = EmbeddingClient(address)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            print("ERROR: Embedding server exited during startup")
+            return None
+        if client.info() is not None:
+            os.environ['EMBEDDING_SERVER'] = address
+            return process
+        time.sleep(0.5)
+    print("ERROR: Embedding server did not start in time")
+    process.terminate()
+    return None
+
+def watch_snapshots(interval):
+    """Reload indexes and databases in this worker when another worker saves them.
+
+    Also takes over running background jobs if the worker that was running
+    them has exited.
+    """
+    try:
+        from utils.collection_manager import collection_manager
+        from utils.jobs import job_queue
+    except ImportError:
+        return
+    
+    while True:
+        time.sleep(interval)
+        try:
+            collection_manager.reload_if_changed()
+            if job_queue.role == 'client' and job_queue.claim_runner():
+                print(f"Worker {os.getpid()} is now running background jobs")
+                job_queue.start(poll_interval=interval)
+        except Exception as e:
+            print(f"Error checking for snapshot changes: {e}")
+
+class ProductionServer(BaseApplication):
+    """gunicorn application that loads the model and index once in the master.
+
+    Workers are forked after loading, so the CLIP weights and index arrays
+    are shared copy-on-write instead of loaded once per worker.
+    """
+    def __init__(self, options, use_asgi=False):
+        self.options = options
+        self.use_asgi = use_asgi
+        super().__init__()
+    
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+    
+    def load(self):
+        import gc
+        
+        if self.use_asgi:
+            from asgi import app
+        else:
+            from app import app
+        
+        # Move everything loaded so far out of the garbage collector's reach
+        # so collections in the workers don't touch (and copy) shared pages
+        gc.freeze()
+        return app
+
+def serve_production(host, port, workers=None, threads=None, use_asgi=False, reload_interval=2.0,
+                     embedding_server=None):
+    """Run the application under gunicorn with preloaded shared model and index.
+
+    With `embedding_server` (an address), the model is loaded once in a
+    separate embedding server process and the workers are its clients.
+    """
+    if not GUNICORN_AVAILABLE:
+        print("ERROR: gunicorn not available. Please install it with: pip install gunicorn")
+        return False
+    
+    setup_env()
+    
+    if embedding_server and start_embedding_server(embedding_server) is None:
+        return False
+    
+    cpu_count = os.cpu_count() or 1
+    workers = workers or max(1, min(4, cpu_count // 2))
+    threads = threads or max(1, cpu_count // workers)
+    
+    # Thread pools are sized when torch/NumPy/FAISS are first imported, so
+    # this has to happen before the app is loaded in the master
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'SEARCH_THREADS'):
+        os.environ[var] = str(threads)
+    configure_worker_threads(threads)
+    
+    # CUDA cannot be used from a forked child, so GPU hosts load per worker
+    # (unless the model lives in the embedding server)
+    preload = True
+    if not os.environ.get('EMBEDDING_SERVER'):
+        try:
+            import torch
+            if torch.cuda.is_available():
+                print("WARNING: CUDA available, loading the model in each worker instead of preloading")
+                preload = False
+        except ImportError:
+            pass
+    
+    def post_fork(server, worker):
+        configure_worker_threads(threads)
+        
+        # Exactly one worker runs background jobs; the others queue them
+        try:
+            from utils.jobs import job_queue
+            from utils.warmup import warmer
+            warmer.start()
+            if job_queue.claim_runner():
+                print(f"Worker {os.getpid()} is running background jobs")
+                job_queue.start(poll_interval=reload_interval)
+        except ImportError:
+            pass
+        
+        watcher = threading.Thread(
+            target=watch_snapshots,
+            args=(reload_interval,),
+            name="snapshot-watcher",
+            daemon=True
+        )
+        watcher.start()
+    
+    options = {
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'preload_app': preload,
+        'post_fork': post_fork,
+        'timeout': 120
+    }
+    if use_asgi:
+        options['worker_class'] = 'uvicorn.workers.UvicornWorker'
+    
+    print(f"Starting {workers} workers with {threads} threads each")
+    print(f"Server running at http://{host}:{port}")
+    ProductionServer(options, use_asgi=use_asgi).run()
+    return True
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run the Image Retrieval System')
     parser.add_argument('--dev', action='store_true', help='Run in development mode')
     parser.add_argument('--build-frontend', action='store_true', help='Build the frontend only')
     parser.add_argument('--verify', action='store_true', help='Verify dependencies')
+    parser.add_argument('--serve', action='store_true', help='Run the production server (gunicorn, multiple workers)')
+    parser.add_argument('--workers', type=int, help='Number of worker processes for --serve')
+    parser.add_argument('--threads', type=int, help='Torch/OpenMP threads per worker for --serve')
+    parser.add_argument('--asgi', action='store_true', help='Serve the ASGI app with --serve')
+    parser.add_argument('--host', default='0.0.0.0', help='Host to bind for --serve')
+    parser.add_argument('--embedding-server', nargs='?', const='unix:/tmp/image-retrieval-embedder.sock',
+                        help='Load the model once in a shared embedding server for --serve (optional address)')
     
     args = parser.parse_args()
     
-    if args.verify:
+    if args.serve:
+        import platform
+        default_port = 5002 if platform.system() == 'Darwin' else 5000
+        port = int(os.environ.get('FLASK_RUN_PORT', default_port))
+        success = serve_production(args.host, port, args.workers, args.threads, use_asgi=args.asgi,
+                                   embedding_server=args.embedding_server)
+        sys.exit(0 if success else 1)
+    elif args.verify:
         all_deps = verify_dependencies()
         if all_deps:
             print("All dependencies verified successfully!")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Build script that exports the current index and database as a read-only
+search bundle for the serverless deployment (see serverless.py).
+
+Usage:
+  python scripts/build_search_bundle.py --output bundle
+  python scripts/build_search_bundle.py --output bundle --queries common_queries.txt
+"""
+
+import os
+import sys
+import argparse
+
+# Add parent directory to path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.index import image_index
+from database.db import db
+from models.search_bundle import export_bundle
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a read-only search bundle for serverless deployment')
+    parser.add_argument('--output', default='bundle', help='Directory to write the bundle to')
+    parser.add_argument('--queries', help='File with extra queries to precompute, one per line')
+    
+    args = parser.parse_args()
+    
+    queries = []
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    
+    manifest = export_bundle(args.output, image_index, db, image_index.embedder, queries=queries)
+    
+    size = sum(os.path.getsize(os.path.join(args.output, name)) for name in os.listdir(args.output))
+    print(f"Exported {manifest['images']} images and {manifest['queries']} queries "
+          f"to {args.output} ({size / 1e6:.1f} MB)")
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Embedding server that loads the CLIP model once and serves embeddings to
+every web worker and script on the machine.
+
+Usage:
+  python scripts/embedding_server.py --address unix:/tmp/image-retrieval-embedder.sock
+  EMBEDDING_SERVER=unix:/tmp/image-retrieval-embedder.sock python run.py --serve
+"""
+
+import os
+import sys
+import signal
+import argparse
+
+# Add parent directory to path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_ADDRESS = 'unix:/tmp/image-retrieval-embedder.sock'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve image and text embeddings to other processes')
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help='unix:/path/to/socket or http://host:port')
+    parser.add_argument('--max-batch', type=int, default=64, help='Largest batch sent to the model')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='How long a batch waits for more requests')
+    parser.add_argument('--allowed-root', action='append', dest='allowed_roots',
+                        help='Directory whose images may be embedded by path (repeatable; '
+                             'default on TCP: the static folder, on a Unix socket: anywhere)')
+    
+    args = parser.parse_args()
+    
+    # This process holds the model, so it must not be a client itself
+    os.environ.pop('EMBEDDING_SERVER', None)
+    
+    from models.image_embedder import embedder
+    from models.embedding_service import EmbeddingServer
+    
+    # Exit cleanly on SIGTERM so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    server = EmbeddingServer(embedder, args.address, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000,
+                             allowed_roots=args.allowed_roots)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Reconcile script to bring the database and search index back in line
+with the images in static/uploads.
+
+Missing images are embedded, moved images keep their embeddings and
+entries for deleted images are dropped.
+
+Usage:
+  python scripts/reconcile.py --dry-run
+  python scripts/reconcile.py --workers 8
+"""
+
+import os
+import sys
+import argparse
+
+# Add parent directory to path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.reconciler import reconciler
+
+def print_progress(done, total):
+    print(f"\rEmbedded {done}/{total} images", end='', flush=True)
+    if done == total:
+        print()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reconcile the database and index with the uploads folder')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be repaired')
+    parser.add_argument('--workers', type=int, default=8, help='Number of embedding threads')
+    
+    args = parser.parse_args()
+    
+    summary = reconciler.reconcile(dry_run=args.dry_run, progress=print_progress, max_workers=args.workers)
+    
+    for key, value in summary.items():
+        print(f"{key.replace('_', ' ')}: {value}")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Watch script that keeps the search index and database in step with the
+images in static/uploads (or a collection's upload folder).
+
+New, changed and removed images are indexed a few seconds after they
+settle, without reindexing anything else. Don't run it alongside a server
+started with WATCH_UPLOADS=1, which watches the same folder.
+
+Usage:
+  python scripts/watch_uploads.py
+  python scripts/watch_uploads.py --collection products --debounce 5
+  python scripts/watch_uploads.py --poll 10 --reconcile-first
+"""
+
+import os
+import sys
+import signal
+import argparse
+
+# Add parent directory to path so we can import our modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.collection_manager import collection_manager
+from utils.watcher import UploadWatcher
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index images as they are added to, changed in or removed from the uploads folder')
+    parser.add_argument('--collection', default=None, help='Collection to watch (default: the default collection)')
+    parser.add_argument('--debounce', type=float, default=2.0, help='Seconds without file events before changes are indexed')
+    parser.add_argument('--max-delay', type=float, default=30.0, help='Longest wait before indexing while files keep arriving')
+    parser.add_argument('--poll', type=float, default=None, metavar='SECONDS',
+                        help='Poll for changes every SECONDS instead of using inotify')
+    parser.add_argument('--reconcile-first', action='store_true',
+                        help='Index changes made while nothing was watching before starting')
+
+    args = parser.parse_args()
+
+    if args.collection and not collection_manager.exists(args.collection):
+        print(f"Collection not found: {args.collection}")
+        sys.exit(1)
+    reconciler = collection_manager.get(args.collection).reconciler
+    watcher = UploadWatcher(
+        reconciler,
+        debounce=args.debounce,
+        max_delay=args.max_delay,
+        poll_interval=args.poll or 5.0,
+        use_inotify=args.poll is None
+    )
+
+    if args.reconcile_first:
+        summary = reconciler.reconcile()
+        print(f"Reconciled: {summary['embedded']} embedded, {summary['db_removed']} removed")
+
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
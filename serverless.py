@@ -0,0 +1,96 @@
+"""
+Read-only API for serverless deployments, served from a search bundle.
+
+Unlike app.py this imports neither torch nor CLIP nor the full index, so a
+cold start only maps the bundle built by scripts/build_search_bundle.py
+(SEARCH_BUNDLE, default ./bundle). Text queries are answered from the
+bundle's table of precomputed query embeddings; uploads and other writes
+are rejected.
+"""
+
+import os
+import time
+from flask import Flask, request, jsonify, Response
+from flask_cors import CORS
+from models.search_bundle import SearchBundle, BUNDLE_FIELDS
+from utils.serialization import dumps
+
+BUNDLE_DIR = os.environ.get('SEARCH_BUNDLE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bundle'))
+DEFAULT_RESULT_FIELDS = ('db_id', 'favorites', 'tags', 'description')
+MAX_SEARCH_LIMIT = 1000
+
+app = Flask(__name__, static_folder='static')
+CORS(app)
+
+# Loaded on first use so the module imports instantly
+_bundle = None
+_load_seconds = None
+
+def get_bundle():
+    global _bundle, _load_seconds
+    if _bundle is None:
+        start = time.perf_counter()
+        _bundle = SearchBundle(BUNDLE_DIR)
+        _load_seconds = time.perf_counter() - start
+        print(f"Loaded search bundle with {len(_bundle)} images in {_load_seconds * 1000:.0f} ms")
+    return _bundle
+
+def json_response(payload, status=200):
+    """JSON response serialised with the fast encoder"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    """Get the status of the deployment"""
+    try:
+        bundle = get_bundle()
+    except (OSError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': f"Search bundle not available: {e}"}), 500
+    
+    return jsonify({
+        'status': 'ok',
+        'mode': 'bundle',
+        'embedder': False,
+        'index_size': len(bundle),
+        'image_count': len(bundle),
+        'queries': len(bundle.queries),
+        'bundle': bundle.manifest,
+        'load_ms': round(_load_seconds * 1000, 1)
+    })
+
+@app.route('/api/search', methods=['POST'])
+def search():
+    """Search the bundle by text prompt and/or reference image"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+    
+    query = data.get('query', '')
+    image_id = data.get('imageId')
+    limit = data.get('limit', 20)
+    weight_text = data.get('weightText', 0.7)
+    fields = data.get('fields', list(DEFAULT_RESULT_FIELDS))
+    if not query and image_id is None:
+        return jsonify({'error': 'Either query or imageId must be provided'}), 400
+    if image_id is not None and (not isinstance(image_id, int) or isinstance(image_id, bool)):
+        return jsonify({'error': 'imageId must be an integer'}), 400
+    if not isinstance(fields, list) or any(field not in BUNDLE_FIELDS for field in fields):
+        return jsonify({'error': f"fields must be a list of: {', '.join(BUNDLE_FIELDS)}"}), 400
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    if not isinstance(weight_text, (int, float)) or isinstance(weight_text, bool) or not 0 <= weight_text <= 1:
+        return jsonify({'error': 'weightText must be a number between 0 and 1'}), 400
+    
+    results = get_bundle().search(query, image_id, min(limit, MAX_SEARCH_LIMIT), weight_text, fields)
+    if results is None:
+        return jsonify({'error': 'Query not supported by this deployment; try a simpler query'}), 422
+    return json_response({'results': results})
+
+@app.route('/api/images', methods=['GET'])
+def list_images():
+    """Get all images in the bundle"""
+    return json_response({'images': get_bundle().images()})
+
+@app.route('/api/<path:path>', methods=['POST', 'PUT', 'DELETE'])
+def read_only(path):
+    return jsonify({'error': 'This deployment is read-only'}), 405
@@ -0,0 +1,64 @@
+"""
+Shared fixtures. Tests run offline with the stub embedder; every index,
+database and job directory lives under pytest's tmp_path.
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The stub must be selected before any model module is imported, and the
+# module-level singletons (default index, database, job queue) are created
+# relative to the working directory, so keep them out of the repository
+os.environ['IMAGE_EMBEDDER'] = 'stub'
+os.environ['QUERY_LOG'] = ''
+sys.path.insert(0, REPO_ROOT)
+os.chdir(tempfile.mkdtemp(prefix='image-retrieval-tests-'))
+
+def write_image(path, seed, size=(32, 32)):
+    """Write a small random PNG; the same seed gives the same bytes"""
+    from PIL import Image
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, format='PNG')
+    return path
+
+class Workspace:
+    def __init__(self, root):
+        """An upload folder, index and database under `root`, laid out like static/ and index/"""
+        self.root = str(root)
+        self.static_dir = os.path.join(self.root, 'static')
+        self.upload_dir = os.path.join(self.static_dir, 'uploads')
+        self.index_dir = os.path.join(self.root, 'index')
+        self.db_path = os.path.join(self.root, 'database', 'images.json')
+        self.open()
+
+    def open(self):
+        """(Re)load the stores from disk, as a fresh process would"""
+        from models.index import ImageIndex
+        from database.db import ImageDatabase
+        from utils.image_processor import ImageProcessor
+
+        self.index = ImageIndex(index_dir=self.index_dir, backend='numpy')
+        self.db = ImageDatabase(self.db_path)
+        self.processor = ImageProcessor(self.upload_dir, self.index, self.db, path_root=self.static_dir)
+        return self
+
+    def image(self, name, seed):
+        return write_image(os.path.join(self.upload_dir, name), seed)
+
+    def indexed_paths(self):
+        return list(self.index.image_metadata.all_paths())
+
+    def row_paths(self):
+        return [row['path'] for row in self.db.get_all_images()]
+
+@pytest.fixture
+def workspace(tmp_path):
+    return Workspace(tmp_path)
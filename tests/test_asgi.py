@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+from starlette.testclient import TestClient
+
+from utils.executor import BoundedExecutor, ExecutorBusy
+
+@pytest.fixture
+def saturated(monkeypatch):
+    """A one-worker executor, no queue, whose only worker is busy until the test ends"""
+    import asgi
+
+    executor = BoundedExecutor(max_workers=1, max_pending=0)
+    release = threading.Event()
+    executor.submit(release.wait, 10)
+    monkeypatch.setattr(asgi, 'cpu_executor', executor)
+    yield executor
+    release.set()
+    executor.shutdown()
+
+def test_executor_refuses_work_beyond_its_queue():
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+    release = threading.Event()
+    running = [executor.submit(release.wait, 10), executor.submit(release.wait, 10)]
+
+    with pytest.raises(ExecutorBusy):
+        executor.submit(release.wait, 10)
+
+    release.set()
+    assert all(future.result(10) for future in running)
+    assert executor.submit(lambda: 'done').result(10) == 'done'
+
+@pytest.mark.parametrize('method, path, body', [('POST', '/api/search', {'query': 'beach'}),
+                                                ('GET', '/api/clusters', None)])
+def test_saturated_executor_answers_429(saturated, method, path, body):
+    import asgi
+
+    response = TestClient(asgi.app).request(method, path, json=body)
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,25 @@
+from starlette.testclient import TestClient
+
+from utils.metrics import HTTP_SECONDS
+
+def observations(**labels):
+    entry = HTTP_SECONDS._values.get(tuple(sorted(labels.items())))
+    return entry[2] if entry else 0
+
+def test_native_routes_record_http_seconds():
+    import asgi
+
+    # Without the context manager the lifespan (job workers, warmer) doesn't run
+    client = TestClient(asgi.app)
+    search = dict(endpoint='/api/search', method='POST')
+    clusters = dict(endpoint='/api/clusters', method='GET')
+    before = (observations(status=200, **search), observations(status=400, **search),
+              observations(status=200, **clusters))
+
+    assert client.post('/api/search', json={'query': 'beach'}).status_code == 200
+    assert client.post('/api/search', json={'imageId': '3'}).status_code == 400
+    assert client.get('/api/clusters').status_code == 200
+
+    after = (observations(status=200, **search), observations(status=400, **search),
+             observations(status=200, **clusters))
+    assert [b - a for a, b in zip(before, after)] == [1, 1, 1]
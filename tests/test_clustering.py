@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pytest
+
+from models.clustering import ClusterStore
+from models.index import ImageIndex
+
+def grouped_vectors(count, seed=0):
+    """Unit vectors near e0 (even rows) and e1 (odd rows)"""
+    vectors = np.random.default_rng(seed).normal(scale=0.05, size=(count, 512)).astype(np.float32)
+    vectors[np.arange(count), np.arange(count) % 2] += 1
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+@pytest.fixture
+def index_dir(tmp_path):
+    index = ImageIndex(index_dir=str(tmp_path / 'index'), backend='numpy')
+    index.add_images([f"{i}.png" for i in range(20)], grouped_vectors(20))
+    return index.index_dir
+
+def no_refit(monkeypatch):
+    def fit(*args, **kwargs):
+        raise AssertionError('clusters were refit')
+    monkeypatch.setattr(ClusterStore, 'fit', fit)
+
+def test_clusterings_are_persisted_per_k(index_dir, monkeypatch):
+    index = ImageIndex(index_dir=index_dir, backend='numpy')
+    fitted = {k: index.get_cluster_state(k).assignments.copy() for k in (2, 3)}
+
+    assert {name for name in os.listdir(index_dir) if name.startswith('clusters_')} == {'clusters_k2.npz', 'clusters_k3.npz'}
+
+    # Another process loads them instead of fitting again
+    no_refit(monkeypatch)
+    reopened = ImageIndex(index_dir=index_dir, backend='numpy')
+    for k, assignments in fitted.items():
+        np.testing.assert_array_equal(reopened.get_cluster_state(k).assignments, assignments)
+
+def test_added_images_join_the_nearest_existing_cluster(index_dir, monkeypatch):
+    index = ImageIndex(index_dir=index_dir, backend='numpy')
+    state = index.get_cluster_state(2)
+    e0_cluster = state.assignments[0]
+
+    no_refit(monkeypatch)
+    index.add_images(['new.png'], grouped_vectors(1, seed=1))
+
+    state = index.get_cluster_state(2)
+    assert len(state.assignments) == 21 and state.assignments[20] == e0_cluster
+    # The extended clustering was saved with the index
+    reopened = ImageIndex(index_dir=index_dir, backend='numpy')
+    assert reopened.get_cluster_state(2).assignments[20] == e0_cluster
+
+def test_clusters_are_refit_once_the_index_has_grown_enough(index_dir):
+    index = ImageIndex(index_dir=index_dir, backend='numpy')
+    assert index.get_cluster_state(2).fit_size == 20
+
+    index.add_images([f"more_{i}.png" for i in range(21)], grouped_vectors(21, seed=2))
+
+    assert index.get_cluster_state(2).fit_size == 41
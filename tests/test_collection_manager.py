@@ -0,0 +1,47 @@
+import pytest
+
+from utils.collection_manager import CollectionManager
+
+@pytest.fixture
+def manager(tmp_path):
+    # With no memory budget every idle collection is evicted as soon as another loads
+    manager = CollectionManager(root=str(tmp_path / 'collections'), static_dir=str(tmp_path / 'static'), memory_budget=0)
+    for name in ('a', 'b', 'c'):
+        manager.create(name)
+    return manager
+
+def loaded_names(manager):
+    return [collection.name for collection in manager.loaded()[1:]]
+
+def test_least_recently_used_idle_collection_is_evicted(manager):
+    manager.get('a')
+    manager.get('b')
+
+    assert loaded_names(manager) == ['b']
+
+def test_collection_in_use_is_never_evicted(manager):
+    with manager.use('a') as a:
+        manager.get('b')
+        manager.get('c')
+
+        assert loaded_names(manager) == ['a', 'c']
+        assert manager.get('a') is a
+
+def test_collection_with_unsaved_changes_is_never_evicted(manager):
+    manager.get('a').index._dirty = True
+    manager.get('b')
+
+    assert loaded_names(manager) == ['a', 'b']
+
+def test_use_counts_the_user_before_anything_can_evict(manager, monkeypatch):
+    users = []
+    evict = manager._evict
+
+    def recording_evict(keep=None):
+        users.append(manager._loaded[keep].users)
+        evict(keep)
+
+    monkeypatch.setattr(manager, '_evict', recording_evict)
+    with manager.use('a') as collection:
+        assert users == [1] and collection.users == 1
+    assert collection.users == 0
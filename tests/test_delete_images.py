@@ -0,0 +1,42 @@
+import os
+import uuid
+
+import pytest
+
+from tests.conftest import write_image
+
+@pytest.fixture
+def collection():
+    """A fresh collection; its files live under the working directory, not app.static_folder"""
+    from utils.collection_manager import collection_manager
+
+    return collection_manager.create(f"delete-{uuid.uuid4().hex[:8]}")
+
+def add_image(collection, name, seed):
+    path = write_image(os.path.join(collection.processor.upload_dir, name), seed)
+    image = collection.processor.process_upload(path)
+    return collection.db.get_images_by_paths([image['path']])[0]['id'], path
+
+def test_delete_image_removes_file_under_path_root(collection):
+    from app import app
+
+    image_id, path = add_image(collection, 'a.png', 1)
+
+    response = app.test_client().delete(f"/api/images/{image_id}", headers={'X-Collection': collection.name})
+
+    assert response.status_code == 200
+    assert not os.path.exists(path)
+    assert collection.db.get_image(image_id) is None
+
+def test_bulk_delete_removes_files_under_path_root(collection):
+    from app import app
+
+    first_id, first = add_image(collection, 'a.png', 1)
+    second_id, second = add_image(collection, 'b.png', 2)
+
+    response = app.test_client().delete('/api/images', json={'ids': [first_id, second_id, 999]},
+                                        headers={'X-Collection': collection.name})
+
+    assert response.status_code == 200
+    assert response.get_json()['not_found'] == [999]
+    assert not os.path.exists(first) and not os.path.exists(second)
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+
+import pytest
+
+from tests.conftest import REPO_ROOT, write_image
+from models.embedding_service import EmbeddingServer, EmbeddingClient
+from models.image_embedder import StubEmbedder
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(embedder, address, **options):
+        server = EmbeddingServer(embedder, address, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        client = EmbeddingClient(address)
+        deadline = time.time() + 10
+        while client.info() is None:
+            assert time.time() < deadline, 'embedding server did not start'
+            time.sleep(0.05)
+        return client
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+def test_tcp_server_only_embeds_images_under_allowed_roots(tmp_path, serve):
+    allowed = write_image(str(tmp_path / 'static' / 'uploads' / 'a.png'), 1)
+    outside = write_image(str(tmp_path / 'private' / 'b.png'), 2)
+    client = serve(StubEmbedder(), f"http://127.0.0.1:{free_port()}", allowed_roots=[str(tmp_path / 'static')])
+
+    assert client.embed_image(allowed) is not None
+    assert client.embed_image(outside) is None
+    # A path that only starts with the root's name, or climbs out of it
+    assert client.embed_image(str(tmp_path / 'static-other' / 'c.png')) is None
+    assert client.embed_image(str(tmp_path / 'static' / '..' / 'private' / 'b.png')) is None
+
+def test_unix_server_accepts_any_path_by_default(tmp_path, serve):
+    image = write_image(str(tmp_path / 'photos' / 'a.png'), 1)
+    client = serve(StubEmbedder(), f"unix:{tmp_path / 'embedder.sock'}")
+
+    assert client.embed_image(image) is not None
+
+def start_server_process(address, model_name):
+    code = ("import sys; from models.embedding_service import EmbeddingServer; "
+            "from models.image_embedder import StubEmbedder; "
+            "EmbeddingServer(StubEmbedder(model_name=sys.argv[2]), sys.argv[1]).serve_forever()")
+    return subprocess.Popen([sys.executable, '-c', code, address, model_name], cwd=REPO_ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_for_socket(path, timeout=30):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        assert time.time() < deadline, 'embedding server did not start'
+        time.sleep(0.05)
+
+def test_client_refetches_info_after_server_restart(tmp_path):
+    path = str(tmp_path / 'embedder.sock')
+    address = f"unix:{path}"
+    first = start_server_process(address, 'stub')
+    second = None
+    try:
+        wait_for_socket(path)
+        client = EmbeddingClient(address)
+        assert client.model_name == 'stub'
+
+        # Restarted with another model; the client's kept-alive connection is reset
+        first.terminate()
+        first.wait(10)
+        if os.path.exists(path):
+            os.remove(path)
+        second = start_server_process(address, 'stub-v2')
+        wait_for_socket(path)
+
+        assert client.embed_texts(['beach']) is not None
+        assert client.model_name == 'stub-v2'
+    finally:
+        for process in (first, second):
+            if process is not None:
+                process.terminate()
+                process.wait(10)
@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import pytest
+
+from models.index import ImageIndex
+
+def unit_vectors(count, dimension=512, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+@pytest.fixture(params=['numpy', 'faiss'])
+def index(request, tmp_path):
+    index = ImageIndex(index_dir=str(tmp_path / 'index'), backend=request.param)
+    index.add_images([f"{i}.png" for i in range(50)], unit_vectors(50), save=False)
+    return index
+
+def test_snapshot_is_unchanged_by_later_writes(index):
+    query = unit_vectors(1, seed=1)
+    snapshot = index.snapshot()
+    before = snapshot.format_results(*[row[0] for row in snapshot.index.search(query, 10)])
+
+    index.add_images([f"new-{i}.png" for i in range(20)], unit_vectors(20, seed=2), save=False)
+    index.remove_images([result['path'] for result in before[:3]], save=False)
+
+    after = snapshot.format_results(*[row[0] for row in snapshot.index.search(query, 10)])
+    assert after == before
+    assert len(snapshot.metadata) == snapshot.index.ntotal == 50
+    assert len(index.image_metadata) == index.index.ntotal == 67
+
+def test_search_does_not_hold_the_lock_while_ranking(index):
+    acquired = []
+
+    def scorer(query, embeddings, k, **context):
+        # Another thread can take the lock while this search ranks candidates
+        thread = threading.Thread(target=lambda: acquired.append(index.lock.acquire(timeout=5)) or index.lock.release())
+        thread.start()
+        thread.join()
+        scores = embeddings @ query.reshape(-1)
+        order = np.argsort(-scores)[:k]
+        return order, scores[order]
+
+    results = index.search_by_vector(unit_vectors(1, seed=1), 5, rerank=scorer)
+
+    assert len(results) == 5 and acquired == [True]
+
+@pytest.mark.parametrize('threshold, expected', [(1.0, 1), (0.0, 4), (0.5, 1)])
+def test_threshold_keeps_scores_equal_to_it(tmp_path, threshold, expected):
+    # Axis vectors score exactly 1 against themselves and 0 against each other
+    counts = []
+    for backend in ('numpy', 'faiss'):
+        index = ImageIndex(index_dir=str(tmp_path / backend), backend=backend)
+        index.add_images([f"{i}.png" for i in range(4)], np.eye(4, 512, dtype=np.float32), save=False)
+        counts.append(len(index.search_by_vector(np.eye(1, 512, dtype=np.float32), None, threshold=threshold)))
+
+    assert counts == [expected, expected]
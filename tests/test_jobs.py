@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+
+from utils.jobs import JobQueue, RUNNING, COMPLETED, CANCELLED, FAILED
+
+def wait_for(queue, job_id, states=(COMPLETED, FAILED, CANCELLED), timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        record = queue.get(job_id)
+        if record['status'] in states:
+            return record
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {queue.get(job_id)['status']}")
+
+def test_runs_job_and_records_result(tmp_path):
+    queue = JobQueue(jobs_dir=str(tmp_path))
+    queue.register('add', lambda job, a, b: {'sum': a + b})
+    queue.start()
+
+    job = queue.submit('add', a=2, b=3)
+    record = wait_for(queue, job['id'])
+
+    assert record['status'] == COMPLETED
+    assert record['result'] == {'sum': 5}
+
+def test_failed_job_records_error(tmp_path):
+    def fail(job):
+        raise RuntimeError('broken')
+
+    queue = JobQueue(jobs_dir=str(tmp_path))
+    queue.register('fail', fail)
+    queue.start()
+
+    record = wait_for(queue, queue.submit('fail')['id'])
+
+    assert record['status'] == FAILED and record['error'] == 'broken'
+
+def test_recovers_queued_jobs_and_jobs_of_dead_processes(tmp_path):
+    # A process that queued two jobs and died while running one of them
+    before = JobQueue(jobs_dir=str(tmp_path))
+    before.register('echo', lambda job, value: value)
+    queued = before.submit('echo', value=1)
+    interrupted = before.submit('echo', value=2)
+    before._update(interrupted['id'], {'status': RUNNING, 'pid': 2 ** 22 + 1})
+
+    after = JobQueue(jobs_dir=str(tmp_path))
+    after.register('echo', lambda job, value: value)
+    after.start()
+
+    assert wait_for(after, queued['id'])['result'] == 1
+    assert wait_for(after, interrupted['id'])['result'] == 2
+
+def test_leaves_running_jobs_of_live_processes(tmp_path):
+    queue = JobQueue(jobs_dir=str(tmp_path))
+    queue.register('echo', lambda job, value: value)
+    job = queue.submit('echo', value=1)
+    # Still running in another live process
+    queue._update(job['id'], {'status': RUNNING, 'pid': os.getppid()})
+
+    other = JobQueue(jobs_dir=str(tmp_path))
+    other.register('echo', lambda job, value: value)
+    other._recover()
+
+    assert other.get(job['id'])['status'] == RUNNING
+
+def test_cancel_queued_job(tmp_path):
+    queue = JobQueue(jobs_dir=str(tmp_path))
+    queue.register('echo', lambda job, value: value)
+    job = queue.submit('echo', value=1)
+
+    record = queue.cancel(job['id'])
+    queue.start()
+    time.sleep(0.1)
+
+    assert record['status'] == CANCELLED
+    assert queue.get(job['id'])['status'] == CANCELLED
+    assert queue.get(job['id'])['result'] is None
+
+def test_cancel_running_job_stops_at_next_progress_update(tmp_path):
+    started = threading.Event()
+    steps = []
+
+    def slow(job):
+        started.set()
+        for i in range(500):
+            steps.append(i)
+            job.update_progress(i, 500)
+            time.sleep(0.01)
+        return 'finished'
+
+    queue = JobQueue(jobs_dir=str(tmp_path))
+    queue.register('slow', slow)
+    queue.start()
+    job = queue.submit('slow')
+    assert started.wait(5)
+
+    queue.cancel(job['id'])
+    record = wait_for(queue, job['id'])
+
+    assert record['status'] == CANCELLED
+    assert len(steps) < 500
+
+def test_cancel_requested_from_another_process(tmp_path):
+    started = threading.Event()
+
+    def wait(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    runner = JobQueue(jobs_dir=str(tmp_path))
+    runner.register('wait', wait)
+    runner.start()
+    job = runner.submit('wait')
+    assert started.wait(5)
+
+    client = JobQueue(jobs_dir=str(tmp_path))
+    client.register('wait', wait)
+    client.role = 'client'
+    client.cancel(job['id'])
+
+    assert wait_for(runner, job['id'])['status'] == CANCELLED
+
+def test_finished_job_is_not_resurrected_by_late_progress(tmp_path):
+    queue = JobQueue(jobs_dir=str(tmp_path))
+    queue.register('echo', lambda job, value: value)
+    queue.start()
+    job = queue.submit('echo', value=1)
+    wait_for(queue, job['id'])
+
+    queue._update(job['id'], {'progress': {'done': 5, 'total': 5}})
+
+    assert queue.get(job['id'])['status'] == COMPLETED
+    assert queue.get(job['id'])['progress'] != {'done': 5, 'total': 5}
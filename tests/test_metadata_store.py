@@ -0,0 +1,28 @@
+import numpy as np
+
+from models.metadata_store import MetadataStore
+
+PATHS = ['uploads/a.png', 'uploads/été.jpg', '', 'collections/x/b.png']
+
+def test_paths_match_single_lookups_in_any_order(tmp_path):
+    MetadataStore.from_paths(PATHS).save(str(tmp_path / 'meta'))
+    store = MetadataStore.load(str(tmp_path / 'meta'))
+    positions = np.array([3, 1, 1, 2, 0])
+
+    assert store.paths(positions) == [store.path(int(p)) for p in positions]
+    assert store.paths(positions) == [PATHS[p] for p in positions]
+    assert store.paths([]) == []
+
+def test_paths_include_images_appended_since_loading():
+    store = MetadataStore.from_paths(PATHS)
+    store.append('uploads/new.png')
+
+    assert store.paths([4, 0, 4, 1]) == ['uploads/new.png', 'uploads/a.png', 'uploads/new.png', 'uploads/été.jpg']
+    assert store.all_paths() == PATHS + ['uploads/new.png']
+
+def test_paths_span_several_chunks():
+    paths = [f"uploads/{i}.png" for i in range(50)]
+    store = MetadataStore.from_paths(paths)
+    positions = np.arange(50)[::-1]
+
+    assert store._decode(positions, chunk_size=7) == [paths[p] for p in positions]
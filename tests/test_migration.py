@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+
+from models.image_embedder import StubEmbedder
+from utils.migration import ModelMigration
+
+def populate(workspace, count):
+    paths = [workspace.image(f"img_{i}.png", i) for i in range(count)]
+    assert all(workspace.processor.process_image(path) for path in paths)
+    return paths
+
+def test_cut_over_keeps_positions_and_ids(workspace):
+    paths = populate(workspace, 5)
+    before = workspace.indexed_paths()
+    rows = {row['path']: row['id'] for row in workspace.db.get_all_images()}
+
+    summary = ModelMigration(workspace.processor).run('stub-v2', batch_size=2)
+
+    assert summary['model_name'] == 'stub-v2' and summary['unreadable'] == 0
+    assert workspace.index.model_name == 'stub-v2'
+    assert workspace.indexed_paths() == before
+    assert {row['path']: row['id'] for row in workspace.db.get_all_images()} == rows
+
+    new_model = StubEmbedder(model_name='stub-v2')
+    for position, rel_path in enumerate(before):
+        expected = new_model.embed_image(os.path.join(workspace.static_dir, rel_path))
+        np.testing.assert_allclose(workspace.index.image_embeddings[position], expected[0], rtol=1e-6)
+
+    # Another process loading the index sees the new model
+    fresh = workspace.open()
+    assert fresh.index.model_name == 'stub-v2'
+    assert fresh.indexed_paths() == before
+
+def test_unreadable_files_get_zero_vectors(workspace):
+    paths = populate(workspace, 4)
+    os.remove(paths[2])
+
+    summary = ModelMigration(workspace.processor).run('stub-v2')
+
+    assert summary['unreadable'] == 1
+    assert not workspace.index.image_embeddings[2].any()
+    assert all(workspace.index.image_embeddings[i].any() for i in (0, 1, 3))
+
+def test_cut_over_catches_up_images_added_after_the_last_pass(workspace):
+    populate(workspace, 3)
+    migration = ModelMigration(workspace.processor)
+    shadow = migration._open_shadow('stub-v2')
+    migration._embed(shadow, workspace.indexed_paths(), set())
+
+    # Added while no migration was registered, so not dual-embedded
+    late = workspace.image('late.png', 99)
+    assert workspace.processor.process_image(late)
+    summary = migration._cut_over(shadow, 'stub-v2', set())
+
+    assert summary['caught_up'] == 1 and summary['images'] == 4
+    expected = StubEmbedder(model_name='stub-v2').embed_image(late)
+    np.testing.assert_allclose(workspace.index.image_embeddings[3], expected[0], rtol=1e-6)
+    assert migration.read_state() is None and not os.path.exists(migration.shadow_dir)
+
+def test_resumes_from_checkpoint(workspace):
+    populate(workspace, 6)
+    migration = ModelMigration(workspace.processor)
+
+    class Stop(Exception):
+        pass
+
+    def stop_after_first_batch(done, total):
+        if done > 0:
+            raise Stop()
+
+    try:
+        migration.run('stub-v2', batch_size=2, progress=stop_after_first_batch)
+    except Stop:
+        pass
+    assert workspace.index.model_name == 'stub'
+    assert migration.status()['migration']['model_name'] == 'stub-v2'
+
+    embedded = []
+    summary = migration.run('stub-v2', batch_size=2, progress=lambda done, total: embedded.append(done))
+
+    assert summary['model_name'] == 'stub-v2'
+    assert embedded[0] == 2
+
+def cut_over_after_first_embed(workspace, monkeypatch):
+    """Make the processor's first embedding trigger a cut-over to stub-v2; returns the models used"""
+    import utils.image_processor
+
+    get_embedder = utils.image_processor.get_embedder
+    models = []
+
+    class Embedder:
+        def __init__(self, model_name):
+            self.model_name = model_name
+            self.embedder = get_embedder(model_name)
+
+        def embedded(self, result):
+            models.append(self.model_name)
+            if len(models) == 1:
+                ModelMigration(workspace.processor).run('stub-v2')
+            return result
+
+        def embed_image(self, path):
+            return self.embedded(self.embedder.embed_image(path))
+
+        def embed_images(self, paths, **options):
+            return self.embedded(self.embedder.embed_images(paths, **options))
+
+    monkeypatch.setattr(utils.image_processor, 'get_embedder', Embedder)
+    return models
+
+def test_image_embedded_before_a_cut_over_is_embedded_again(workspace, monkeypatch):
+    populate(workspace, 2)
+    models = cut_over_after_first_embed(workspace, monkeypatch)
+    path = workspace.image('during.png', 50)
+
+    assert workspace.processor.process_image(path)
+
+    assert models[1:] == ['stub-v2'] and models[0] != 'stub-v2'
+    expected = StubEmbedder(model_name='stub-v2').embed_image(path)
+    np.testing.assert_allclose(workspace.index.image_embeddings[2], expected[0], rtol=1e-6)
+
+def test_batch_embedded_before_a_cut_over_is_embedded_again(workspace, monkeypatch):
+    populate(workspace, 2)
+    models = cut_over_after_first_embed(workspace, monkeypatch)
+    paths = [workspace.image(f"during_{i}.png", 50 + i) for i in range(3)]
+
+    assert all(workspace.processor.process_images(paths))
+
+    assert models[1:] == ['stub-v2'] and models[0] != 'stub-v2'
+    expected = np.vstack(StubEmbedder(model_name='stub-v2').embed_images(paths))
+    np.testing.assert_allclose(workspace.index.image_embeddings[2:], expected, rtol=1e-6)
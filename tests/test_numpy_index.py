@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from models.index import ImageIndex
+from models.numpy_index import NumpyIndex
+
+faiss = pytest.importorskip('faiss')
+
+def unit_vectors(count, dimension=64, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+@pytest.fixture
+def indexes():
+    """The same vectors in a FAISS flat index and in a NumpyIndex scanned in several blocks"""
+    vectors = unit_vectors(1000)
+    reference = faiss.IndexFlatIP(64)
+    reference.add(vectors)
+    return reference, NumpyIndex(64, vectors.copy(), block_size=128)
+
+def assert_same_results(expected, actual, queries, vectors):
+    np.testing.assert_allclose(actual[0], expected[0], rtol=1e-5, atol=1e-6)
+    # Near-ties may come out in either order, but every position must
+    # really have the score of its rank
+    scores = np.take_along_axis(queries @ vectors.T, actual[1], axis=1)
+    np.testing.assert_allclose(scores, expected[0], rtol=1e-5, atol=1e-6)
+
+def test_search_matches_faiss(indexes):
+    reference, index = indexes
+    queries = unit_vectors(5, seed=1)
+
+    for k in (1, 10, 200):
+        assert_same_results(reference.search(queries, k), index.search(queries, k), queries, index.embeddings)
+
+def test_search_pads_like_faiss_when_k_exceeds_the_index():
+    reference = faiss.IndexFlatIP(64)
+    reference.add(unit_vectors(3))
+    index = NumpyIndex(64, unit_vectors(3))
+
+    scores, positions = index.search(unit_vectors(1, seed=1), 5)
+    expected_scores, expected_positions = reference.search(unit_vectors(1, seed=1), 5)
+
+    np.testing.assert_array_equal(positions, expected_positions)
+    np.testing.assert_allclose(scores[:, :3], expected_scores[:, :3], rtol=1e-5)
+
+def test_range_search_matches_faiss(indexes):
+    reference, index = indexes
+    queries = unit_vectors(3, seed=2)
+
+    expected_lims, expected_scores, expected_positions = reference.range_search(queries, 0.2)
+    lims, scores, positions = index.range_search(queries, 0.2)
+
+    np.testing.assert_array_equal(lims, expected_lims)
+    for q in range(len(queries)):
+        expected = dict(zip(expected_positions[expected_lims[q]:expected_lims[q + 1]].tolist(),
+                            expected_scores[expected_lims[q]:expected_lims[q + 1]].tolist()))
+        actual = dict(zip(positions[lims[q]:lims[q + 1]].tolist(), scores[lims[q]:lims[q + 1]].tolist()))
+        assert actual.keys() == expected.keys()
+        np.testing.assert_allclose([actual[p] for p in expected], list(expected.values()), rtol=1e-5)
+
+def test_removal_renumbers_like_faiss(indexes):
+    reference, index = indexes
+    removed = np.array([0, 5, 500, 999], dtype=np.int64)
+
+    assert index.remove_ids(removed) == reference.remove_ids(removed) == 4
+    np.testing.assert_array_equal(index.reconstruct_n(0, index.ntotal), reference.reconstruct_n(0, reference.ntotal))
+    queries = unit_vectors(2, seed=3)
+    assert_same_results(reference.search(queries, 10), index.search(queries, 10), queries, index.embeddings)
+
+@pytest.mark.parametrize('options', [{}, {'rerank': 'exact'}, {'threshold': 0.1}, {'paths': ['3.png', '7.png', '11.png']}])
+def test_image_index_returns_the_same_results_with_either_backend(tmp_path, options):
+    vectors = unit_vectors(50, dimension=512)
+    results = []
+    for backend in ('faiss', 'numpy'):
+        index = ImageIndex(index_dir=str(tmp_path / backend), backend=backend)
+        index.add_images([f"{i}.png" for i in range(50)], vectors, save=False)
+        results.append(index.search_by_vector(unit_vectors(1, dimension=512, seed=1), 5, **options))
+
+    assert [r['path'] for r in results[0]] == [r['path'] for r in results[1]]
+    np.testing.assert_allclose([r['score'] for r in results[0]], [r['score'] for r in results[1]], rtol=1e-5)
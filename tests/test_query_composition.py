@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from app import parse_query_terms
+from models.index import ImageIndex
+
+@pytest.fixture
+def index(tmp_path):
+    # e0, e1 and the direction halfway between them
+    vectors = np.eye(3, 512, dtype=np.float32)
+    vectors[2, :2] = np.sqrt(0.5)
+    vectors[2, 2] = 0
+    index = ImageIndex(index_dir=str(tmp_path / 'index'), backend='numpy')
+    index.add_images(['x.png', 'y.png', 'xy.png'], vectors, save=False)
+    return index
+
+def test_parses_prompts_ids_and_weighted_objects():
+    terms, error = parse_query_terms(['beach', 3, {'text': 'sunset', 'weight': 2}, {'imageId': 4, 'weight': 0.5}])
+
+    assert error is None
+    assert terms == [('text', 'beach', 1.0), ('image', 3, 1.0), ('text', 'sunset', 2.0), ('image', 4, 0.5)]
+    assert parse_query_terms('night') == ([('text', 'night', 1.0)], None)
+
+@pytest.mark.parametrize('items, error', [([True], 'each term'), ([{'text': 'a', 'weight': 'high'}], 'weight must be a number'),
+                                          (['  '], 'each term')])
+def test_rejects_malformed_terms(items, error):
+    terms, message = parse_query_terms(items)
+
+    assert terms is None and message.startswith(error)
+
+def test_negative_terms_are_subtracted_with_their_weights(index):
+    vector = index.compose_query([('image', 2, 1.0)], [('image', 1, 0.5)])
+
+    expected = index.image_embeddings[2] - 0.5 * index.image_embeddings[1]
+    np.testing.assert_allclose(vector[0], expected / np.linalg.norm(expected), rtol=1e-5, atol=1e-7)
+
+def test_text_and_image_terms_are_combined(index):
+    vector = index.compose_query([('text', 'beach', 2.0), ('image', 0, 1.0)])
+
+    expected = 2 * index.embedder.embed_text('beach')[0] + index.image_embeddings[0]
+    np.testing.assert_allclose(vector[0], expected / np.linalg.norm(expected), rtol=1e-5, atol=1e-7)
+
+def test_negative_image_pushes_similar_images_down(index):
+    positive = [result['path'] for result in index.search_composed([('image', 2, 1.0)], k=3)]
+    composed = [result['path'] for result in index.search_composed([('image', 2, 1.0)], [('image', 1, 1.0)], k=3)]
+
+    assert positive[0] == 'xy.png'
+    assert composed.index('x.png') < composed.index('y.png')
+    assert composed[-1] == 'y.png'
+
+def test_unknown_image_or_empty_query_gives_no_vector(index):
+    assert index.compose_query([('image', 99, 1.0)]) is None
+    assert index.compose_query([]) is None
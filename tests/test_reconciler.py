@@ -0,0 +1,134 @@
+import os
+import sys
+import threading
+import subprocess
+
+import numpy as np
+
+from tests.conftest import REPO_ROOT
+from utils.reconciler import Reconciler
+
+def test_embeds_files_missing_from_index_and_database(workspace):
+    workspace.image('a.png', 1)
+    workspace.image('b.png', 2)
+
+    summary = Reconciler(workspace.processor).reconcile()
+
+    assert summary['embedded'] == 2
+    assert sorted(workspace.indexed_paths()) == ['uploads/a.png', 'uploads/b.png']
+    assert sorted(workspace.row_paths()) == ['uploads/a.png', 'uploads/b.png']
+
+def test_embeds_new_files_in_batches(workspace, monkeypatch):
+    import utils.image_processor
+
+    embedder = utils.image_processor.get_embedder(workspace.index.model_name)
+    embed_images = embedder.embed_images
+    batches = []
+    monkeypatch.setattr(embedder, 'embed_images', lambda paths, **options: batches.append(len(paths)) or
+                        embed_images(paths, **options))
+    for i in range(5):
+        workspace.image(f"{i}.png", i)
+
+    summary = Reconciler(workspace.processor).reconcile(batch_size=2)
+
+    assert summary['embedded'] == 5 and batches == [2, 2, 1]
+    assert len(workspace.indexed_paths()) == 5
+
+def test_dry_run_changes_nothing(workspace):
+    workspace.image('a.png', 1)
+
+    summary = Reconciler(workspace.processor).reconcile(dry_run=True)
+
+    assert summary['missing_from_index'] == 1
+    assert workspace.indexed_paths() == []
+    assert workspace.row_paths() == []
+
+def test_drops_entries_and_rows_of_deleted_files(workspace):
+    workspace.image('a.png', 1)
+    path = workspace.image('b.png', 2)
+    Reconciler(workspace.processor).reconcile()
+
+    os.remove(path)
+    summary = Reconciler(workspace.processor).reconcile()
+
+    assert summary['index_removed'] == 1 and summary['db_removed'] == 1
+    assert workspace.indexed_paths() == ['uploads/a.png']
+    assert workspace.row_paths() == ['uploads/a.png']
+
+def test_moved_file_keeps_its_embedding_and_row(workspace):
+    path = workspace.image('a.png', 1)
+    reconciler = Reconciler(workspace.processor)
+    reconciler.reconcile()
+    row_id = workspace.db.get_all_images()[0]['id']
+    embedding = np.array(workspace.index.image_embeddings[0])
+
+    os.rename(path, os.path.join(workspace.upload_dir, 'renamed.png'))
+    summary = reconciler.reconcile()
+
+    assert summary['moved'] == 1 and summary['embedded'] == 0
+    assert workspace.indexed_paths() == ['uploads/renamed.png']
+    rows = workspace.db.get_all_images()
+    assert [(row['id'], row['path']) for row in rows] == [(row_id, 'uploads/renamed.png')]
+    np.testing.assert_array_equal(workspace.index.image_embeddings[0], embedding)
+
+def test_removes_duplicate_rows_and_entries(workspace):
+    workspace.image('a.png', 1)
+    reconciler = Reconciler(workspace.processor)
+    reconciler.reconcile()
+    workspace.db.add_image('uploads/a.png')
+    workspace.index.add_images(['uploads/a.png'], workspace.index.image_embeddings[:1])
+
+    summary = reconciler.reconcile()
+
+    assert summary['duplicate_db_rows'] == 1 and summary['duplicate_index_entries'] == 1
+    assert workspace.indexed_paths() == ['uploads/a.png']
+    assert workspace.row_paths() == ['uploads/a.png']
+
+def test_keeps_images_saved_by_another_process_meanwhile(workspace):
+    """Uploads finishing in another process between plan and commit are neither lost nor duplicated"""
+    for i in range(3):
+        workspace.image(f"existing_{i}.png", i)
+    # racing.png is in the plan; new.png only appears after it was made
+    racing = workspace.image('racing.png', 10)
+    new = os.path.join(workspace.upload_dir, 'new.png')
+
+    script = (
+        "import sys\n"
+        f"sys.path.insert(0, {REPO_ROOT!r})\n"
+        "from tests.conftest import Workspace\n"
+        "workspace = Workspace(sys.argv[1])\n"
+        "for path in sys.argv[2:]:\n"
+        "    assert workspace.processor.process_image(path)\n"
+    )
+
+    def progress(done, total):
+        # Called after the plan is made and before anything is committed
+        if done == total:
+            workspace.image('new.png', 11)
+            subprocess.run([sys.executable, '-c', script, workspace.root, racing, new],
+                           check=True, env=dict(os.environ, IMAGE_EMBEDDER='stub'))
+
+    Reconciler(workspace.processor).reconcile(progress=progress)
+
+    fresh = workspace.open()
+    expected = sorted([f"uploads/existing_{i}.png" for i in range(3)] + ['uploads/racing.png', 'uploads/new.png'])
+    assert sorted(fresh.indexed_paths()) == expected
+    assert sorted(fresh.row_paths()) == expected
+
+def test_leaves_files_of_unfinished_upload_jobs_alone(workspace):
+    from utils.jobs import job_queue
+
+    workspace.image('a.png', 1)
+    pending = workspace.image('pending.png', 2)
+    # Queued or running, the job stays unfinished until the reconcile is done
+    done = threading.Event()
+    job_queue.register('upload', lambda job, file_path: done.wait(10), lane='interactive')
+    job = job_queue.submit('upload', file_path=pending)
+    try:
+        Reconciler(workspace.processor).reconcile()
+    finally:
+        done.set()
+        job_queue.cancel(job['id'])
+
+    assert workspace.indexed_paths() == ['uploads/a.png']
+    assert workspace.row_paths() == ['uploads/a.png']
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from models.search_bundle import SearchBundle, export_bundle
+
+@pytest.fixture
+def bundle(workspace, tmp_path):
+    for seed in range(5):
+        workspace.processor.process_upload(workspace.image(f"{seed}.png", seed))
+    export_bundle(str(tmp_path / 'bundle'), workspace.index, workspace.db, workspace.index.embedder)
+    return SearchBundle(str(tmp_path / 'bundle'))
+
+@pytest.fixture
+def client(bundle, monkeypatch):
+    import serverless
+
+    monkeypatch.setattr(serverless, '_bundle', bundle)
+    monkeypatch.setattr(serverless, '_load_seconds', 0.0)
+    return serverless.app.test_client()
+
+@pytest.mark.parametrize('limit', [0, -5, '5', True, 2.5])
+def test_serverless_rejects_bad_limit(client, limit):
+    response = client.post('/api/search', json={'query': 'beach', 'limit': limit})
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'limit must be a positive integer'}
+
+@pytest.mark.parametrize('weight_text', [-0.1, 1.5, '0.5', None, False])
+def test_serverless_rejects_bad_weight_text(client, weight_text):
+    response = client.post('/api/search', json={'query': 'beach', 'imageId': 0, 'weightText': weight_text})
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'weightText must be a number between 0 and 1'}
+
+def test_serverless_caps_huge_limit(client):
+    response = client.post('/api/search', json={'query': 'beach', 'limit': 10 ** 12})
+
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == 5
+
+def test_bundle_round_trip_matches_the_full_index(workspace, bundle):
+    query = 'beach'
+    expected = workspace.index.search(query, k=5)
+
+    results = bundle.search(query, k=5, fields=('db_id', 'tags', 'description'))
+
+    # int8 codes keep the ranking and scores of the float32 index
+    assert [r['path'] for r in results] == [r['path'] for r in expected]
+    np.testing.assert_allclose([r['score'] for r in results], [r['score'] for r in expected], atol=0.02)
+    rows = {row['path']: row for row in workspace.db.get_all_images()}
+    for result in results:
+        row = rows[result['path']]
+        assert (result['db_id'], result['tags'], result['description']) == (row['id'], row['tags'], row.get('description'))
+
+def test_bundle_lists_images_and_manifest(workspace, bundle):
+    rows = {row['path']: row for row in workspace.db.get_all_images()}
+
+    images = bundle.images()
+
+    assert sorted(image['path'] for image in images) == sorted(rows)
+    assert all(image['id'] == rows[image['path']]['id'] for image in images)
+    assert bundle.manifest['images'] == len(bundle) == 5
+    assert bundle.manifest['model_name'] == workspace.index.model_name
+
+def test_bundle_queries_outside_its_table(bundle):
+    # Unknown queries are approximated from known words, or not answered
+    assert bundle.search('beach xyzzy', k=3)
+    assert bundle.search('xyzzy plugh', k=3) is None
+    # Image-only searches need no query table
+    assert [r['id'] for r in bundle.search(image_id=1, k=1)] == [1]
@@ -0,0 +1,59 @@
+import io
+import os
+import uuid
+
+import pytest
+
+from tests.conftest import write_image
+from utils.metrics import CACHE_REQUESTS
+
+@pytest.fixture
+def collection():
+    from utils.collection_manager import collection_manager
+
+    collection = collection_manager.create(f"probe-{uuid.uuid4().hex[:8]}")
+    for seed in range(4):
+        collection.processor.process_upload(write_image(os.path.join(collection.processor.upload_dir, f"{seed}.png"), seed))
+    return collection
+
+def files_under(directory):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(directory) for name in names)
+
+def search_by_image(collection, image_bytes, **form):
+    from app import app
+
+    return app.test_client().post('/api/search/by-image', headers={'X-Collection': collection.name},
+                                  data={'image': (io.BytesIO(image_bytes), 'probe.png'), **form},
+                                  content_type='multipart/form-data')
+
+def test_finds_the_matching_image_without_storing_the_upload(collection, tmp_path):
+    with open(write_image(str(tmp_path / 'probe.png'), 2), 'rb') as f:
+        image_bytes = f.read()
+    stored = files_under(collection.processor.path_root)
+    rows = collection.db.get_all_images()
+    size = len(collection.index.image_metadata)
+
+    response = search_by_image(collection, image_bytes, limit='2')
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert len(results) == 2 and results[0]['path'].endswith('/2.png')
+    assert files_under(collection.processor.path_root) == stored
+    assert collection.db.get_all_images() == rows
+    assert len(collection.index.image_metadata) == size
+
+def test_repeated_probe_reuses_its_embedding(collection, tmp_path):
+    with open(write_image(str(tmp_path / 'probe.png'), 9), 'rb') as f:
+        image_bytes = f.read()
+    hits = CACHE_REQUESTS.get(cache='probe_embedding', result='hit')
+
+    assert search_by_image(collection, image_bytes).status_code == 200
+    assert search_by_image(collection, image_bytes).status_code == 200
+
+    assert CACHE_REQUESTS.get(cache='probe_embedding', result='hit') == hits + 1
+
+@pytest.mark.parametrize('form, error', [({}, 'Could not read image'), ({'limit': 'many'}, 'limit must be an integer')])
+def test_rejects_bad_uploads(collection, form, error):
+    response = search_by_image(collection, b'not an image', **form)
+
+    assert response.status_code == 400 and response.get_json() == {'error': error}
@@ -0,0 +1,51 @@
+import pytest
+
+from app import parse_search_request
+
+@pytest.mark.parametrize('image_id', ['3', True, 3.0, [3]])
+def test_rejects_non_integer_image_id(image_id):
+    params, error = parse_search_request({'imageId': image_id})
+
+    assert params is None and error == 'imageId must be an integer'
+
+def test_accepts_integer_image_id():
+    params, error = parse_search_request({'imageId': 3})
+
+    assert error is None and params['image_id'] == 3
+
+def test_serverless_rejects_non_integer_image_id():
+    import serverless
+
+    response = serverless.app.test_client().post('/api/search', json={'imageId': '3'})
+
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'imageId must be an integer'}
+
+@pytest.mark.parametrize('limit', [0, -5, '20', True, 2.5])
+def test_rejects_bad_limit(limit):
+    params, error = parse_search_request({'query': 'beach', 'limit': limit})
+
+    assert params is None and error == 'limit must be a positive integer'
+
+@pytest.mark.parametrize('weight_text', [-0.1, 1.5, '0.5', None, False])
+def test_rejects_bad_weight_text(weight_text):
+    params, error = parse_search_request({'query': 'beach', 'weightText': weight_text})
+
+    assert params is None and error == 'weightText must be a number between 0 and 1'
+
+def test_accepts_defaults_and_bounds():
+    params, error = parse_search_request({'query': 'beach', 'limit': 1, 'weightText': 0})
+
+    assert error is None and params['limit'] == 1 and params['weight_text'] == 0
+
+@pytest.mark.parametrize('diversity', [-1, 2, 'high', True])
+def test_rejects_bad_diversity(diversity):
+    params, error = parse_search_request({'query': 'beach', 'rerank': 'mmr', 'diversity': diversity})
+
+    assert params is None and error == 'diversity must be a number between 0 and 1'
+
+@pytest.mark.parametrize('max_results', [0, '5', True, 2.5])
+def test_rejects_bad_max_results(max_results):
+    params, error = parse_search_request({'query': 'beach', 'threshold': 0.2, 'maxResults': max_results})
+
+    assert params is None and error == 'maxResults must be a positive integer'
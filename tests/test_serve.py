@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+import run
+from models.index import ImageIndex
+
+@pytest.fixture
+def started(monkeypatch):
+    """Run serve_production without starting gunicorn; returns the servers it would have run"""
+    servers = []
+    monkeypatch.setattr(run.ProductionServer, 'run', lambda self: servers.append(self))
+    monkeypatch.setattr(run, 'configure_worker_threads', lambda threads: None)
+    # serve_production sets these for the workers; restore them afterwards
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'SEARCH_THREADS'):
+        monkeypatch.setenv(var, '')
+    return servers
+
+@pytest.mark.skipif(not run.GUNICORN_AVAILABLE, reason='gunicorn not installed')
+def test_serve_preloads_the_app_in_the_requested_workers(started):
+    assert run.serve_production('127.0.0.1', 5001, workers=3, threads=2)
+
+    server = started[0]
+    assert server.cfg.workers == 3 and server.cfg.preload_app
+    assert server.cfg.bind == ['127.0.0.1:5001']
+    assert os.environ['OMP_NUM_THREADS'] == os.environ['SEARCH_THREADS'] == '2'
+    assert not server.use_asgi and server.cfg.worker_class_str == 'sync'
+
+@pytest.mark.skipif(not run.GUNICORN_AVAILABLE, reason='gunicorn not installed')
+def test_serve_asgi_uses_uvicorn_workers(started):
+    assert run.serve_production('127.0.0.1', 5001, workers=1, threads=1, use_asgi=True)
+
+    assert started[0].use_asgi
+    assert started[0].cfg.worker_class_str == 'uvicorn.workers.UvicornWorker'
+
+def test_worker_picks_up_a_snapshot_saved_by_another_worker(tmp_path):
+    # Two workers' views of the same index directory
+    first = ImageIndex(index_dir=str(tmp_path / 'index'), backend='numpy')
+    second = ImageIndex(index_dir=str(tmp_path / 'index'), backend='numpy')
+
+    first.add_images(['a.png', 'b.png'], np.eye(2, 512, dtype=np.float32))
+
+    assert second.reload_if_changed()
+    assert list(second.image_metadata.all_paths()) == ['a.png', 'b.png']
+    assert not second.reload_if_changed()
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.query_log import QueryLog
+from utils.warmup import Warmer
+
+@pytest.fixture
+def log(tmp_path):
+    log = QueryLog(str(tmp_path / 'query_log.jsonl'))
+    for query, image_id, weight_text, times in (('beach', None, None, 3), ('dog', None, None, 1),
+                                                 ('sunset', 4, 0.5, 2), ('', 7, None, 1)):
+        for _ in range(times):
+            log.record(query, image_id, weight_text, seconds=0.01)
+    log.record('mountain', collection='travel')
+    return log
+
+class RecordingIndex:
+    def __init__(self):
+        self.generation = 1
+        self.searches = []
+        self.embedded = []
+        self.embedder = SimpleNamespace(embed_texts=lambda texts, cache: self.embedded.append(texts))
+
+    def search(self, query, k, image_id, weight_text):
+        self.searches.append((query, image_id, weight_text))
+
+def manager_with(*names):
+    collections = [SimpleNamespace(name=name, index=RecordingIndex()) for name in names]
+    return SimpleNamespace(loaded=lambda: collections), collections
+
+def test_top_queries_are_ranked_by_frequency_per_collection(log):
+    assert log.top_queries(3) == [('beach', None, None), ('sunset', 4, 0.5), ('dog', None, None)]
+    assert log.top_queries(collection='travel') == [('mountain', None, None)]
+
+def test_rotated_files_are_still_read(tmp_path):
+    log = QueryLog(str(tmp_path / 'query_log.jsonl'), max_bytes=200, backups=2)
+    for i in range(8):
+        log.record(f"query {i}")
+
+    assert (tmp_path / 'query_log.jsonl.1').exists()
+    assert [entry['q'] for entry in log.entries()][-1] == 'query 7'
+
+def test_warm_up_replays_the_top_queries(log):
+    manager, (default,) = manager_with('default')
+    warmer = Warmer(manager, log, num_queries=3)
+
+    summary = warmer.warm_up(default)
+
+    assert summary['queries'] == 3 and summary['generation'] == 1
+    # Texts are embedded in one batch before the searches run
+    assert default.index.embedded == [['beach', 'sunset', 'dog']]
+    assert default.index.searches == [('beach', None, 0.7), ('sunset', 4, 0.5), ('dog', None, 0.7)]
+
+def test_collections_are_warmed_again_when_their_generation_changes(log):
+    manager, (default, travel) = manager_with('default', 'travel')
+    warmer = Warmer(manager, log, num_queries=10, min_interval=0)
+
+    warmer.check()
+    warmer.check()
+    assert len(default.index.searches) == 4 and travel.index.searches == [('mountain', None, 0.7)]
+
+    travel.index.generation = 2
+    warmer.check()
+    assert len(default.index.searches) == 4 and len(travel.index.searches) == 2
+
+def test_rewarming_waits_for_min_interval(log):
+    manager, (default,) = manager_with('default')
+    warmer = Warmer(manager, log, num_queries=10, min_interval=60)
+
+    warmer.check()
+    default.index.generation = 2
+    warmer.check()
+
+    assert len(default.index.searches) == 4
+
+def test_startup_warm_up_sets_ready(log):
+    manager, (default,) = manager_with('default')
+    warmer = Warmer(manager, log, num_queries=10, interval=0.05)
+    assert not warmer.ready
+
+    warmer.start()
+    try:
+        assert warmer._ready.wait(10)
+    finally:
+        warmer.stop()
+
+    assert default.index.searches
@@ -0,0 +1,88 @@
+import os
+import time
+import shutil
+
+from utils.reconciler import Reconciler
+from utils.watcher import UploadWatcher
+
+class ScriptedSource:
+    def __init__(self, events, every=0.0):
+        """Returns the scripted (paths, rescan) events one read at a time, then nothing"""
+        self.events = list(events)
+        self.every = every
+
+    def read(self, timeout):
+        if self.events:
+            time.sleep(self.every)
+            return self.events.pop(0)
+        time.sleep(timeout)
+        return set(), False
+
+    def close(self):
+        pass
+
+class RecordingReconciler:
+    def __init__(self, upload_dir, calls):
+        self.upload_dir = upload_dir
+        self.processor = self
+        self.calls = calls
+
+    def relative_path(self, path):
+        return os.path.relpath(path, os.path.dirname(self.upload_dir))
+
+    def reconcile(self, paths=None):
+        self.calls.append(None if paths is None else sorted(paths))
+        return {}
+
+def watch(tmp_path, source, until, **options):
+    """Run a watcher on `source` until `until(calls)` holds; returns the reconcile calls"""
+    calls = []
+    watcher = UploadWatcher(RecordingReconciler(str(tmp_path / 'uploads'), calls), **options)
+    watcher._open_source = lambda: source
+    watcher.start()
+    deadline = time.time() + 10
+    while not until(calls) and time.time() < deadline:
+        time.sleep(0.01)
+    watcher.stop()
+    return calls
+
+def test_events_are_debounced_into_one_scoped_reconcile(tmp_path):
+    uploads = tmp_path / 'uploads'
+    source = ScriptedSource([({str(uploads / 'a.png')}, False), ({str(uploads / 'b.png')}, False),
+                             ({str(uploads / 'a.png')}, False)])
+
+    calls = watch(tmp_path, source, lambda calls: calls, debounce=0.1)
+
+    assert calls == [['uploads/a.png', 'uploads/b.png']]
+
+def test_lost_events_recheck_the_whole_directory(tmp_path):
+    source = ScriptedSource([({str(tmp_path / 'uploads' / 'a.png')}, False), (set(), True)])
+
+    calls = watch(tmp_path, source, lambda calls: calls, debounce=0.1)
+
+    assert calls == [None]
+
+def test_steady_events_are_flushed_after_max_delay(tmp_path):
+    # A new file every 20 ms never leaves the directory quiet for the debounce
+    source = ScriptedSource([({str(tmp_path / 'uploads' / f"{i}.png")}, False) for i in range(100)], every=0.02)
+
+    calls = watch(tmp_path, source, lambda calls: calls, debounce=1.0, max_delay=0.2)
+
+    assert calls and 0 < len(calls[0]) < 100
+
+def test_copied_in_file_is_indexed(workspace):
+    watcher = UploadWatcher(Reconciler(workspace.processor), debounce=0.1, poll_interval=0.1)
+    watcher.start()
+    try:
+        while watcher.source is None:
+            time.sleep(0.01)
+        # Written outside and moved in, as rsync and most copy tools do
+        shutil.move(workspace.image(os.path.join('..', 'outside.png'), 1), os.path.join(workspace.upload_dir, 'a.png'))
+        deadline = time.time() + 10
+        while workspace.indexed_paths() != ['uploads/a.png'] and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+
+    assert workspace.indexed_paths() == ['uploads/a.png']
+    assert workspace.row_paths() == ['uploads/a.png']
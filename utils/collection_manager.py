@@ -0,0 +1,191 @@
+import os
+import re
+import time
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict
+from pathlib import Path
+from models.index import ImageIndex, image_index
+from database.db import ImageDatabase, db
+from utils.image_processor import ImageProcessor, image_processor
+from utils.reconciler import Reconciler, reconciler
+from utils.migration import ModelMigration, model_migration
+from utils.metrics import COLLECTION_EVENTS
+
+DEFAULT_COLLECTION = 'default'
+COLLECTION_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+# Rough per-image cost of a database row held in memory
+DB_ROW_BYTES = 1024
+
+class CollectionNotFound(KeyError):
+    """Raised when a request names a collection that does not exist"""
+
+class Collection:
+    def __init__(self, name, index, database, processor, reconciler, migration):
+        """One catalogue: its index, database, upload directory, reconciler and model migration"""
+        self.name = name
+        self.index = index
+        self.db = database
+        self.processor = processor
+        self.reconciler = reconciler
+        self.migration = migration
+        self.last_used = time.monotonic()
+        # Requests and jobs currently using the collection; never evicted while > 0
+        self.users = 0
+
+    @classmethod
+    def open(cls, name, root, static_dir):
+        """Load a named collection stored under root/<name>, with uploads in static_dir/collections/<name>"""
+        index = ImageIndex(index_dir=os.path.join(root, name, 'index'))
+        database = ImageDatabase(db_path=os.path.join(root, name, 'database', 'images.json'))
+        processor = ImageProcessor(upload_dir=os.path.join(static_dir, 'collections', name),
+                                   index=index, database=database, path_root=static_dir)
+        return cls(name, index, database, processor, Reconciler(processor), ModelMigration(processor))
+
+    def resident_bytes(self):
+        """Approximate memory held by the collection"""
+        return self.index.resident_bytes() + len(self.db.get_all_images()) * DB_ROW_BYTES
+
+    def has_unsaved_changes(self):
+        return self.index._dirty or self.db._dirty or self.index.shadow is not None
+
+    def info(self):
+        return {
+            'name': self.name,
+            'loaded': True,
+            'images': len(self.db.get_all_images()),
+            'index_size': len(self.index.image_metadata),
+            'model_name': self.index.model_name,
+            'memory_bytes': self.resident_bytes(),
+            'in_use': self.users
+        }
+
+class CollectionManager:
+    def __init__(self, root="collections", static_dir="static", memory_budget=None):
+        """Named collections, each with its own index directory, database and uploads.
+
+        The default collection is the global index and database. Others live
+        under root/<name> and are loaded on first use. Loaded collections
+        are kept while their estimated memory fits `memory_budget` bytes
+        (COLLECTIONS_MEMORY_MB, default 1024); beyond that the least recently
+        used idle collections are closed. Embeddings and metadata are
+        memory-mapped, so reopening one is cheap.
+        """
+        self.root = root
+        self.static_dir = static_dir
+        if memory_budget is None:
+            memory_budget = int(os.environ.get('COLLECTIONS_MEMORY_MB', 1024)) * 1024 * 1024
+        self.memory_budget = memory_budget
+        self.default = Collection(DEFAULT_COLLECTION, image_index, db, image_processor, reconciler, model_migration)
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._current = contextvars.ContextVar('collection', default=None)
+
+    def names(self):
+        """Every collection, the default first"""
+        names = []
+        if os.path.isdir(self.root):
+            names = sorted(name for name in os.listdir(self.root)
+                           if COLLECTION_NAME.match(name) and os.path.isdir(os.path.join(self.root, name)))
+        return [DEFAULT_COLLECTION] + [name for name in names if name != DEFAULT_COLLECTION]
+
+    def exists(self, name):
+        return name == DEFAULT_COLLECTION or (
+            bool(COLLECTION_NAME.match(name or '')) and os.path.isdir(os.path.join(self.root, name)))
+
+    def create(self, name):
+        """Create an empty collection; raises ValueError for invalid or taken names"""
+        if not COLLECTION_NAME.match(name or ''):
+            raise ValueError('Collection names may contain letters, digits, "-" and "_" (at most 64)')
+        if self.exists(name):
+            raise ValueError(f"Collection already exists: {name}")
+        Path(os.path.join(self.root, name)).mkdir(parents=True)
+        return self.get(name)
+
+    def get(self, name=None):
+        """The named collection, loading it if needed"""
+        return self._get(name)
+
+    def _get(self, name, acquire=False):
+        """get(); with `acquire`, also count a user of the collection.
+
+        The user is counted in the same locked section that finds or loads
+        the collection, so an eviction from another thread can't close it
+        in between.
+        """
+        if not name or name == DEFAULT_COLLECTION:
+            with self._lock:
+                self.default.last_used = time.monotonic()
+                if acquire:
+                    self.default.users += 1
+            return self.default
+        if not self.exists(name):
+            raise CollectionNotFound(name)
+
+        with self._lock:
+            collection = self._loaded.get(name)
+            if collection is not None:
+                self._loaded.move_to_end(name)
+                collection.last_used = time.monotonic()
+                if acquire:
+                    collection.users += 1
+                return collection
+
+            print(f"Loading collection '{name}'")
+            collection = Collection.open(name, self.root, self.static_dir)
+            COLLECTION_EVENTS.inc(event='load')
+            if acquire:
+                collection.users += 1
+            self._loaded[name] = collection
+            self._evict(keep=name)
+            return collection
+
+    @contextlib.contextmanager
+    def use(self, name=None):
+        """Make a collection current for this thread (or task) while the block runs"""
+        collection = self._get(name, acquire=True)
+        token = self._current.set(collection)
+        try:
+            yield collection
+        finally:
+            self._current.reset(token)
+            with self._lock:
+                collection.users -= 1
+                collection.last_used = time.monotonic()
+
+    def current(self):
+        """The collection selected for the running request or job, or the default one"""
+        return self._current.get() or self.default
+
+    def loaded(self):
+        """Every loaded collection, the default first"""
+        with self._lock:
+            return [self.default] + list(self._loaded.values())
+
+    def resident_bytes(self):
+        return sum(collection.resident_bytes() for collection in self.loaded())
+
+    def reload_if_changed(self):
+        """Pick up snapshots saved by other processes for every loaded collection"""
+        for collection in self.loaded():
+            collection.index.reload_if_changed()
+            collection.db.reload_if_changed()
+
+    def _evict(self, keep=None):
+        """Close least recently used idle collections until the rest fit the budget"""
+        total = self.default.resident_bytes() + sum(c.resident_bytes() for c in self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.memory_budget:
+                break
+            collection = self._loaded[name]
+            if name == keep or collection.users > 0 or collection.has_unsaved_changes():
+                continue
+            total -= collection.resident_bytes()
+            del self._loaded[name]
+            COLLECTION_EVENTS.inc(event='evict')
+            print(f"Closed idle collection '{name}' to stay within the memory budget")
+
+# Create singleton instance
+collection_manager = CollectionManager()
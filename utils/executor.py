@@ -0,0 +1,51 @@
+import os
+import asyncio
+import threading
+import concurrent.futures
+
+class ExecutorBusy(Exception):
+    """Raised when the executor's queue is full"""
+
+class BoundedExecutor:
+    def __init__(self, max_workers=None, max_pending=None):
+        """Thread pool for CPU-bound work (CLIP embedding, FAISS search).
+
+        At most `max_workers` tasks run at once and at most `max_pending`
+        more may wait; beyond that submit() raises ExecutorBusy instead of
+        letting requests pile up. Torch and FAISS release the GIL, so
+        threads give real parallelism here.
+        """
+        if max_workers is None:
+            max_workers = int(os.environ.get('CPU_WORKERS', min(4, os.cpu_count() or 1)))
+        if max_pending is None:
+            max_pending = int(os.environ.get('CPU_MAX_PENDING', 32))
+
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='cpu-worker'
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit a task, raising ExecutorBusy if the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusy()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a task from async code without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+# Create singleton instance
+cpu_executor = BoundedExecutor()
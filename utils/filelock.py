@@ -0,0 +1,54 @@
+import os
+import threading
+
+# fcntl is only available on Unix; elsewhere locks are per-process only
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+class FileLock:
+    def __init__(self, path):
+        """Exclusive lock shared between processes through a lock file.
+
+        Re-entrant within a thread, so methods holding the lock can call
+        each other. Several processes (e.g. production server workers) use
+        it to serialise writes to the index, database and job files.
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """Acquire the lock, returning False if non-blocking and held elsewhere"""
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        if self._depth == 0 and FCNTL_AVAILABLE:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(fd, flags)
+            except OSError:
+                os.close(fd)
+                self._lock.release()
+                return False
+            self._fd = fd
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -1,21 +1,46 @@
 import os
 import sys
 import time
+import hashlib
 import concurrent.futures
+import numpy as np
 from PIL import Image
 from pathlib import Path
-from models.image_embedder import embedder
 from models.index import image_index
+from models.image_embedder import get_embedder
+from models.labels import label_vocabulary
 from database.db import db
+from utils.metrics import INGEST_SECONDS
+
+def file_fingerprint(file_path, chunk_size=1 << 20):
+    """Size, modification time and SHA-256 of a file, used to detect changed and moved files"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
 
 class ImageProcessor:
-    def __init__(self, upload_dir="static/uploads"):
-        """Initialize image processor with upload directory"""
+    def __init__(self, upload_dir="static/uploads", index=None, database=None, path_root=None):
+        """Initialize image processor with upload directory.
+
+        Images go into `index` and `database` (the global ones by default)
+        under paths relative to `path_root` (the parent of upload_dir by
+        default, so uploads are stored as "uploads/<file>").
+        """
         self.upload_dir = upload_dir
+        self.index = index if index is not None else image_index
+        self.db = database if database is not None else db
+        self.path_root = path_root if path_root is not None else os.path.dirname(upload_dir)
         Path(upload_dir).mkdir(parents=True, exist_ok=True)
         
-    def process_image(self, file_path, save_metadata=True):
-        """Process a single image: resize, validate, embed and index"""
+    def process_image(self, file_path, save_metadata=True, save=True):
+        """Process a single image: resize, validate, embed and index.
+
+        With save=False the index and database are updated in memory only;
+        the caller is responsible for persisting them.
+        """
         try:
             # Check if file exists
             if not os.path.exists(file_path):
@@ -23,39 +48,46 @@ class ImageProcessor:
                 return None
                 
             # Open and validate image
-            try:
-                img = Image.open(file_path).convert("RGB")
-                
-                # Resize if too large (preserve aspect ratio)
-                max_size = 1920
-                if img.width > max_size or img.height > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                    img.save(file_path)
-            except Exception as e:
-                print(f"Error processing image {file_path}: {e}")
+            info = self._decode(file_path)
+            if info is None:
                 return None
                 
             # Generate relative path for storage
-            rel_path = os.path.relpath(file_path, start=os.path.dirname(self.upload_dir))
+            rel_path = self.relative_path(file_path)
             
-            # Generate embedding and add to index
-            embedding = embedder.embed_image(file_path)
+            # Generate embedding and add to index; if a model migration cuts
+            # over in between, the index refuses it and it is embedded again
+            model_name = None
+            while model_name != self.index.model_name:
+                model_name = self.index.model_name
+                with INGEST_SECONDS.time(stage='embed'):
+                    embedding = get_embedder(model_name).embed_image(file_path)
+                if embedding is None:
+                    break
+                success = self.index.add_image(rel_path, embedding, save=save, model_name=model_name)
+                if success:
+                    break
             if embedding is not None:
-                # Add to index
-                success = image_index.add_image(rel_path, embedding)
+                # Embed it with the new model too while a model migration runs
+                shadow = self.index.shadow
+                if success and shadow is not None:
+                    with INGEST_SECONDS.time(stage='embed_shadow'):
+                        shadow_embedding = shadow.embedder.embed_image(file_path)
+                    if shadow_embedding is not None:
+                        shadow.add_image(rel_path, shadow_embedding, save=False)
                 
                 # Save metadata to database
                 if success and save_metadata:
-                    db.add_image(rel_path, {
-                        'width': img.width,
-                        'height': img.height,
-                        'format': img.format
-                    })
+                    # Zero-shot tag against the label vocabulary
+                    with INGEST_SECONDS.time(stage='tag'):
+                        tags = label_vocabulary.for_model(model_name).tag(embedding)[0]
+                    with INGEST_SECONDS.time(stage='db_add'):
+                        self.db.add_image(rel_path, {**info, **file_fingerprint(file_path)}, save=save, tags=tags)
                     
                 return {
                     'path': rel_path,
-                    'width': img.width,
-                    'height': img.height,
+                    'width': info['width'],
+                    'height': info['height'],
                     'success': True
                 }
         except Exception as e:
@@ -63,8 +95,103 @@ class ImageProcessor:
             
         return None
         
-    def batch_process_directory(self, directory, max_workers=8):
-        """Process all images in a directory using multi-threading"""
+    def _decode(self, file_path):
+        """Open, validate and if needed shrink an image; returns its info, or None if unreadable"""
+        try:
+            with INGEST_SECONDS.time(stage='decode'):
+                with Image.open(file_path) as img:
+                    img_format = img.format
+                    img = img.convert("RGB")
+                
+                # Resize if too large (preserve aspect ratio)
+                max_size = 1920
+                if img.width > max_size or img.height > max_size:
+                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                    img.save(file_path)
+            return {'width': img.width, 'height': img.height, 'format': img_format}
+        except Exception as e:
+            print(f"Error processing image {file_path}: {e}")
+            return None
+    
+    def process_images(self, file_paths, max_workers=8, batch_size=32, progress=None, remove_failed=False):
+        """Process many images with batched embedding and a single index and database save.
+
+        Images are decoded in parallel, embedded in batches of `batch_size`,
+        tagged in one pass and added to the index and database together.
+        Returns a result (as from process_image) or None per path. With
+        `remove_failed`, files that could not be processed are deleted.
+        `progress(done, total)` is called after each embedded batch.
+        """
+        results = [None] * len(file_paths)
+        if not file_paths:
+            return results
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            infos = list(executor.map(self._decode, file_paths))
+        readable = [i for i, info in enumerate(infos) if info is not None]
+        
+        model_name = self.index.model_name
+        embedded = self.embed_batches(file_paths, readable, model_name, batch_size, progress)
+        
+        if embedded:
+            with self.index.write_lock:
+                self.index.reload_if_changed()
+                if self.index.model_name != model_name:
+                    # A model migration cut over while these were embedded
+                    model_name = self.index.model_name
+                    embedded = self.embed_batches(file_paths, [i for i, _ in embedded], model_name, batch_size)
+                rel_paths = [self.relative_path(file_paths[i]) for i, _ in embedded]
+                embeddings = np.vstack([embedding for _, embedding in embedded]) if embedded else None
+                added = embedded and self.index.add_images(rel_paths, embeddings, save=False, model_name=model_name)
+                
+                # Embed them with the new model too while a model migration runs
+                shadow = self.index.shadow
+                if added and shadow is not None:
+                    with INGEST_SECONDS.time(stage='embed_shadow'):
+                        shadow_embeddings = shadow.embedder.embed_images([file_paths[i] for i, _ in embedded])
+                    found = [j for j, embedding in enumerate(shadow_embeddings) if embedding is not None]
+                    if found:
+                        shadow.add_images([rel_paths[j] for j in found],
+                                          np.vstack([shadow_embeddings[j] for j in found]), save=False)
+                
+                if added:
+                    with INGEST_SECONDS.time(stage='tag'):
+                        tags = label_vocabulary.for_model(model_name).tag(embeddings)
+                    with INGEST_SECONDS.time(stage='db_add'):
+                        for (i, _), rel_path, image_tags in zip(embedded, rel_paths, tags):
+                            self.db.add_image(rel_path, {**infos[i], **file_fingerprint(file_paths[i])},
+                                              save=False, tags=image_tags)
+                            results[i] = {'path': rel_path, 'width': infos[i]['width'],
+                                          'height': infos[i]['height'], 'success': True}
+                    self.save()
+        
+        if remove_failed:
+            for file_path, result in zip(file_paths, results):
+                if result is None and os.path.exists(file_path):
+                    os.remove(file_path)
+        return results
+        
+    def embed_batches(self, file_paths, positions, model_name, batch_size, progress=None):
+        """(position, embedding) for the files at `positions` that embed with `model_name`"""
+        embedder = get_embedder(model_name)
+        embedded = []
+        for start in range(0, len(positions), batch_size):
+            batch = positions[start:start + batch_size]
+            with INGEST_SECONDS.time(stage='embed'):
+                embeddings = embedder.embed_images([file_paths[i] for i in batch], batch_size=batch_size)
+            embedded += [(i, embedding) for i, embedding in zip(batch, embeddings) if embedding is not None]
+            if progress:
+                progress(min(start + batch_size, len(positions)), len(positions))
+        return embedded
+        
+    def batch_process_directory(self, directory, max_workers=8, progress=None, save_every=100):
+        """Process all images in a directory using multi-threading.
+
+        The index and database are persisted every `save_every` images rather
+        than after each one. `progress(done, total)` is called as images
+        complete and may raise to stop the import; images processed so far
+        are kept.
+        """
         processed = 0
         failed = 0
         
@@ -83,8 +210,9 @@ class ImageProcessor:
         start_time = time.time()
         
         # Process images in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_file = {executor.submit(self.process_image, file): file for file in image_files}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            future_to_file = {executor.submit(self.process_image, file, save=False): file for file in image_files}
             
             for future in concurrent.futures.as_completed(future_to_file):
                 file = future_to_file[future]
@@ -96,28 +224,43 @@ class ImageProcessor:
                         failed += 1
                         
                     # Print progress
-                    progress = (processed + failed) / total * 100
-                    sys.stdout.write(f"\rProgress: {progress:.1f}% ({processed}/{total})")
+                    progress_pct = (processed + failed) / total * 100
+                    sys.stdout.write(f"\rProgress: {progress_pct:.1f}% ({processed}/{total})")
                     sys.stdout.flush()
                 except Exception as e:
                     print(f"Error processing {file}: {e}")
                     failed += 1
+                
+                if (processed + failed) % save_every == 0:
+                    self.save()
+                if progress:
+                    progress(processed + failed, total)
+        finally:
+            # Drop queued images if we are stopping early, then persist
+            # whatever has been processed
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.save()
         
         elapsed_time = time.time() - start_time
         print(f"\nProcessed {processed} images in {elapsed_time:.2f} seconds. Failed: {failed}")
         
         return processed, failed
         
-    def upload_image(self, file_obj, filename):
-        """Process an uploaded image file"""
+    def save_upload(self, file_obj, filename):
+        """Save an uploaded file into the upload directory and return its path"""
         # Secure filename
         secure_name = "".join([c for c in filename if c.isalpha() or c.isdigit() or c in '._- ']).strip()
         timestamp = int(time.time())
         unique_filename = f"{timestamp}_{secure_name}"
         
-        # Save file
+        # Save file, numbering it if a file of the same name arrived this second
         file_path = os.path.join(self.upload_dir, unique_filename)
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        stem, extension = os.path.splitext(file_path)
+        counter = 1
+        while os.path.exists(file_path):
+            file_path = f"{stem}_{counter}{extension}"
+            counter += 1
         
         if hasattr(file_obj, 'save'):
             # For web uploads (Flask)
@@ -127,7 +270,10 @@ class ImageProcessor:
             with open(file_path, 'wb') as f:
                 f.write(file_obj.read())
         
-        # Process image
+        return file_path
+        
+    def process_upload(self, file_path):
+        """Process a saved upload, deleting the file if processing fails"""
         result = self.process_image(file_path)
         if result:
             return result
@@ -137,6 +283,24 @@ class ImageProcessor:
             os.remove(file_path)
             
         return None
+        
+    def upload_image(self, file_obj, filename):
+        """Process an uploaded image file"""
+        file_path = self.save_upload(file_obj, filename)
+        return self.process_upload(file_path)
+        
+    def relative_path(self, file_path):
+        """Get the path under which an image is stored in the index and database"""
+        return os.path.relpath(file_path, start=self.path_root)
+        
+    def absolute_path(self, rel_path):
+        """Get the file behind a path stored in the index and database"""
+        return os.path.normpath(os.path.join(self.path_root, rel_path))
+        
+    def save(self):
+        """Persist the index and database"""
+        self.index.save_index()
+        self.db.save_db()
 
 # Create singleton instance
 image_processor = ImageProcessor() 
\ No newline at end of file
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+import traceback
+from datetime import datetime
+from pathlib import Path
+from utils.filelock import FileLock
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+class JobCancelled(Exception):
+    """Raised inside a job handler once cancellation has been requested"""
+
+class Job:
+    """Handle passed to job handlers for reporting progress"""
+    def __init__(self, job_queue, job_id):
+        self.job_queue = job_queue
+        self.id = job_id
+
+    def update_progress(self, done, total=None, message=None):
+        """Record progress and raise JobCancelled if the job was cancelled.
+
+        Handlers pass this as the `progress` callback of long-running
+        operations, so cancellation takes effect at the next progress step.
+        """
+        updates = {'progress': {'done': done, 'total': total}}
+        if message is not None:
+            updates['message'] = message
+        self.job_queue._update(self.id, updates)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """Raise JobCancelled if cancellation has been requested"""
+        if self.job_queue.is_cancel_requested(self.id):
+            raise JobCancelled()
+
+class JobQueue:
+    def __init__(self, jobs_dir="database/jobs", lanes=None):
+        """Persistent background job queue backed by one JSON file per job.
+
+        Jobs are dispatched to lanes, each with its own worker threads, so
+        short interactive jobs (uploads) are never stuck behind bulk ones
+        (imports, reindexing).
+
+        A queue with role 'client' only records jobs; a 'runner' process
+        (see claim_runner) picks them up from disk and runs them. By default
+        every process is a runner.
+        """
+        self.jobs_dir = jobs_dir
+        self.lanes = lanes or {'interactive': 1, 'bulk': 1}
+        Path(jobs_dir).mkdir(parents=True, exist_ok=True)
+
+        self.handlers = {}
+        self.role = 'runner'
+        self._queues = {lane: queue.Queue() for lane in self.lanes}
+        self._lock = threading.Lock()
+        self._cancelled = set()
+        self._enqueued = set()
+        self._workers = []
+        self._started = False
+        # job_type -> (interval in seconds, params) for periodic jobs
+        self._schedules = {}
+        # Serialises job record updates across processes
+        self._file_lock = FileLock(os.path.join(jobs_dir, ".lock"))
+        # Held for the lifetime of the process that runs jobs
+        self._runner_lock = FileLock(os.path.join(jobs_dir, ".runner.lock"))
+
+    def register(self, job_type, handler, lane='bulk'):
+        """Register a handler called as handler(job, **params)"""
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown job lane: {lane}")
+        self.handlers[job_type] = (handler, lane)
+
+    def schedule(self, job_type, interval, **params):
+        """Submit a job every `interval` seconds once the runner has started.
+
+        A run is skipped while a job of the same type is still queued or
+        running, so slow jobs never pile up.
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        self._schedules[job_type] = (interval, params)
+
+    def claim_runner(self):
+        """Try to become the one process that runs jobs.
+
+        Used when several server processes share the jobs directory: the
+        process holding the runner lock runs jobs, the rest become clients.
+        Returns True if this process is the runner.
+        """
+        if self._runner_lock.acquire(blocking=False):
+            self.role = 'runner'
+            return True
+        self.role = 'client'
+        return False
+
+    def start(self, poll_interval=None):
+        """Start the worker threads and requeue unfinished jobs.
+
+        With `poll_interval`, the jobs directory is rescanned periodically
+        so jobs submitted by client processes get picked up.
+        """
+        with self._lock:
+            if self._started or self.role != 'runner':
+                return
+            self._started = True
+
+        for lane, num_workers in self.lanes.items():
+            for i in range(num_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(lane,),
+                    name=f"job-worker-{lane}-{i}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+        self._recover()
+
+        if poll_interval:
+            poller = threading.Thread(
+                target=self._poll_loop,
+                args=(poll_interval,),
+                name="job-poller",
+                daemon=True
+            )
+            poller.start()
+            self._workers.append(poller)
+
+        if self._schedules:
+            scheduler = threading.Thread(target=self._schedule_loop, name="job-scheduler", daemon=True)
+            scheduler.start()
+            self._workers.append(scheduler)
+
+    def submit(self, job_type, **params):
+        """Queue a job and return its record immediately"""
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+
+        job_id = uuid.uuid4().hex
+        record = {
+            'id': job_id,
+            'type': job_type,
+            'params': params,
+            'status': QUEUED,
+            'progress': {'done': 0, 'total': None},
+            'message': '',
+            'result': None,
+            'error': None,
+            'cancel_requested': False,
+            'pid': os.getpid(),
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+        self._write(record)
+
+        # Client processes leave the job on disk for the runner to pick up
+        if self.role == 'runner':
+            self._enqueue(record)
+        return record
+
+    def get(self, job_id):
+        """Get a job record by ID"""
+        return self._read(job_id)
+
+    def list_jobs(self, status=None, limit=50):
+        """Get the most recent jobs, optionally filtered by status"""
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith('.json'):
+                continue
+            record = self._read(name[:-5])
+            if record and (status is None or record['status'] == status):
+                jobs.append(record)
+        jobs.sort(key=lambda j: j['created_at'], reverse=True)
+        return jobs[:limit] if limit is not None else jobs
+
+    def cancel(self, job_id):
+        """Request cancellation of a job.
+
+        Queued jobs are cancelled immediately; running jobs stop at their
+        next progress update.
+        """
+        with self._file_lock:
+            record = self._read(job_id)
+            if record is None:
+                return None
+            if record['status'] in FINISHED_STATES:
+                return record
+
+            with self._lock:
+                self._cancelled.add(job_id)
+
+            updates = {'cancel_requested': True}
+            if record['status'] == QUEUED:
+                updates.update({'status': CANCELLED, 'finished_at': datetime.now().isoformat()})
+            return self._update(job_id, updates)
+
+    def is_cancel_requested(self, job_id):
+        """Check whether cancellation was requested, possibly by another process"""
+        with self._lock:
+            if job_id in self._cancelled:
+                return True
+        record = self._read(job_id)
+        return bool(record and record.get('cancel_requested'))
+
+    def prune(self, max_age_days=7):
+        """Delete finished job records older than max_age_days"""
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for name in os.listdir(self.jobs_dir):
+            path = os.path.join(self.jobs_dir, name)
+            if not name.endswith('.json') or os.path.getmtime(path) > cutoff:
+                continue
+            record = self._read(name[:-5])
+            if record and record['status'] in FINISHED_STATES:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def _enqueue(self, record):
+        """Hand a job to its lane's workers unless it is already waiting there"""
+        with self._lock:
+            if record['id'] in self._enqueued:
+                return
+            self._enqueued.add(record['id'])
+        _, lane = self.handlers[record['type']]
+        self._queues[lane].put(record['id'])
+
+    def _poll_loop(self, interval):
+        """Pick up jobs submitted by other processes"""
+        while True:
+            time.sleep(interval)
+            try:
+                self._recover()
+            except Exception as e:
+                print(f"Error polling for jobs: {e}")
+
+    def _schedule_loop(self, tick=1.0):
+        """Submit scheduled jobs when they are due"""
+        now = time.time()
+        due = {job_type: now + interval for job_type, (interval, _) in self._schedules.items()}
+        while True:
+            time.sleep(tick)
+            now = time.time()
+            for job_type, (interval, params) in list(self._schedules.items()):
+                if now < due.get(job_type, 0):
+                    continue
+                due[job_type] = now + interval
+                try:
+                    pending = [job for job in self.list_jobs(limit=None)
+                               if job['type'] == job_type and job['status'] in (QUEUED, RUNNING)]
+                    if not pending:
+                        self.submit(job_type, **params)
+                except Exception as e:
+                    print(f"Error submitting scheduled {job_type} job: {e}")
+
+    def _worker_loop(self, lane):
+        """Take jobs from a lane's queue and run them until the process exits"""
+        while True:
+            job_id = self._queues[lane].get()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+            finally:
+                self._queues[lane].task_done()
+
+    def _run(self, job_id):
+        """Run a single job and record its outcome"""
+        with self._lock:
+            self._enqueued.discard(job_id)
+
+        # Claim the job; another process may have run or cancelled it already
+        with self._file_lock:
+            record = self._read(job_id)
+            if record is None or record['status'] != QUEUED:
+                return
+            self._update(job_id, {
+                'status': RUNNING,
+                'pid': os.getpid(),
+                'started_at': datetime.now().isoformat()
+            })
+
+        handler, _ = self.handlers[record['type']]
+        job = Job(self, job_id)
+        try:
+            job.check_cancelled()
+            result = handler(job, **record['params'])
+            updates = {'status': COMPLETED, 'result': result}
+        except JobCancelled:
+            updates = {'status': CANCELLED}
+        except Exception as e:
+            traceback.print_exc()
+            updates = {'status': FAILED, 'error': str(e)}
+
+        updates['finished_at'] = datetime.now().isoformat()
+        self._update(job_id, updates)
+
+        with self._lock:
+            self._cancelled.discard(job_id)
+
+    def _recover(self):
+        """Queue jobs waiting on disk, including those left unfinished by a
+        process that is no longer running"""
+        for name in sorted(os.listdir(self.jobs_dir)):
+            if not name.endswith('.json'):
+                continue
+            record = self._read(name[:-5])
+            if record is None or record['type'] not in self.handlers:
+                continue
+
+            if record['status'] == RUNNING:
+                if _pid_alive(record.get('pid')):
+                    continue
+                print(f"Recovering job {record['id']} ({record['type']})")
+                record = self._update(record['id'], {'status': QUEUED, 'pid': os.getpid()})
+
+            if record['status'] == QUEUED:
+                self._enqueue(record)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _read(self, job_id):
+        """Read a job record from disk"""
+        # Job IDs come from URLs, so only accept plain hex IDs
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._job_path(job_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, record):
+        """Atomically write a job record to disk"""
+        path = self._job_path(record['id'])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def _update(self, job_id, updates):
+        """Apply updates to a job record"""
+        with self._file_lock:
+            record = self._read(job_id)
+            if record is None:
+                return None
+            # Never let a late progress update resurrect a finished job
+            if record['status'] in FINISHED_STATES and 'status' not in updates:
+                return record
+            record.update(updates)
+            self._write(record)
+            return record
+
+def _pid_alive(pid):
+    """Check whether a process with the given PID is running"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+# Create singleton instance
+job_queue = JobQueue()
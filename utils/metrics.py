@@ -0,0 +1,221 @@
+import os
+import time
+import threading
+import functools
+import contextlib
+
+# Default latency buckets in seconds, from 0.5ms to 30s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PREFIX = 'image_retrieval_'
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=None):
+    items = list(key) + list(extra or [])
+    if not items:
+        return ''
+    parts = []
+    for name, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+class Gauge:
+    def __init__(self, name, help_text, fn=None):
+        """Gauge set explicitly, or computed by `fn` at scrape time.
+
+        `fn` returns either a number or a list of (labels, value) pairs.
+        """
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def _samples(self):
+        if self.fn is None:
+            with self._lock:
+                return sorted(self._values.items())
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Error computing metric {self.name}: {e}")
+            return []
+        if isinstance(value, list):
+            return [(_label_key(labels), v) for labels, v in value]
+        return [((), value)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in self._samples():
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # label key -> [bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Context manager that observes the duration of its block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, **labels):
+        """Decorator that observes the duration of each call"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = _format_labels(key, [('le', _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self, prefix=PREFIX):
+        """Process-local metrics rendered in the Prometheus text format.
+
+        Registering a metric that already exists returns the existing one,
+        so modules can declare the metrics they use at import time.
+        """
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        name = self.prefix + name
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text):
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name, help_text, fn=None):
+        return self._register(Gauge, name, help_text, fn=fn)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+def resident_memory_bytes():
+    """Resident set size of this process, or None if unavailable"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    # Fall back to peak RSS where /proc is not available (macOS)
+    try:
+        import resource
+        import sys
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+    except (ImportError, OSError):
+        return None
+
+# Create singleton instance
+metrics = MetricsRegistry()
+
+# Shared metrics, declared here so every module records into the same families
+EMBED_SECONDS = metrics.histogram('embed_seconds', 'Time spent computing CLIP embeddings, by input kind and stage')
+SEARCH_SECONDS = metrics.histogram('search_seconds', 'Time spent in ImageIndex.search, by stage')
+INGEST_SECONDS = metrics.histogram('ingest_seconds', 'Time spent ingesting an image, by stage')
+DB_SECONDS = metrics.histogram('db_seconds', 'Time spent in ImageDatabase operations, by operation')
+HTTP_SECONDS = metrics.histogram('http_request_seconds', 'HTTP request latency, by endpoint, method and status')
+CACHE_REQUESTS = metrics.counter('cache_requests_total', 'Cache lookups, by cache and result (hit or miss)')
+COLLECTION_EVENTS = metrics.counter('collection_events_total', 'Named collections loaded and evicted, by event')
+
+def cache_hit_ratios():
+    """Hit ratio per cache, computed from CACHE_REQUESTS"""
+    caches = {}
+    with CACHE_REQUESTS._lock:
+        for key, value in CACHE_REQUESTS._values.items():
+            labels = dict(key)
+            hits, total = caches.get(labels['cache'], (0, 0))
+            if labels['result'] == 'hit':
+                hits += value
+            caches[labels['cache']] = (hits, total + value)
+    return [({'cache': name}, hits / total) for name, (hits, total) in sorted(caches.items()) if total]
+
+metrics.gauge('cache_hit_ratio', 'Fraction of cache lookups that were hits, by cache', fn=cache_hit_ratios)
+metrics.gauge('process_resident_memory_bytes', 'Resident memory of this process in bytes', fn=resident_memory_bytes)
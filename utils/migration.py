@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+from datetime import datetime
+from models.image_embedder import get_embedder
+from models.index import ImageIndex
+from utils.image_processor import image_processor
+
+class ModelMigration:
+    def __init__(self, processor=None):
+        """Move an index to another embedding model without interrupting search.
+
+        Every indexed image is re-embedded with the new model into a shadow
+        ImageIndex (index_dir/shadow) while searches keep using the live
+        index and its model. Images processed meanwhile are embedded with
+        both models. The shadow is checkpointed as it fills, so a cancelled
+        or interrupted migration resumes where it stopped. Once it has
+        caught up, the live index takes over the new vectors in one save,
+        keeping every image's position, and other processes switch models
+        when they reload it. Works on the index of `processor` (the global
+        image processor by default).
+        """
+        self.processor = processor if processor is not None else image_processor
+        self.index = self.processor.index
+        self.shadow_dir = os.path.join(self.index.index_dir, "shadow")
+        self.state_path = os.path.join(self.index.index_dir, "migration.json")
+
+    def absolute_path(self, rel_path):
+        return self.processor.absolute_path(rel_path)
+
+    def read_state(self):
+        """The unfinished migration's {'model_name', 'from_model', 'started_at', ...}, or None"""
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, state):
+        with open(f"{self.state_path}.tmp", 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(f"{self.state_path}.tmp", self.state_path)
+
+    def status(self):
+        """The live model and the progress of any unfinished migration"""
+        state = self.read_state()
+        if state is not None:
+            shadow = self.index.shadow
+            if shadow is not None:
+                state['embedded'] = len(shadow.image_metadata)
+            state['total'] = len(self.index.image_metadata)
+        return {'model_name': self.index.model_name, 'dimension': self.index.dimension, 'migration': state}
+
+    def discard(self):
+        """Drop an unfinished migration and its shadow index"""
+        self.index.shadow = None
+        shutil.rmtree(self.shadow_dir, ignore_errors=True)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def _open_shadow(self, model_name):
+        """The shadow index, resumed from its last checkpoint if there is one"""
+        # A new model may produce vectors of another size
+        probe = get_embedder(model_name).embed_texts(['a photo'])
+        if probe is None:
+            raise RuntimeError(f"Model {model_name} could not be loaded")
+        return ImageIndex(dimension=probe.shape[1], index_dir=self.shadow_dir,
+                          backend=self.index.backend, model_name=model_name)
+
+    def _embed(self, shadow, paths, failed):
+        """Add the new model's embeddings of paths to the shadow; returns how many were added"""
+        results = shadow.embedder.embed_images([self.absolute_path(path) for path in paths])
+        embedded = [(path, embedding) for path, embedding in zip(paths, results) if embedding is not None]
+        failed.update(path for path, embedding in zip(paths, results) if embedding is None)
+        if not embedded:
+            return 0
+        return shadow.add_images([path for path, _ in embedded],
+                                 np.vstack([embedding for _, embedding in embedded]), save=False)
+
+    def run(self, model_name, batch_size=32, rate=None, checkpoint_interval=30.0, progress=None):
+        """Re-embed the index with `model_name` and cut over; returns a summary.
+
+        `rate` caps the images embedded per second so the migration leaves
+        CPU/GPU time for serving. `progress(done, total)` is called after
+        each batch and may raise to pause the migration; run it again with
+        the same model to resume.
+        """
+        if model_name == self.index.model_name:
+            raise ValueError(f"The index already uses {model_name}")
+
+        state = self.read_state()
+        if state is not None and state['model_name'] != model_name:
+            print(f"Discarding unfinished migration to {state['model_name']}")
+            self.discard()
+            state = None
+        if state is None:
+            state = {
+                'model_name': model_name,
+                'from_model': self.index.model_name,
+                'started_at': datetime.now().isoformat()
+            }
+            self._write_state(state)
+
+        shadow = self._open_shadow(model_name)
+        self.index.shadow = shadow
+        failed = set()
+        embedded = 0
+        try:
+            last_checkpoint = time.monotonic()
+            # Repeat until a pass finds nothing left: images keep arriving while we work
+            while True:
+                with self.index.lock:
+                    live = list(dict.fromkeys(self.index.image_metadata.all_paths()))
+                done = set(shadow.image_metadata.all_paths())
+                todo = [path for path in live if path not in done and path not in failed]
+                if not todo:
+                    break
+
+                for start in range(0, len(todo), batch_size):
+                    batch = todo[start:start + batch_size]
+                    batch_start = time.monotonic()
+                    if progress:
+                        progress(len(live) - len(todo) + start, len(live))
+
+                    embedded += self._embed(shadow, batch, failed)
+
+                    if time.monotonic() - last_checkpoint >= checkpoint_interval:
+                        shadow.save_index()
+                        last_checkpoint = time.monotonic()
+                    if rate:
+                        time.sleep(max(0.0, len(batch) / rate - (time.monotonic() - batch_start)))
+
+            summary = self._cut_over(shadow, model_name, failed)
+            summary['embedded'] = embedded + summary.pop('caught_up')
+            return summary
+        finally:
+            if self.index.shadow is shadow:
+                self.index.shadow = None
+                # Keep the progress for a resumed run
+                if shadow._dirty:
+                    shadow.save_index()
+
+    def _cut_over(self, shadow, model_name, failed):
+        """Swap the shadow's vectors into the live index"""
+        with self.index.write_lock:
+            self.index.reload_if_changed()
+            with self.index.lock:
+                live = self.index.image_metadata.all_paths()
+
+            # Images added since the last pass; normally none or a few
+            positions = shadow.positions_for_paths(live)
+            missing = [path for path, position in zip(live, positions) if position < 0 and path not in failed]
+            caught_up = 0
+            if missing:
+                caught_up = self._embed(shadow, missing, failed)
+                positions = shadow.positions_for_paths(live)
+
+            # Rows in live order, so positions and image ids stay the same;
+            # images whose files could not be read get zero vectors and
+            # never match until they are reindexed
+            found = positions >= 0
+            embeddings = np.zeros((len(live), shadow.dimension), dtype=np.float32)
+            with shadow.lock:
+                embeddings[found] = shadow.image_embeddings[positions[found]]
+            self.index.switch_model(model_name, embeddings)
+
+        self.discard()
+        print(f"Index now uses {model_name}")
+        return {'model_name': model_name, 'images': len(live), 'unreadable': int((~found).sum()), 'caught_up': caught_up}
+
+# Create singleton instance
+model_migration = ModelMigration()
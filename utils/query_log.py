@@ -0,0 +1,102 @@
+"""
+Log of the searches served by /api/search, used to warm up new workers.
+
+Each search is appended as one short JSON line (time, query, imageId,
+weightText, latency in ms and the collection if not the default). The file
+is rotated when it reaches QUERY_LOG_MAX_BYTES, keeping QUERY_LOG_BACKUPS
+older files, so it stays small however long the server runs.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import Counter
+from utils.filelock import FileLock
+
+# Set QUERY_LOG to another path, or to an empty string to turn logging off
+QUERY_LOG = os.environ.get('QUERY_LOG', os.path.join('database', 'query_log.jsonl'))
+QUERY_LOG_MAX_BYTES = int(os.environ.get('QUERY_LOG_MAX_BYTES', 4 * 1024 * 1024))
+QUERY_LOG_BACKUPS = int(os.environ.get('QUERY_LOG_BACKUPS', 2))
+
+class QueryLog:
+    def __init__(self, path=QUERY_LOG, max_bytes=QUERY_LOG_MAX_BYTES, backups=QUERY_LOG_BACKUPS):
+        """Size-rotated log of search queries shared by all server processes"""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{path}.lock") if path else None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def record(self, query, image_id=None, weight_text=None, seconds=None, collection=None):
+        """Append one search to the log"""
+        if not self.enabled:
+            return
+        entry = {'t': int(time.time())}
+        if query:
+            entry['q'] = query
+        if image_id is not None:
+            entry['i'] = image_id
+        if weight_text is not None and query and image_id is not None:
+            entry['w'] = weight_text
+        if seconds is not None:
+            entry['ms'] = round(seconds * 1000, 1)
+        if collection:
+            entry['c'] = collection
+        line = json.dumps(entry, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                # Appends of one short line don't interleave between processes
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                    size = f.tell()
+                if size >= self.max_bytes:
+                    self._rotate()
+        except OSError as e:
+            print(f"Error writing query log: {e}")
+
+    def _rotate(self):
+        with self._file_lock:
+            # Another process may have rotated it already
+            if not os.path.exists(self.path) or os.path.getsize(self.path) < self.max_bytes:
+                return
+            for i in range(self.backups, 0, -1):
+                source = self.path if i == 1 else f"{self.path}.{i - 1}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i}")
+            if self.backups == 0:
+                os.remove(self.path)
+
+    def entries(self):
+        """Every logged search, oldest file first"""
+        if not self.enabled:
+            return
+        paths = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue
+            except OSError:
+                continue
+
+    def top_queries(self, n=100, collection=None):
+        """The `n` most frequent searches in a collection as (query, image_id, weight_text), most frequent first"""
+        counts = Counter(
+            (entry.get('q', ''), entry.get('i'), entry.get('w'))
+            for entry in self.entries()
+            if entry.get('c') == collection and (entry.get('q') or entry.get('i') is not None)
+        )
+        return [key for key, _ in counts.most_common(n)]
+
+# Create singleton instance
+query_log = QueryLog()
@@ -0,0 +1,319 @@
+import os
+import concurrent.futures
+import numpy as np
+from PIL import Image
+from utils.image_processor import image_processor, file_fingerprint
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+class Reconciler:
+    def __init__(self, processor=None):
+        """Bring the index and database back in line with the image files.
+
+        Files on disk, database rows and index entries are matched by path,
+        with content hashes to recognise files that changed or moved. Only
+        what differs is repaired: missing files are embedded in batches,
+        moved files reuse their existing embedding, and orphaned rows and
+        entries are dropped. Everything is committed with one index save and
+        one database save. Works on the upload directory, index and database
+        of `processor` (the global image processor by default).
+        """
+        self.processor = processor if processor is not None else image_processor
+        self.upload_dir = self.processor.upload_dir
+        self.index = self.processor.index
+        self.db = self.processor.db
+
+    def absolute_path(self, rel_path):
+        return self.processor.absolute_path(rel_path)
+
+    def scan_files(self):
+        """Relative paths of all images under the upload directory"""
+        paths = set()
+        for root, _, files in os.walk(self.upload_dir):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.add(self.processor.relative_path(os.path.join(root, name)))
+        return paths
+
+    def plan(self, paths=None):
+        """Work out what needs repairing without changing anything.
+
+        With `paths` (relative image paths), only those images are checked,
+        so the cost is proportional to the number of paths rather than the
+        size of the collection; duplicates are left to full runs.
+        """
+        self.db.reload_if_changed()
+        self.index.reload_if_changed()
+
+        # Upload jobs index their own files; leave those alone
+        skip = {self.processor.relative_path(path) for path in uploads_in_progress()}
+
+        if paths is None:
+            files = self.scan_files()
+            with self.db.lock:
+                rows = list(self.db.get_all_images())
+            with self.index.lock:
+                indexed = self.index.image_metadata.all_paths()
+        else:
+            paths = sorted(set(paths))
+            files = {path for path in paths
+                     if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(self.absolute_path(path))}
+            rows = [row for row in self.db.get_images_by_paths(paths) if row is not None]
+            indexed = [path for path, position in zip(paths, self.index.positions_for_paths(paths)) if position >= 0]
+        if skip:
+            files -= skip
+            rows = [row for row in rows if row['path'] not in skip]
+            indexed = [path for path in indexed if path not in skip]
+
+        # Rows and entries for images imported from outside the upload
+        # directory count as present as long as their file still exists
+        known = {row['path'] for row in rows} | set(indexed)
+        files |= {path for path in known - files if os.path.exists(self.absolute_path(path))}
+
+        row_paths = {}
+        duplicate_rows = []
+        for row in rows:
+            if row['path'] in row_paths:
+                duplicate_rows.append(row)
+            else:
+                row_paths[row['path']] = row
+        index_paths = set(indexed)
+        duplicate_entries = len(indexed) - len(index_paths)
+
+        # Files whose content changed since they were embedded
+        changed = []
+        refresh = {}
+        for path in files & index_paths & set(row_paths):
+            fingerprint = row_paths[path].get('metadata') or {}
+            if 'sha256' not in fingerprint:
+                continue
+            stat = os.stat(self.absolute_path(path))
+            if (stat.st_size, stat.st_mtime_ns) == (fingerprint.get('size'), fingerprint.get('mtime_ns')):
+                continue
+            current = file_fingerprint(self.absolute_path(path))
+            if current['sha256'] != fingerprint['sha256']:
+                changed.append(path)
+            else:
+                refresh[row_paths[path]['id']] = current
+
+        return {
+            'full': paths is None,
+            'files': files,
+            'rows': row_paths,
+            'duplicate_rows': duplicate_rows,
+            'duplicate_entries': duplicate_entries,
+            'missing_from_index': sorted((files - index_paths) | set(changed)),
+            'missing_from_db': sorted(files - set(row_paths)),
+            'orphan_entries': sorted(index_paths - files),
+            'orphan_rows': sorted(set(row_paths) - files),
+            'changed': sorted(changed),
+            'refresh': refresh
+        }
+
+    def reconcile(self, dry_run=False, progress=None, max_workers=8, paths=None, batch_size=32):
+        """Repair the index and database; returns a summary of what was done.
+
+        Files are hashed on `max_workers` threads and embedded in batches of
+        `batch_size`, as ImageProcessor.process_images does.
+        `progress(done, total)` is called after each embedded batch and may
+        raise to abort before anything is committed. `paths` limits the
+        repair to those images (see plan).
+        """
+        plan = self.plan(paths)
+        summary = {
+            'files': len(plan['files']),
+            'db_rows': len(plan['rows']) + len(plan['duplicate_rows']),
+            'index_entries': len(self.index.image_metadata),
+            'missing_from_index': len(plan['missing_from_index']),
+            'missing_from_db': len(plan['missing_from_db']),
+            'orphan_index_entries': len(plan['orphan_entries']),
+            'orphan_db_rows': len(plan['orphan_rows']),
+            'duplicate_db_rows': len(plan['duplicate_rows']),
+            'duplicate_index_entries': plan['duplicate_entries'],
+            'changed_files': len(plan['changed']),
+            'dry_run': dry_run
+        }
+        if dry_run:
+            return summary
+
+        # Scoped runs are frequent (see utils.watcher); don't rewrite the
+        # index and database when the given paths are already in sync
+        pending = ('missing_from_index', 'missing_from_db', 'orphan_entries', 'orphan_rows', 'refresh')
+        if not plan['full'] and not any(plan[key] for key in pending):
+            return summary
+
+        # Files that moved keep their embedding: match new paths to orphaned
+        # index entries by the content hash recorded in the database
+        orphan_by_hash = {}
+        for path in plan['orphan_entries']:
+            row = plan['rows'].get(path)
+            sha = (row.get('metadata') or {}).get('sha256') if row else None
+            if sha:
+                orphan_by_hash[sha] = path
+
+        to_embed = plan['missing_from_index']
+        fingerprints = {}
+        embeddings = {}
+        moved = {}
+        model_name = self.index.model_name
+
+        if to_embed:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                fingerprints = dict(zip(to_embed, executor.map(file_fingerprint, map(self.absolute_path, to_embed))))
+            for path in to_embed:
+                source = orphan_by_hash.get(fingerprints[path]['sha256'])
+                if source is not None:
+                    moved[path] = source
+
+            new = [path for path in to_embed if path not in moved]
+            found = self.processor.embed_batches([self.absolute_path(path) for path in new], range(len(new)),
+                                                 model_name, batch_size, progress)
+            for i, embedding in found:
+                embeddings[new[i]] = embedding.reshape(-1)
+
+        # Embeddings of moved files, read before their old entries are removed
+        if moved:
+            sources = self.index.positions_for_paths(list(moved.values()))
+            with self.index.lock:
+                for (path, _), position in zip(moved.items(), sources):
+                    if position >= 0:
+                        embeddings[path] = np.array(self.index.image_embeddings[position])
+
+        summary.update(self._apply(plan, embeddings, fingerprints, moved, model_name))
+        return summary
+
+    def _revalidate(self, plan, embeddings, moved):
+        """Re-check a plan against the index and database as they are now.
+
+        Called with both locked and reloaded, so that images another process
+        (or an upload job) added or removed since the plan was made are not
+        removed again or given a second row.
+        """
+        skip = {self.processor.relative_path(path) for path in uploads_in_progress()}
+
+        def gone(path):
+            return path not in skip and not os.path.exists(self.absolute_path(path))
+
+        paths = sorted(set(plan['rows']) | set(plan['missing_from_db']) | set(moved) | set(moved.values()))
+        rows = {path: row for path, row in zip(paths, self.db.get_images_by_paths(paths)) if row is not None}
+        embeddings = {path: embedding for path, embedding in embeddings.items() if path not in skip}
+        moved = {path: source for path, source in moved.items() if path in embeddings}
+        plan = dict(
+            plan,
+            rows=rows,
+            orphan_entries=[path for path in plan['orphan_entries'] if gone(path)],
+            orphan_rows=[path for path in plan['orphan_rows'] if path in rows and gone(path)],
+            missing_from_db=[path for path in plan['missing_from_db'] if path not in rows and path not in skip],
+            changed=[path for path in plan['changed'] if path in rows and path not in skip],
+            refresh={row_id: fingerprint for row_id, fingerprint in plan['refresh'].items()
+                     if self.db.get_image(row_id) is not None}
+        )
+        return plan, embeddings, moved
+
+    def _apply(self, plan, embeddings, fingerprints, moved, model_name):
+        """Commit the repairs with one index save and one database save.
+
+        Both stores stay locked from reloading to saving, so nothing saved
+        by another process in between is overwritten.
+        """
+        with self.index.write_lock, self.db.transaction():
+            self.index.reload_if_changed()
+            if self.index.model_name != model_name:
+                raise RuntimeError(f"Index switched to {self.index.model_name} while reconciling; run it again")
+            plan, embeddings, moved = self._revalidate(plan, embeddings, moved)
+            return self._commit(plan, embeddings, fingerprints, moved)
+
+    def _commit(self, plan, embeddings, fingerprints, moved):
+        renumbered = self.db.renumber_duplicate_ids() if plan['full'] else 0
+
+        # Index: drop orphans, duplicates and stale versions of changed files,
+        # then add the new embeddings
+        stale = set(plan['orphan_entries']) | set(plan['changed'])
+        removed_entries = self.index.remove_images(sorted(stale), save=False) if stale else 0
+        if plan['full']:
+            removed_entries += self._remove_duplicate_entries()
+
+        present = self.index.positions_for_paths(list(embeddings))
+        new_paths = [path for path, position in zip(embeddings, present) if position < 0]
+        added = self.index.add_images(new_paths, np.array([embeddings[p] for p in new_paths]), save=False) if new_paths else 0
+
+        # Database: move rows of moved files, drop orphaned and duplicate
+        # rows, refresh fingerprints and add rows for new files
+        updates = {}
+        moved_rows = {}
+        for path, source in moved.items():
+            row = plan['rows'].get(source)
+            if row is not None and path not in plan['rows'] and source not in moved_rows:
+                moved_rows[source] = path
+                updates[row['id']] = {'path': path, 'metadata': {**(row.get('metadata') or {}), **fingerprints[path]}}
+        for row_id, fingerprint in plan['refresh'].items():
+            updates[row_id] = {'metadata': {**(self.db.get_image(row_id).get('metadata') or {}), **fingerprint}}
+        for path in plan['changed']:
+            row = plan['rows'][path]
+            if path in fingerprints:
+                updates[row['id']] = {'metadata': {**(row.get('metadata') or {}), **fingerprints[path]}}
+
+        orphan_rows = [plan['rows'][path]['id'] for path in plan['orphan_rows'] if path not in moved_rows]
+        # Ids are read now, after any renumbering
+        deleted = self.db.delete_images(orphan_rows + [row['id'] for row in plan['duplicate_rows']], save=False)
+        updated = self.db.update_images(updates, save=False)
+
+        moved_into = set(moved_rows.values())
+        new_rows = [path for path in plan['missing_from_db'] if path in embeddings and path not in moved_into]
+        tags = self.index.labels.tag(np.array([embeddings[p] for p in new_rows])) if new_rows else []
+        for path, image_tags in zip(new_rows, tags):
+            self.db.add_image(path, {**self._image_info(path), **fingerprints[path]}, save=False, tags=image_tags)
+
+        self.index.save_index()
+        self.db.save_db()
+        return {
+            'embedded': len([p for p in embeddings if p not in moved]),
+            'moved': len(moved),
+            'index_added': added,
+            'index_removed': removed_entries,
+            'db_added': len(new_rows),
+            'db_removed': len(deleted),
+            'db_updated': updated,
+            'db_renumbered': renumbered
+        }
+
+    def _remove_duplicate_entries(self):
+        """Drop all but one index entry for each path"""
+        removed = 0
+        while True:
+            paths = self.index.image_metadata.all_paths()
+            seen = set()
+            duplicates = {path for path in paths if path in seen or seen.add(path)}
+            if not duplicates:
+                return removed
+            # Each pass removes one copy of every duplicated path
+            count = self.index.remove_images(sorted(duplicates), save=False)
+            if count == 0:
+                return removed
+            removed += count
+
+    def _image_info(self, path):
+        try:
+            with Image.open(self.absolute_path(path)) as img:
+                return {'width': img.width, 'height': img.height, 'format': img.format}
+        except Exception as e:
+            print(f"Error reading image {path}: {e}")
+            return {}
+
+def uploads_in_progress():
+    """Absolute paths of files saved by /api/upload whose upload job hasn't finished.
+
+    Those jobs index the files themselves, so the reconciler and the
+    watcher leave them alone.
+    """
+    from utils.jobs import job_queue, QUEUED, RUNNING
+
+    return {
+        os.path.abspath(file_path)
+        for job in job_queue.list_jobs(limit=None)
+        if job['type'] in ('upload', 'upload_batch') and job['status'] in (QUEUED, RUNNING)
+        for file_path in job['params'].get('file_paths', [job['params'].get('file_path', '')])
+    }
+
+# Create singleton instance
+reconciler = Reconciler()
@@ -0,0 +1,24 @@
+import json
+import numpy as np
+
+# orjson is several times faster than the standard library for large
+# result lists and serialises NumPy values natively; it is optional
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def _default(value):
+    """Convert NumPy values the standard json module doesn't know about"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(payload):
+    """Serialise a response payload to compact JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, separators=(',', ':'), default=_default).encode('utf-8')
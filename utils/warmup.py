@@ -0,0 +1,112 @@
+"""
+Warm up a server process by replaying the most frequent logged searches.
+
+A fresh process starts with empty text-embedding caches and index files
+that are not yet in the OS page cache, so its first users wait. The warmer
+embeds the top WARMUP_QUERIES queries from the query log in one batch and
+runs each search once, at startup and again whenever a collection's index
+generation changes (a reload, reindex or model switch). /api/status reports
+the process ready once the startup warm-up has finished.
+"""
+
+import os
+import time
+import threading
+from utils.collection_manager import collection_manager as default_manager, DEFAULT_COLLECTION
+from utils.query_log import query_log as default_query_log
+
+# Number of logged searches replayed (0 disables warm-up)
+WARMUP_QUERIES = int(os.environ.get('WARMUP_QUERIES', 100))
+
+class Warmer:
+    def __init__(self, manager=None, log=None, num_queries=WARMUP_QUERIES, k=20, interval=5.0, min_interval=60.0):
+        """Replay logged searches against every loaded collection.
+
+        Generations are checked every `interval` seconds; a collection is
+        warmed again at most every `min_interval` seconds, so a stream of
+        uploads (each of which saves a new generation) doesn't keep the
+        process busy replaying queries.
+        """
+        self.manager = manager if manager is not None else default_manager
+        self.log = log if log is not None else default_query_log
+        self.num_queries = num_queries
+        self.k = k
+        self.interval = interval
+        self.min_interval = min_interval
+        self._warmed = {}
+        self._last = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        if num_queries <= 0 or not self.log.enabled:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def status(self):
+        """Whether the startup warm-up is done, and the last warm-up's summary"""
+        return {'ready': self.ready, 'last': self._last}
+
+    def start(self):
+        """Warm up in a background thread, then keep watching for new generations"""
+        with self._start_lock:
+            if self._thread is not None or self.num_queries <= 0 or not self.log.enabled:
+                return
+            self._thread = threading.Thread(target=self.run, name='warmer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error warming up: {e}")
+            self._ready.set()
+            self._stop.wait(self.interval)
+
+    def check(self):
+        """Warm every loaded collection whose index generation changed since it was last warmed"""
+        now = time.monotonic()
+        for collection in self.manager.loaded():
+            generation, warmed_at = self._warmed.get(collection.name, (None, None))
+            if generation == collection.index.generation:
+                continue
+            if warmed_at is not None and now - warmed_at < self.min_interval:
+                continue
+            self.warm_up(collection)
+
+    def warm_up(self, collection):
+        """Replay the collection's most frequent searches; returns the summary"""
+        index = collection.index
+        generation = index.generation
+        start = time.perf_counter()
+        queries = self.log.top_queries(self.num_queries, None if collection.name == DEFAULT_COLLECTION else collection.name)
+
+        # One batch fills the text embedding cache for all of them
+        texts = list(dict.fromkeys(query for query, _, _ in queries if query))
+        if texts:
+            index.embedder.embed_texts(texts, cache=True)
+
+        # Searching touches the index and embedding pages the queries need
+        for query, image_id, weight_text in queries:
+            index.search(query, self.k, image_id, weight_text if weight_text is not None else 0.7)
+
+        self._warmed[collection.name] = (generation, time.monotonic())
+        self._last = {
+            'collection': collection.name,
+            'generation': generation,
+            'queries': len(queries),
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+        if queries:
+            print(f"Warmed up {collection.name} with {len(queries)} queries in {self._last['seconds']}s")
+        return self._last
+
+# Create singleton instance
+warmer = Warmer()
@@ -0,0 +1,257 @@
+"""
+Watch the upload directory and keep the index and database in step with it.
+
+Files copied in by rsync, other services or by hand are picked up without
+a full reindex: file events are collected until the directory has been
+quiet for a debounce period, then only the paths that changed go through
+Reconciler.reconcile(paths=...), which embeds new and changed images in
+one batch, reuses the embeddings of moved ones and drops deleted ones with
+a single index and database save.
+
+Events come from inotify on Linux. Elsewhere, or if inotify can't be set
+up, the directory is polled for size and modification time changes.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from utils.reconciler import reconciler as default_reconciler, uploads_in_progress, IMAGE_EXTENSIONS
+
+# Set WATCH_UPLOADS=1 to run the watcher in the server's job runner process
+WATCH_UPLOADS = os.environ.get('WATCH_UPLOADS', '').lower() in ('1', 'true', 'yes')
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Files are reported once fully written (IN_CLOSE_WRITE) or moved into place
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+def is_image(path):
+    name = os.path.basename(path)
+    # rsync and most copy tools write to hidden temporary files first
+    return not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS)
+
+class InotifySource:
+    def __init__(self, directory):
+        """Recursive inotify watch on a directory (Linux only; raises OSError otherwise)"""
+        self.directory = directory
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        self._add_tree(directory)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return
+        self._dirs[wd] = directory
+
+    def _add_tree(self, directory):
+        """Watch a directory and its subdirectories; returns the images already in them"""
+        found = set()
+        for root, dirs, files in os.walk(directory):
+            self._add_watch(root)
+            found.update(os.path.join(root, name) for name in files if is_image(name))
+        return found
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds for events.
+
+        Returns (paths, rescan): the image paths that changed, and whether
+        events were lost and the whole directory must be rechecked.
+        """
+        paths = set()
+        rescan = False
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return paths, rescan
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return paths, rescan
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            directory = self._dirs.get(wd)
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if directory is None or mask & IN_DELETE_SELF:
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files can land in a new directory before it is watched
+                    paths |= self._add_tree(path)
+                elif mask & IN_MOVED_FROM:
+                    # Images inside a directory moved away get no events of
+                    # their own (deleting one reports each file first)
+                    rescan = True
+            elif is_image(name) and not mask & IN_CREATE:
+                paths.add(path)
+        return paths, rescan
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingSource:
+    def __init__(self, directory, interval=5.0):
+        """Detect changes by comparing the size and mtime of every image between scans"""
+        self.directory = directory
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if is_image(name):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds for the next scan; returns (paths, rescan) like InotifySource"""
+        wait = self._next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set(), False
+        time.sleep(max(wait, 0))
+        self._next_scan = time.monotonic() + self.interval
+
+        snapshot = self._scan()
+        previous = self._snapshot
+        self._snapshot = snapshot
+        changed = {path for path, state in snapshot.items() if previous.get(path) != state}
+        return changed | (previous.keys() - snapshot.keys()), False
+
+    def close(self):
+        pass
+
+class UploadWatcher:
+    def __init__(self, reconciler=None, debounce=2.0, max_delay=30.0, poll_interval=5.0, use_inotify=True):
+        """Index files that appear in, change in or vanish from an upload directory.
+
+        Changes are applied once no event has arrived for `debounce`
+        seconds, or `max_delay` seconds after the first pending event while
+        files keep arriving. Works on the directory, index and database of
+        `reconciler` (the default collection's by default).
+        """
+        self.reconciler = reconciler if reconciler is not None else default_reconciler
+        self.directory = self.reconciler.upload_dir
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.source = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _open_source(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.use_inotify:
+            try:
+                return InotifySource(self.directory)
+            except OSError as e:
+                print(f"inotify unavailable ({e}); polling {self.directory} every {self.poll_interval}s")
+        return PollingSource(self.directory, self.poll_interval)
+
+    def start(self):
+        """Watch in a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name='upload-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        """Watch until stop() is called"""
+        self.source = self._open_source()
+        print(f"Watching {self.directory} for new, changed and removed images ({type(self.source).__name__})")
+        pending = set()
+        rescan = False
+        first_event = last_event = None
+        try:
+            while not self._stop.is_set():
+                paths, overflow = self.source.read(timeout=min(self.debounce, 1.0))
+                now = time.monotonic()
+                if paths or overflow:
+                    pending |= paths
+                    rescan = rescan or overflow
+                    first_event = first_event or now
+                    last_event = now
+
+                if first_event is None:
+                    continue
+                if now - last_event >= self.debounce or now - first_event >= self.max_delay:
+                    self.flush(None if rescan else pending)
+                    pending, rescan = set(), False
+                    first_event = last_event = None
+        finally:
+            self.source.close()
+
+    def flush(self, paths):
+        """Apply a batch of changed paths (None rechecks the whole directory); returns the summary"""
+        try:
+            if paths is not None:
+                in_progress = uploads_in_progress()
+                paths = [self.reconciler.processor.relative_path(path) for path in paths
+                         if os.path.abspath(path) not in in_progress]
+                if not paths:
+                    return None
+            summary = self.reconciler.reconcile(paths=paths)
+        except Exception as e:
+            print(f"Error indexing watched changes: {e}")
+            return None
+
+        changes = {key: value for key, value in summary.items()
+                   if key in ('embedded', 'moved', 'index_removed', 'db_removed', 'db_updated') and value}
+        if changes:
+            print(f"Indexed watched changes: {', '.join(f'{key} {value}' for key, value in changes.items())}")
+        return summary
+
+# Create singleton instance
+upload_watcher = UploadWatcher(debounce=float(os.environ.get('WATCH_DEBOUNCE', 2.0)))